@@ -1,6 +1,6 @@
 import sys
 from components.updater.updater import updater
-from machine import Pin
+from machine import Pin, reset
 from components.led_control import LEDControl
 from lib.logging import getLogger, handlers, basicConfig, INFO, StreamHandler
 
@@ -27,9 +27,12 @@ def boot():
         uart_tx=4,
         uart_rx=5,
     )
-    update_instance.start_update()
+    updated = update_instance.start_update()
     led_control_instance.stop_blinking()
     logger_boot.info("Application completed")
+    if updated:
+        # the new version is in another slot: it runs from the next boot
+        reset()
 
 
 try:
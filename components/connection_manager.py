@@ -32,6 +32,9 @@ def connect_process(esp_process, attempt=0, logger_connection_manager=None):
 
     timeout_seconds = 30
     esp_process.initialized = None
+    if attempt == 0:
+        baudrate = esp_process.negotiate_baudrate()
+        logger_connection_manager.info("ESP baudrate: " + str(baudrate))
     if attempt == 0 and esp_process.is_wifi_connected():
         logger_connection_manager.info("ESP already connected")
         esp_process.initialized = True
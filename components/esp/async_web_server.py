@@ -0,0 +1,261 @@
+import time
+
+import uasyncio as asyncio
+
+from components.esp.command_scheduler import command_scheduler
+from components.esp.http_link import http_link
+from components.esp.web_server import web_server
+
+
+class async_web_server(web_server):
+    """
+    web_server driven by uasyncio. The UART is read through a stream reader,
+    so waiting on the ESP yields to the other tasks of the event loop
+    instead of spinning, and the server needs no thread of its own.
+
+    The blocking methods inherited from web_server (joining the network,
+    starting the server) are meant for setup before the loop starts; once
+    it runs, use the coroutines below; send_web_file, send_ok_response,
+    send_404_response and service_links keep their names but are
+    coroutines here. All of them go through one command_scheduler, so
+    exchanges never interleave and replies to clients go before
+    housekeeping.
+
+    To serve several clients at once, queue the responses (queue_web_file,
+    queue_ok_response, queue_404_response) and await service_links between
+    calls to receive_frame: every link then sends one payload per round.
+    """
+
+    RECEIVE_SLICE = 0.02
+
+    def __init__(self, wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate=None):
+        super().__init__(wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate)
+        self.reader = asyncio.StreamReader(self.uart)
+        self.writer = asyncio.StreamWriter(self.uart, {})
+        self.scheduler = command_scheduler()
+
+    async def send_command(
+        self,
+        at_command,
+        terminators=None,
+        timeout=10,
+        priority=command_scheduler.COMMAND,
+    ):
+        """
+        Send an AT command and return its decoded response, or "ERROR".
+        """
+        async with self.scheduler.claim(priority):
+            return await self._command(at_command, terminators, timeout)
+
+    async def receive_frame(self, timeout=None):
+        """
+        Wait for a complete request on any link and return (headers, body,
+        conn_id), or (None, None, None) when timeout seconds pass first.
+
+        The UART is claimed at housekeeping priority for RECEIVE_SLICE
+        seconds at a time, so queued commands run in between.
+        """
+        start_time = time.ticks_ms()
+        if timeout == 0:
+            # only what the exchanges so far brought in
+            async with self.scheduler.claim(command_scheduler.HOUSEKEEPING):
+                self._fill_rx_buffer()
+                self._process_rx_buffer()
+        while timeout != 0 and not self._has_request():
+            async with self.scheduler.claim(command_scheduler.HOUSEKEEPING):
+                self._response_length = 0
+                self._line_start = 0
+                try:
+                    await asyncio.wait_for(
+                        self._wait_for_request(), self.RECEIVE_SLICE
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            elapsed = time.ticks_diff(time.ticks_ms(), start_time)
+            if timeout is not None and elapsed >= timeout * 1000:
+                break
+        if not self._has_request():
+            return None, None, None
+        return self._pop_request()
+
+    async def send_response(
+        self, conn_id, response, priority=command_scheduler.RESPONSE
+    ):
+        """
+        Send a payload (bytes, or str sent as UTF-8) on a link, in segments
+        of at most MAX_SEND_LENGTH bytes. Returns True once the ESP took all
+        of them; with AT+CIPSENDBUF that is before the peer acknowledged
+        them, see wait_sent.
+        """
+        buffered = bool(self.send_buffered)
+        view = memoryview(self._to_bytes(response))
+        for start in range(0, len(view), self.MAX_SEND_LENGTH):
+            segment = view[start : start + self.MAX_SEND_LENGTH]
+            async with self.scheduler.claim(priority):
+                ret_data = await self._command(
+                    self._send_request(conn_id, len(segment), buffered),
+                    terminators=self.PROMPT_RESPONSES,
+                )
+                if "> " not in ret_data:
+                    self.logger_wifi_server.critical(
+                        "Failed to send HTTP response: " + ret_data
+                    )
+                    return False
+                self.writer.write(segment)
+                await self.writer.drain()
+                received, terminators = self._send_confirmation(
+                    len(segment), buffered
+                )
+                ret_data = str(await self._read_response_async(terminators), "utf-8")
+                if not self._segment_sent(conn_id, ret_data, received, buffered):
+                    return False
+        return True
+
+    async def wait_sent(self, conn_id, timeout=10, priority=command_scheduler.RESPONSE):
+        """
+        Wait until the peer acknowledged the buffered segments of the link.
+        """
+        async with self.scheduler.claim(priority):
+            self._response_length = 0
+            self._line_start = 0
+            try:
+                await asyncio.wait_for(self._wait_for_acks(conn_id), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._all_sent(conn_id)
+
+    async def send_web_file(self, conn_id, html_file_path):
+        html_content = self._read_web_file(html_file_path)
+        if html_content is None:
+            await self.send_404_response(conn_id)
+            return False
+
+        self._queue_response(conn_id, self._web_file_parts(html_content))
+        if not await self._flush_link(conn_id):
+            return False
+
+        self.logger_wifi_server.info("Final chunk sent.")
+        return True
+
+    async def send_ok_response(self, conn_id):
+        self.queue_ok_response(conn_id)
+        return await self._flush_link(conn_id)
+
+    async def send_404_response(self, conn_id):
+        self.queue_404_response(conn_id)
+        return await self._flush_link(conn_id)
+
+    async def service_links(self):
+        """
+        Coroutine counterpart of web_server.service_links.
+        """
+        for conn_id in sorted(self.links):
+            link = self.links.get(conn_id)
+            if link is not None:
+                await self._service_link(link)
+        return self.is_responding()
+
+    async def _service_link(self, link):
+        sent = True
+        if link.state == http_link.RESPONDING:
+            payload = link.next_payload()
+            if payload is not None and not await self.send_response(
+                link.conn_id, payload
+            ):
+                self.logger_wifi_server.error("Failed to send chunk. ")
+                link.state = http_link.CLOSING
+                sent = False
+        if link.state == http_link.CLOSING:
+            if not await self.wait_sent(link.conn_id):
+                self.logger_wifi_server.error("Chunks not acknowledged. ")
+                sent = False
+            await self.close_link(link.conn_id)
+            self._close_link_state(link)
+        return sent
+
+    async def _flush_link(self, conn_id):
+        link = self.links.get(conn_id)
+        sent = link is not None
+        while sent and link.state in (http_link.RESPONDING, http_link.CLOSING):
+            sent = await self._service_link(link)
+        return sent
+
+    async def close_link(self, conn_id):
+        ret_data = await self.send_command("AT+CIPCLOSE={}".format(conn_id))
+        if self.ESP8266_OK_STATUS not in ret_data:
+            self.logger_wifi_server.error("Failed to close connection.")
+            return False
+        return True
+
+    async def _command(
+        self, at_command, terminators=None, timeout=10, attempts=10
+    ):
+        """
+        One exchange on the claimed UART. A busy reply means the command was
+        not run, so it is sent again after a growing delay.
+        """
+        data = (at_command + self.line_separator).encode()
+
+        step = 0
+        while step < attempts:
+            self.logger.debug("AT command: %s", at_command)
+            self.writer.write(data)
+            await self.writer.drain()
+            response = str(
+                await self._read_response_async(terminators, timeout), "utf-8"
+            )
+            try:
+                response_str = self._validate_response(response)
+            except Exception as e:
+                self.logger.error("Validation error: %s", str(e))
+                return self.ESP8266_ERROR_STATUS
+            if response_str != self.ESP8266_BUSY_STATUS:
+                return response_str
+            self.busy_retries += 1
+            await asyncio.sleep_ms(self._busy_delay(step))
+            step += 1
+        return self.ESP8266_ERROR_STATUS
+
+    async def _read_response_async(self, terminators=None, timeout=10):
+        """
+        Coroutine counterpart of _read_response.
+        """
+        if terminators is None:
+            terminators = self.FINAL_RESPONSES
+        self._response_length = 0
+        self._line_start = 0
+        try:
+            await asyncio.wait_for(self._wait_for_terminator(terminators), timeout)
+        except asyncio.TimeoutError:
+            self.logger.debug("AT response timeout")
+        return self._response_view[: self._response_length]
+
+    async def _wait_for_terminator(self, terminators):
+        while not self._process_rx_buffer(terminators):
+            await self._fill_rx_buffer_async()
+
+    async def _wait_for_acks(self, conn_id):
+        while True:
+            self._process_rx_buffer()
+            if not self._unacked.get(conn_id):
+                return
+            await self._fill_rx_buffer_async()
+
+    async def _wait_for_request(self):
+        while True:
+            self._process_rx_buffer()
+            if self._has_request():
+                return
+            await self._fill_rx_buffer_async()
+
+    async def _fill_rx_buffer_async(self):
+        """
+        Read into the free space of the ring buffer, waiting in the event
+        loop until at least one byte is there. Only what the UART already
+        holds is requested, so the read itself never blocks.
+        """
+        span = self.rx_buffer.writable()
+        nbytes = max(1, min(len(span), self.uart.any()))
+        count = await self.reader.readinto(span[:nbytes])
+        self.rx_buffer.commit(count)
+        return count
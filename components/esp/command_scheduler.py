@@ -0,0 +1,87 @@
+import time
+
+import uasyncio as asyncio
+
+
+class command_scheduler:
+    """
+    Single owner of the ESP UART for uasyncio tasks.
+
+    A task claims the UART for one exchange (a command and its response, or
+    CIPSEND and its payload) and gives it back afterwards. While it is
+    taken, other claims wait in priority order, lowest value first and in
+    arrival order within a priority, so a reply to a client never queues
+    behind a connectivity probe.
+    """
+
+    RESPONSE = 0
+    COMMAND = 1
+    HOUSEKEEPING = 2
+
+    def __init__(self):
+        self._owned = False
+        self._queue = []
+        self._sequence = 0
+        self.stats = {
+            "claims": 0,
+            "waits": 0,
+            "max_depth": 0,
+            "wait_ms": 0,
+            "max_wait_ms": 0,
+        }
+
+    def claim(self, priority=COMMAND):
+        """
+        Use as ``async with scheduler.claim(priority):``.
+        """
+        return _claim(self, priority)
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    async def acquire(self, priority=COMMAND):
+        start_time = time.ticks_ms()
+        if self._owned:
+            entry = (priority, self._sequence, asyncio.Event())
+            self._sequence += 1
+            self._queue.append(entry)
+            self._queue.sort()
+            if len(self._queue) > self.stats["max_depth"]:
+                self.stats["max_depth"] = len(self._queue)
+            try:
+                await entry[2].wait()
+            except asyncio.CancelledError:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                else:
+                    self.release()
+                raise
+            waited = time.ticks_diff(time.ticks_ms(), start_time)
+            self.stats["waits"] += 1
+            self.stats["wait_ms"] += waited
+            if waited > self.stats["max_wait_ms"]:
+                self.stats["max_wait_ms"] = waited
+        self._owned = True
+        self.stats["claims"] += 1
+
+    def release(self):
+        """
+        Hand the UART to the first queued claim, if any.
+        """
+        if self._queue:
+            self._queue.pop(0)[2].set()
+        else:
+            self._owned = False
+
+
+class _claim:
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.priority)
+        return self.scheduler
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler.release()
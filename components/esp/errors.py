@@ -28,6 +28,11 @@ class http_response_invalid(Exception):
         super().__init__("Invalid HTTP response", str(response))
 
 
+class http_response_empty(http_response_invalid):
+    def __init__(self):
+        super().__init__("Empty response")
+
+
 class http_response_parse_invalid(Exception):
     def __init__(self, original_exception, response):
         super().__init__(
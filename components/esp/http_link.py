@@ -0,0 +1,89 @@
+class http_link:
+    """
+    State of one link (connection id 0-4) of the web server. The +IPD
+    payload of the link feeds the request; once the server queued a
+    response, it is sent one payload at a time, taking turns with the other
+    links, and the link is closed or waits for the next request.
+
+        IDLE -> RECEIVING -> READY -> HANDLING -> RESPONDING -> CLOSING -> CLOSED
+          ^                                            |
+          +-------------------- (keep open) -----------+
+    """
+
+    IDLE = 0  # connected, no request yet
+    RECEIVING = 1  # part of the request headers arrived
+    READY = 2  # the headers are complete, waiting for the server
+    HANDLING = 3  # the server took the request
+    RESPONDING = 4  # response payloads left to send
+    CLOSING = 5  # response sent, the link is to be closed
+    CLOSED = 6
+    REQUEST_END = b"\r\n\r\n"
+
+    def __init__(self, conn_id):
+        self.conn_id = conn_id
+        self.state = self.IDLE
+        self.request = bytearray()
+        self._matched = 0
+        self._payloads = None
+        self._close = True
+
+    def feed(self, data):
+        """
+        Append received payload to the request and note when the blank
+        line ending the headers arrives. Returns True when the request just
+        became complete.
+        """
+        self.request.extend(data)
+        if self.state not in (self.IDLE, self.RECEIVING):
+            return False
+        self.state = self.RECEIVING
+        matched = self._matched
+        for index in range(len(data)):
+            byte = data[index]
+            if byte == self.REQUEST_END[matched]:
+                matched += 1
+            elif byte == 0x0D:
+                matched = 1
+            else:
+                matched = 0
+            if matched == len(self.REQUEST_END):
+                self._matched = 0
+                self.state = self.READY
+                return True
+        self._matched = matched
+        return False
+
+    def take_request(self):
+        """
+        The complete request as a str, for the server to handle.
+        """
+        request = str(self.request, "utf-8")
+        self.request = bytearray()
+        self.state = self.HANDLING
+        return request
+
+    def respond(self, payloads, close=True):
+        """
+        Queue the response, an iterable of payloads of at most one CIPSEND
+        each. With close, the link is closed once they are sent.
+        """
+        self._payloads = iter(payloads)
+        self._close = close
+        self.state = self.RESPONDING
+
+    def next_payload(self):
+        """
+        The next payload to send, or None once the response is complete.
+        """
+        payload = next(self._payloads, None)
+        if payload is None:
+            self._payloads = None
+            if self._close:
+                self.state = self.CLOSING
+            else:
+                self.state = self.IDLE
+                if self.request:
+                    # a request that arrived meanwhile
+                    pending, self.request = self.request, bytearray()
+                    self.feed(pending)
+        return payload
@@ -0,0 +1,85 @@
+from components.esp.response_parser import http_response_reader
+
+
+class http_stream(http_response_reader):
+    """
+    http_response_reader that hands the body of a 200 response to sink (a
+    callable taking a memoryview, such as the write of an open file)
+    through a buffer of buffer_size bytes, so however long the body, it
+    takes no more memory than that.
+
+    With an offset, the sink already has that many bytes of the body and
+    a 206 response to a Range request starting there carries the rest; a
+    server that ignored the Range header sends a 200 whose first offset
+    bytes are dropped.
+    """
+
+    def __init__(self, sink, buffer_size=1024, offset=0):
+        super().__init__(self._store)
+        self.sink = sink
+        self.offset = offset
+        self._skip = offset
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._buffered = 0
+
+    def accepted(self):
+        """
+        Whether the response is the body asked for, from offset on.
+        """
+        if self.status_code == 206:
+            return self._range_start() == self.offset
+        return self.status_code == 200
+
+    def buffer_space(self):
+        """
+        The free part of the body buffer, for a reader to fill in place
+        before calling commit. Only while raw_body().
+        """
+        return self._view[self._buffered :]
+
+    def commit(self, count):
+        """
+        Account for count body bytes written into buffer_space().
+        """
+        self._stored(count)
+        self._advance(count)
+
+    def finish(self):
+        """
+        Hand what is left in the buffer to the sink.
+        """
+        self._flush()
+
+    def _store(self, view):
+        while len(view):
+            space = self.buffer_space()
+            count = min(len(space), len(view))
+            space[:count] = view[:count]
+            self._stored(count)
+            view = view[count:]
+
+    def _stored(self, count):
+        self._buffered += count
+        if self._buffered == len(self._buffer):
+            self._flush()
+
+    def _flush(self):
+        view = self._view[: self._buffered]
+        self._buffered = 0
+        if self._skip and self.status_code == 200:
+            count = min(self._skip, len(view))
+            self._skip -= count
+            view = view[count:]
+        if len(view) and self.accepted():
+            self.sink(view)
+
+    def _range_start(self):
+        # Content-Range: bytes <first>-<last>/<length>
+        for key, value in self.header.items():
+            if key.lower() == "content-range":
+                try:
+                    return int(value.split()[1].split("-")[0])
+                except (IndexError, ValueError):
+                    return None
+        return None
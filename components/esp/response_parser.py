@@ -1,5 +1,4 @@
 import ujson
-import ure
 from components.esp.errors import http_response_parse_invalid
 from lib.logging import getLogger, handlers, StreamHandler
 import ustruct
@@ -16,53 +15,45 @@ class response_parser:
         self.line_separator_raw = r"\r" + r"\n"
 
     def parse_http(self, http_res, parse=False):
+        """
+        Parse a complete HTTP response, as collected from the +IPD payload
+        of its link, into (headers, body, status_code). The body ends where
+        Content-Length or the chunk framing says; a chunked body is decoded.
+        """
         if http_res == None:
             return None, None, None
+        if isinstance(http_res, str):
+            http_res = http_res.encode("utf-8")
+        body = bytearray()
+        reader = http_response_reader(body.extend)
         try:
-            partition_separator = "IP" + "D"
-            sub_separator = r"\+" + partition_separator + r",\d+:"
-            http_res = http_res.decode("utf-8")
-
-            self.logger_parser.debug("step 1")
-            parsed_res = (http_res).partition("+" + partition_separator + ",")
-
-            parsed_res = parsed_res[2]
-            self.logger_parser.debug("step 2: %s", str(parsed_res))
-
-            parsed_res = str(parsed_res).partition(self.line_separator * 2)
-            self.logger_parser.debug("step 3 len: %s", str(len(parsed_res)))
-
-            self.logger_parser.debug("step 3: %s", parsed_res)
-            body_str = ure.sub(sub_separator, "", parsed_res[2])
-            self.logger_parser.debug("step 4: %s", parsed_res[0])
-
-            headers_str = ure.sub(sub_separator, "", (parsed_res[0])).partition(":")[2]
-            self.logger_parser.debug("step 5")
-            status_code = -1
+            reader.feed(http_res)
+            if reader.header is None:
+                # no blank line: it is all headers
+                reader.feed(reader.HEADER_END)
         except Exception as e:
             self.logger_parser.exception("parse error: %s", str(e))
-            self.logger_parser.exception("args:%s", str(e.args))
-            self.logger_parser.exception("original:%s", http_res)
-            self.logger_parser.exception("trace:%s", str(e.__traceback__))
+            self.logger_parser.exception("original:%s", str(http_res))
             raise http_response_parse_invalid(e, http_res)
+        return self.http_result(reader, body, parse)
 
-        headers = {}
-        for line in headers_str.split(self.line_separator):
-            if ":" in line:
-                key, value = line.split(":", 1)
-                headers[key.strip()] = value.strip()
+    def http_result(self, reader, body, parse=False):
+        """
+        (headers, body, status_code) of a response read by an
+        http_response_reader whose body went to body.
+        """
+        self.logger_parser.debug("headers: %s", str(reader.header))
+        try:
+            body_str = str(body, "utf-8")
+        except Exception as e:
+            self.logger_parser.exception("parse error: %s", str(e))
+            raise http_response_parse_invalid(e, reader.head)
 
-        content_type = headers.get("Content-Type", "").lower()
+        content_type = reader.header.get("Content-Type", "").lower()
         self.logger_parser.debug("content type: " + content_type)
-        body = body_str
         if parse:
-            body = self.content_parser(body_str, content_type)
-
-        for status in str(headers_str.partition(self.line_separator)[0]).split():
-            if status.isdigit():
-                status_code = int(status)
-
-        return headers, body, status_code
+            return reader.header, self.content_parser(body_str, content_type), reader.status_code
+        return reader.header, body_str, reader.status_code
 
     def content_parser(self, body_str, content_type):
         if "text/html" in content_type:
@@ -91,6 +82,173 @@ class response_parser:
         return text
 
 
+class http_response_reader:
+    """
+    HTTP/1.1 response read as its bytes arrive, in pieces of any size. The
+    status and headers are there as soon as the blank line after them is;
+    the body goes to on_body (called with memoryview slices, only valid
+    during the call), decoded from the chunked transfer coding when the
+    response uses it. complete() tells when the body ended, after
+    Content-Length bytes or the last chunk; a body with neither ends with
+    the connection.
+    """
+
+    HEAD = 0
+    BODY = 1  # raw body bytes, up to length or to the end of the connection
+    CHUNK_SIZE = 2
+    CHUNK_DATA = 3
+    CHUNK_END = 4  # the line end after the data of a chunk
+    TRAILER = 5
+    DONE = 6
+    HEADER_END = b"\r\n\r\n"
+    LINE_SEPARATOR = "\r\n"
+
+    def __init__(self, on_body):
+        self.on_body = on_body
+        self.head = bytearray()
+        self.header = None
+        self.status_code = None
+        self.length = None  # Content-Length
+        self.chunked = False
+        self.keep_alive = True
+        self.received = 0  # decoded body bytes so far
+        self._state = self.HEAD
+        self._matched = 0
+        self._line = bytearray()
+        self._remaining = None  # bytes left of the body or of the chunk
+
+    def feed(self, data):
+        """
+        Take the next bytes of the response. Returns how many were used:
+        once the response is complete the rest belongs to the next one.
+        """
+        view = memoryview(data)
+        used = 0
+        while used < len(view) and self._state != self.DONE:
+            if self._state == self.HEAD:
+                used += self._feed_head(view[used:])
+            elif self._state in (self.BODY, self.CHUNK_DATA):
+                used += self._feed_data(view[used:])
+            else:
+                used += self._feed_line(view[used:])
+        return used
+
+    def complete(self):
+        return self._state == self.DONE
+
+    def raw_body(self):
+        """
+        Whether the next bytes are body bytes as they are, which a reader
+        may hand over without feed.
+        """
+        return self._state == self.BODY
+
+    def framed(self):
+        """
+        Whether the response says where its body ends.
+        """
+        return self.chunked or self.length is not None
+
+    def _advance(self, count):
+        self.received += count
+        if self._remaining is None:
+            return
+        self._remaining -= count
+        if self._remaining == 0:
+            self._remaining = None
+            self._state = self.CHUNK_END if self._state == self.CHUNK_DATA else self.DONE
+
+    def _feed_head(self, view):
+        matched = self._matched
+        for index in range(len(view)):
+            byte = view[index]
+            if byte == self.HEADER_END[matched]:
+                matched += 1
+            elif byte == 0x0D:
+                matched = 1
+            else:
+                matched = 0
+            if matched == len(self.HEADER_END):
+                self.head.extend(view[: index + 1])
+                self._parse_head()
+                return index + 1
+        self._matched = matched
+        self.head.extend(view)
+        return len(view)
+
+    def _parse_head(self):
+        lines = str(self.head, "utf-8").split(self.LINE_SEPARATOR)
+        self.status_code = -1
+        for status in lines[0].split():
+            if status.isdigit():
+                self.status_code = int(status)
+        self.keep_alive = not lines[0].startswith("HTTP/1.0")
+        header = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                key = key.strip()
+                value = value.strip()
+                header[key] = value
+                name = key.lower()
+                if name == "content-length":
+                    self.length = int(value)
+                elif name == "transfer-encoding" and "chunked" in value.lower():
+                    self.chunked = True
+                elif name == "connection":
+                    self.keep_alive = value.lower() != "close"
+        self.header = header
+
+        if self.chunked:
+            # the chunks say where the body ends, not Content-Length
+            self.length = None
+            self._state = self.CHUNK_SIZE
+        elif (
+            self.length == 0
+            or self.status_code in (204, 304)
+            or 100 <= self.status_code < 200
+        ):
+            self._state = self.DONE
+        else:
+            if self.length is None:
+                self.keep_alive = False
+            self._remaining = self.length
+            self._state = self.BODY
+
+    def _feed_data(self, view):
+        count = len(view)
+        if self._remaining is not None:
+            count = min(count, self._remaining)
+        if count:
+            self.on_body(view[:count])
+        self._advance(count)
+        return count
+
+    def _feed_line(self, view):
+        for index in range(len(view)):
+            if view[index] == 0x0A:
+                self._line.extend(view[:index])
+                line = str(self._line, "utf-8").strip()
+                self._line = bytearray()
+                self._end_line(line)
+                return index + 1
+        self._line.extend(view)
+        return len(view)
+
+    def _end_line(self, line):
+        if self._state == self.CHUNK_SIZE:
+            size = int(line.split(";")[0], 16)
+            if size:
+                self._remaining = size
+                self._state = self.CHUNK_DATA
+            else:
+                self._state = self.TRAILER
+        elif self._state == self.CHUNK_END:
+            self._state = self.CHUNK_SIZE
+        elif not line:
+            self._state = self.DONE
+
+
 class HTMLNode:
     def __init__(self, tag, parent=None):
         self.tag = tag
@@ -0,0 +1,107 @@
+class ring_buffer:
+    """
+    Fixed size byte ring buffer filled straight from a stream with readinto.
+
+    The storage is allocated once; readers get memoryview slices of it, so
+    moving bytes through the buffer does not allocate on the heap.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.length = 0
+
+    def any(self):
+        return self.length
+
+    def free(self):
+        return self.size - self.length
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def _index(self, offset):
+        index = self.start + offset
+        if index >= self.size:
+            index -= self.size
+        return index
+
+    def writable(self):
+        """
+        Longest contiguous memoryview of free space, to read into directly.
+        Call commit() with the number of bytes written to it.
+        """
+        if self.length == 0:
+            self.start = 0
+        end = self._index(self.length)
+        if end < self.start or (end == self.start and self.length):
+            return self.view[end : self.start]
+        return self.view[end:]
+
+    def commit(self, count):
+        self.length += count
+
+    def fill(self, stream, limit=None):
+        """
+        Read from the stream into the free space until it is full or the
+        stream has nothing more buffered. With a limit, at most that many
+        bytes are requested, so a UART read returns without waiting for
+        more characters. Returns the number of bytes read.
+        """
+        total = 0
+        while self.length < self.size:
+            span = self.writable()
+            nbytes = len(span)
+            if limit is not None:
+                nbytes = min(nbytes, limit - total)
+            count = stream.readinto(span, nbytes)
+            if not count:
+                break
+            self.commit(count)
+            total += count
+            if count < nbytes or total == limit or not stream.any():
+                break
+        return total
+
+    def peek(self, offset=0):
+        return self.buffer[self._index(offset)]
+
+    def chunk(self, offset=0, limit=None):
+        """
+        Longest contiguous memoryview of readable bytes starting at offset.
+        """
+        index = self._index(offset)
+        count = min(self.length - offset, self.size - index)
+        if limit is not None and limit < count:
+            count = limit
+        return self.view[index : index + count]
+
+    def consume(self, count):
+        if count >= self.length:
+            self.clear()
+            return
+        self.start = self._index(count)
+        self.length -= count
+
+    def startswith(self, pattern, offset=0, count=None):
+        if count is None:
+            count = len(pattern)
+        if offset + count > self.length:
+            return False
+        for position in range(count):
+            if self.peek(offset + position) != pattern[position]:
+                return False
+        return True
+
+    def find(self, pattern, start=0):
+        """
+        Offset of the first complete match of pattern, or -1.
+        """
+        first = pattern[0]
+        for offset in range(start, self.length - len(pattern) + 1):
+            if self.peek(offset) == first and self.startswith(pattern, offset):
+                return offset
+        return -1
@@ -0,0 +1,78 @@
+import uasyncio as asyncio
+
+from components.esp.command_scheduler import command_scheduler
+from lib.logging import basicConfig, INFO
+
+basicConfig(level=INFO)
+
+
+class CommandSchedulerTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    async def exchange(self, scheduler, name, priority, order):
+        async with scheduler.claim(priority):
+            order.append(name)
+            await asyncio.sleep_ms(5)
+
+    async def run_claims(self):
+        scheduler = command_scheduler()
+        order = []
+        # The first claim takes the UART, the others queue behind it
+        tasks = [
+            asyncio.create_task(
+                self.exchange(scheduler, "probe", command_scheduler.HOUSEKEEPING, order)
+            ),
+            asyncio.create_task(
+                self.exchange(scheduler, "update", command_scheduler.HOUSEKEEPING, order)
+            ),
+            asyncio.create_task(
+                self.exchange(scheduler, "command", command_scheduler.COMMAND, order)
+            ),
+            asyncio.create_task(
+                self.exchange(scheduler, "reply", command_scheduler.RESPONSE, order)
+            ),
+        ]
+        await asyncio.sleep_ms(1)
+        self.assert_equal(3, scheduler.queue_depth())
+        for task in tasks:
+            await task
+
+        # Replies first, then commands, then housekeeping in arrival order
+        self.assert_equal(["probe", "reply", "command", "update"], order)
+        self.assert_equal(0, scheduler.queue_depth())
+        self.assert_equal(4, scheduler.stats["claims"])
+        self.assert_equal(3, scheduler.stats["max_depth"])
+        self.assert_equal(True, scheduler.stats["max_wait_ms"] >= 10)
+
+        # A cancelled claim leaves the queue
+        async with scheduler.claim():
+            task = asyncio.create_task(
+                self.exchange(scheduler, "late", command_scheduler.COMMAND, order)
+            )
+            await asyncio.sleep_ms(1)
+            task.cancel()
+            await asyncio.sleep_ms(1)
+            self.assert_equal(0, scheduler.queue_depth())
+        async with scheduler.claim():
+            self.assert_equal(0, scheduler.queue_depth())
+
+    def run_tests(self):
+        asyncio.run(self.run_claims())
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = CommandSchedulerTestCase()
+test_case.run_tests()
@@ -0,0 +1,109 @@
+from components.esp.espmodule import ESPMODULE
+from lib.logging import basicConfig, INFO
+
+basicConfig(level=INFO)
+
+
+class FakeStream:
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    def any(self):
+        return len(self.data)
+
+    def readinto(self, buf, nbytes):
+        count = min(nbytes, len(self.data))
+        buf[:count] = self.data[:count]
+        del self.data[:count]
+        return count
+
+
+class ESPModuleTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def feed(self, esp_instance, data, terminators=None):
+        esp_instance.rx_buffer.fill(FakeStream(data))
+        return esp_instance._process_rx_buffer(terminators)
+
+    def response(self, esp_instance):
+        return bytes(esp_instance._response_view[: esp_instance._response_length])
+
+    def run_tests(self):
+        esp_instance = ESPMODULE(uart_tx=4, uart_rx=5)
+        received = {}
+
+        def consumer(link, data):
+            received[link] = received.get(link, b"") + bytes(data)
+
+        esp_instance.default_link_consumer = consumer
+
+        # A command response ends at its final code, the rest is kept
+        esp_instance._response_length = 0
+        esp_instance._line_start = 0
+        self.assert_equal(
+            True,
+            self.feed(esp_instance, b"AT\r\r\n\r\nOK\r\nWIFI", ESPMODULE.FINAL_RESPONSES),
+        )
+        self.assert_equal(b"AT\r\r\n\r\nOK\r\n", self.response(esp_instance))
+        self.assert_equal(4, esp_instance.rx_buffer.any())
+        esp_instance.rx_buffer.clear()
+
+        # The prompt matches without a line end
+        esp_instance._response_length = 0
+        esp_instance._line_start = 0
+        self.assert_equal(
+            True, self.feed(esp_instance, b"\r\nOK\r\n> ", ESPMODULE.PROMPT_RESPONSES)
+        )
+
+        # Frames split anywhere are delivered by declared length, and text
+        # that looks like a final code inside the payload is not a line
+        esp_instance._response_length = 0
+        esp_instance._line_start = 0
+        self.assert_equal(False, self.feed(esp_instance, b"1,CONNECT\r\n\r\n+IP"))
+        self.assert_equal(False, self.feed(esp_instance, b"D,1,9:OK\r\n"))
+        self.assert_equal(False, self.feed(esp_instance, b"abc\r\n+IPD,2,2:hi"))
+        self.assert_equal(b"OK\r\nabc\r\n", received.get(1))
+        self.assert_equal(b"hi", received.get(2))
+        self.assert_equal(True, 1 in esp_instance.open_links)
+
+        self.feed(esp_instance, b"1,CLOSED\r\n")
+        self.assert_equal(False, 1 in esp_instance.open_links)
+
+        # Unsolicited lines go to their handlers, not into the response
+        events = []
+        esp_instance.add_urc_handler(
+            b"WIFI GOT IP", lambda urc, link: events.append((urc, link))
+        )
+        esp_instance.add_urc_handler(
+            b"CLOSED", lambda urc, link: events.append((urc, link)), True
+        )
+        esp_instance._response_length = 0
+        esp_instance._line_start = 0
+        self.assert_equal(
+            True,
+            self.feed(
+                esp_instance,
+                b"WIFI GOT IP\r\n2,CLOSED\r\nWIFI GOT IPS\r\nOK\r\n",
+                ESPMODULE.FINAL_RESPONSES,
+            ),
+        )
+        self.assert_equal(b"WIFI GOT IPS\r\nOK\r\n", self.response(esp_instance))
+        self.assert_equal([(b"WIFI GOT IP", None), (b"CLOSED", 2)], events)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = ESPModuleTestCase()
+test_case.run_tests()
@@ -0,0 +1,50 @@
+from components.esp.http_link import http_link
+
+
+class HttpLinkTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        link = http_link(2)
+        self.assert_equal(http_link.IDLE, link.state)
+
+        # The request may come in pieces, split inside the blank line
+        self.assert_equal(False, link.feed(memoryview(b"GET / HTTP/1.1\r\nHost: x\r")))
+        self.assert_equal(http_link.RECEIVING, link.state)
+        self.assert_equal(True, link.feed(memoryview(b"\n\r\n")))
+        self.assert_equal(http_link.READY, link.state)
+        self.assert_equal("GET / HTTP/1.1\r\nHost: x\r\n\r\n", link.take_request())
+        self.assert_equal(http_link.HANDLING, link.state)
+
+        # A request arriving while the response is sent waits for it
+        link.respond([b"one", b"two"], close=False)
+        self.assert_equal(False, link.feed(b"GET /up HTTP/1.1\r\n\r\n"))
+        self.assert_equal(b"one", link.next_payload())
+        self.assert_equal(b"two", link.next_payload())
+        self.assert_equal(None, link.next_payload())
+        self.assert_equal(http_link.READY, link.state)
+        self.assert_equal("GET /up HTTP/1.1\r\n\r\n", link.take_request())
+
+        # A response that closes the link
+        link.respond([b"bye"])
+        self.assert_equal(b"bye", link.next_payload())
+        self.assert_equal(None, link.next_payload())
+        self.assert_equal(http_link.CLOSING, link.state)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = HttpLinkTestCase()
+test_case.run_tests()
@@ -0,0 +1,88 @@
+from components.esp.response_parser import response_parser, http_response_reader
+
+CHUNKED = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+    b"\r\n"
+    b"4;ext=1\r\n"
+    b'{"a"\r\n'
+    b"8\r\n"
+    b": \r\n\r\n1}\r\n"
+    b"0\r\n"
+    b"X-Trailer: yes\r\n"
+    b"\r\n"
+)
+NEXT = b"HTTP/1.1 204 No Content\r\n\r\n"
+
+
+class HttpResponseReaderTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        # Chunks are decoded wherever the pieces are cut
+        for size in (1, 3, len(CHUNKED)):
+            body = bytearray()
+            reader = http_response_reader(body.extend)
+            used = 0
+            for start in range(0, len(CHUNKED + NEXT), size):
+                used += reader.feed(memoryview(CHUNKED + NEXT)[start : start + size])
+            self.assert_equal(b'{"a": \r\n\r\n1}', bytes(body))
+            self.assert_equal(True, reader.complete())
+            # what follows belongs to the next response
+            self.assert_equal(len(CHUNKED), used)
+        self.assert_equal(True, reader.chunked)
+        self.assert_equal(True, reader.framed())
+        self.assert_equal("application/json", reader.header["Content-Type"])
+
+        # The headers are there before the body is
+        reader = http_response_reader(lambda data: None)
+        reader.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nab")
+        self.assert_equal(200, reader.status_code)
+        self.assert_equal(5, reader.length)
+        self.assert_equal(True, reader.raw_body())
+        self.assert_equal(False, reader.complete())
+        self.assert_equal(3, reader.feed(b"cdefg"))
+        self.assert_equal(True, reader.complete())
+
+        # Without framing the body ends with the connection
+        reader = http_response_reader(lambda data: None)
+        reader.feed(b"HTTP/1.0 200 OK\r\n\r\nabc")
+        self.assert_equal(False, reader.framed())
+        self.assert_equal(False, reader.keep_alive)
+        self.assert_equal(False, reader.complete())
+        self.assert_equal(3, reader.received)
+
+        # A 204 has no body, even with keep-alive
+        reader = http_response_reader(lambda data: None)
+        self.assert_equal(len(NEXT), reader.feed(NEXT + b"more"))
+        self.assert_equal(True, reader.complete())
+        self.assert_equal(True, reader.keep_alive)
+
+        # parse_http decodes a complete chunked response
+        parser = response_parser()
+        header, body, status_code = parser.parse_http(CHUNKED, parse=True)
+        self.assert_equal(200, status_code)
+        self.assert_equal({"a": 1}, body)
+        header, body, status_code = parser.parse_http(
+            "HTTP/1.1 404 Not Found\r\nContent-Length: 3\r\n\r\nabcdef"
+        )
+        self.assert_equal((404, "abc"), (status_code, body))
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = HttpResponseReaderTestCase()
+test_case.run_tests()
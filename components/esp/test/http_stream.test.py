@@ -0,0 +1,100 @@
+from components.esp.http_stream import http_stream
+
+
+class HttpStreamTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        written = []
+        stream = http_stream(lambda data: written.append(bytes(data)), buffer_size=4)
+
+        # The headers may come in pieces, split inside the blank line
+        stream.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r")
+        self.assert_equal(None, stream.header)
+        stream.feed(memoryview(b"\n\r\n\x00\xff\r\n\r"))
+        self.assert_equal(200, stream.status_code)
+        self.assert_equal({"Content-Length": "10"}, stream.header)
+        self.assert_equal(10, stream.length)
+        self.assert_equal(True, stream.keep_alive)
+
+        # The body reaches the sink in buffer sized slices, as bytes
+        self.assert_equal([b"\x00\xff\r\n"], written)
+        self.assert_equal(False, stream.complete())
+        stream.feed(b"\nabcdeXTRA")
+        self.assert_equal(True, stream.complete())
+        self.assert_equal(10, stream.received)
+        stream.finish()
+        self.assert_equal([b"\x00\xff\r\n", b"\r\nab", b"cd"], written)
+
+        # A reader may fill the buffer in place
+        written = []
+        stream = http_stream(written.append, buffer_size=8)
+        stream.feed(b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n")
+        self.assert_equal(False, stream.keep_alive)
+        self.assert_equal(None, stream.length)
+        space = stream.buffer_space()
+        space[:3] = b"abc"
+        stream.commit(3)
+        self.assert_equal(5, len(stream.buffer_space()))
+        self.assert_equal(False, stream.complete())
+        stream.finish()
+        self.assert_equal([b"abc"], [bytes(data) for data in written])
+
+        # The body of an error is not written
+        written = []
+        stream = http_stream(written.append)
+        stream.feed(b"HTTP/1.1 404 Not Found\r\nContent-Length: 9\r\n\r\nNot Found")
+        stream.finish()
+        self.assert_equal(404, stream.status_code)
+        self.assert_equal(True, stream.complete())
+        self.assert_equal([], written)
+
+        # A 206 from the offset asked for carries the rest of the body
+        written = []
+        stream = http_stream(lambda data: written.append(bytes(data)), offset=4)
+        stream.feed(
+            b"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes 4-9/10\r\n"
+            b"Content-Length: 6\r\n\r\n456789"
+        )
+        stream.finish()
+        self.assert_equal(True, stream.accepted())
+        self.assert_equal([b"456789"], written)
+
+        # A server that ignored the Range header: what the sink has is dropped
+        written = []
+        stream = http_stream(
+            lambda data: written.append(bytes(data)), buffer_size=3, offset=4
+        )
+        stream.feed(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n0123456789")
+        stream.finish()
+        self.assert_equal(True, stream.accepted())
+        self.assert_equal(b"456789", b"".join(written))
+
+        # A range from elsewhere is not written
+        written = []
+        stream = http_stream(written.append, offset=4)
+        stream.feed(
+            b"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes 2-9/10\r\n"
+            b"Content-Length: 8\r\n\r\n23456789"
+        )
+        stream.finish()
+        self.assert_equal(False, stream.accepted())
+        self.assert_equal([], written)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = HttpStreamTestCase()
+test_case.run_tests()
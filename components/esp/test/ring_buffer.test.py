@@ -0,0 +1,71 @@
+from components.esp.ring_buffer import ring_buffer
+from lib.logging import basicConfig, INFO
+
+basicConfig(level=INFO)
+
+
+class FakeStream:
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    def any(self):
+        return len(self.data)
+
+    def readinto(self, buf, nbytes):
+        count = min(nbytes, len(self.data))
+        buf[:count] = self.data[:count]
+        del self.data[:count]
+        return count
+
+
+class RingBufferTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def read_all(self, ring):
+        data = bytearray()
+        while ring.any():
+            chunk = ring.chunk()
+            data += chunk
+            ring.consume(len(chunk))
+        return bytes(data)
+
+    def run_tests(self):
+        ring = ring_buffer(8)
+
+        # Fill up to capacity, the rest stays in the stream
+        stream = FakeStream(b"0123456789")
+        self.assert_equal(8, ring.fill(stream))
+        self.assert_equal(b"89", bytes(stream.data))
+
+        # Wrap around the end of the storage
+        ring.consume(6)
+        self.assert_equal(2, ring.fill(stream))
+        self.assert_equal(b"6789", self.read_all(ring))
+
+        # Searching works across the wrap point
+        ring.fill(FakeStream(b"abcdef"))
+        ring.consume(4)
+        ring.fill(FakeStream(b"ghijk"))
+        self.assert_equal(2, ring.find(b"gh"))
+        self.assert_equal(4, ring.find(b"ij"))
+        self.assert_equal(-1, ring.find(b"kz"))
+        self.assert_equal(ord("e"), ring.peek(0))
+        self.assert_equal(b"efghijk", self.read_all(ring))
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = RingBufferTestCase()
+test_case.run_tests()
@@ -2,7 +2,11 @@ from components.esp.wifi import wifi_module
 from components.esp.errors import (
     url_invalid,
     url_unsupported,
+    http_command_fail,
+    http_response_empty,
 )
+from components.esp.http_stream import http_stream
+import time
 import ure
 from lib.logging import getLogger, handlers, StreamHandler
 
@@ -10,47 +14,522 @@ from lib.logging import getLogger, handlers, StreamHandler
 class web_client(wifi_module):
     log_file = "espwebclientlog.txt"
     client_line_separator = "\r" + "\n"
+    # "+++" leaves transparent transmission when it comes as a packet of its
+    # own: 20 ms after the last byte, and the ESP takes no AT command for
+    # one second after it.
+    PASSTHROUGH_ESCAPE = b"+++"
+    PASSTHROUGH_ESCAPE_GUARD_MS = 20
+    PASSTHROUGH_EXIT_DELAY_MS = 1000
+    # Addresses from AT+CIPDOMAIN are reused for this long (ms); without
+    # them the ESP asks the DNS server again on every AT+CIPSTART.
+    DNS_TTL = 300000
+    # Body bytes held before they are handed to a download sink.
+    DOWNLOAD_BUFFER_LENGTH = 1024
+    # Links download_parallel keeps busy at once, of the MAX_LINKS of the ESP.
+    DOWNLOAD_LINKS = 3
+    MAX_LINKS = 5
 
-    def __init__(self, wifi_ssid, wifi_pass, uart_tx, uart_rx):
-        super().__init__(wifi_ssid, wifi_pass, uart_tx, uart_rx)
+    def __init__(self, wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate=None):
+        super().__init__(wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate)
         self.logger_wifi_client = getLogger("web_client")
         self.logger_wifi_client.addHandler(handlers.RotatingFileHandler(self.log_file))
         self.logger_wifi_client.addHandler(StreamHandler())
+        # (host, port) while the UART is a transparent pipe to it
+        self.passthrough = None
+        # (host, port) of the connection kept alive between requests
+        self.connection = None
+        # (files, bytes, ms) of the last download_parallel
+        self._download_totals = (0, 0, 0)
 
     def get_url_response(self, url, port=80, user_agent="RPi-Pico", parse=False):
+        """
+        GET url on a keep-alive connection. The connection stays open for
+        the next request to the same host and port; when the server closed
+        it meanwhile, the request is sent again on a new one.
+        """
         try:
-            match = ure.match(r"(https?)://([^/]+)(.*)", url)
+            scheme, host, path = self._split_url(url)
 
-            if match:
-                scheme, host, path = match.groups()
-            else:
-                raise url_invalid(url)
+            if port is None:
+                raise url_unsupported(scheme)
+
+            get_req = self._get_request(host, port, path, user_agent, keep_alive=True)
+            return self._send_on_connection(
+                host, port, lambda: self.send_http_command(get_req, parse=parse)
+            )
+
+        except Exception as e:
+            self.logger_wifi_client.error(f"Failed to get URL response from {url}: {e}")
+            # what is left of the response must not be read as the next one
+            self.close_keep_alive()
+            return (None, None, None)
+
+    def download(
+        self,
+        url,
+        sink,
+        port=80,
+        user_agent="RPi-Pico",
+        timeout=10,
+        passthrough=False,
+        offset=0,
+    ):
+        """
+        GET url and hand the body, as bytes, to sink (e.g. the write of a
+        file open in "wb") while it arrives, in slices of at most
+        DOWNLOAD_BUFFER_LENGTH bytes: memory use does not grow with the
+        file. With passthrough, over transparent transmission as in
+        get_url_passthrough. With an offset, the sink has that many bytes
+        already (a file open in "ab") and gets the rest, asked for with a
+        Range header.
+
+        Returns (header, body length, status_code), Nones on failure.
+        """
+        try:
+            scheme, host, path = self._split_url(url)
 
             if port is None:
                 raise url_unsupported(scheme)
 
-            if not self.create_tcp_connection(host, port):
-                return (None, None, None)
-
-            get_req = (
-                "GET "
-                + path
-                + " HTTP/1.1"
-                + self.client_line_separator
-                + "Host: "
-                + host
-                + ":"
-                + str(port)
-                + self.client_line_separator
-                + "User-Agent: "
-                + user_agent
-                + (self.client_line_separator * 2)
+            get_req = self._get_request(
+                host, port, path, user_agent, keep_alive=True, offset=offset
+            )
+            if passthrough and self._enter_passthrough(host, port):
+                return self._download_passthrough(get_req, sink, timeout, offset)
+            return self._send_on_connection(
+                host,
+                port,
+                lambda: self.send_http_stream(
+                    get_req,
+                    http_stream(sink, self.DOWNLOAD_BUFFER_LENGTH, offset),
+                    timeout=timeout,
+                ),
             )
 
-            (header, body, status_code) = self.send_http_command(get_req, parse=parse)
+        except Exception as e:
+            self.logger_wifi_client.error(f"Failed to download {url}: {e}")
+            self.close_passthrough()
+            self.close_keep_alive()
+            return (None, None, None)
+
+    def download_parallel(
+        self,
+        urls,
+        open_file,
+        port=80,
+        links=None,
+        user_agent="RPi-Pico",
+        timeout=10,
+        offsets=None,
+    ):
+        """
+        Download urls over up to links connections at once, each on a link
+        id of its own (AT+CIPMUX=1) and kept alive from one file to the
+        next: while the server works on a request, the responses to the
+        others arrive. The +IPD payload of every link goes to its own
+        http_stream, into the file open_file(url) returns (open in "wb"),
+        which is closed once written. offsets has, for the urls whose
+        file already holds part of the body (open in "ab"), how many bytes:
+        only the rest is asked for, as in download.
+
+        Returns {url: (status_code, body length, ms)}, stopping at the
+        first failure, whose status_code is None; download_stats() has the
+        totals.
+        """
+        links = max(1, min(links or self.DOWNLOAD_LINKS, self.MAX_LINKS))
+        queue = list(urls)
+        queue.reverse()
+        results = {}
+        retried = set()
+        active = {}  # conn_id: [url, file, stream, start ms, reused]
+        hosts = {}  # conn_id: (host, port) it is connected to
+        free = list(range(links))
+        started = time.ticks_ms()
+        self.close_passthrough()
+        self.close_keep_alive()
+        self.set_multiple_connections(1)
+        try:
+            while queue or active:
+                while queue and free:
+                    conn_id = free.pop()
+                    url = queue.pop()
+                    try:
+                        active[conn_id] = self._start_download(
+                            conn_id,
+                            url,
+                            hosts,
+                            open_file,
+                            port,
+                            user_agent,
+                            (offsets or {}).get(url, 0),
+                        )
+                    except Exception as e:
+                        results[url] = (None, 0, None)
+                        self.logger_wifi_client.error(f"Failed to download {url}: {e}")
+                        return results
+                finished = [c for c in active if self._download_done(c, active[c][2])]
+                if not finished:
+                    for conn_id in active:
+                        if self.available.get(conn_id):
+                            self.receive_data(conn_id)
+                    if not self._receive_frames(
+                        lambda: self._downloads_ready(active), timeout
+                    ):
+                        for download in active.values():
+                            results[download[0]] = (None, download[2].received, None)
+                        self.logger_wifi_client.error("Downloads timed out")
+                        return results
+                    continue
+                for conn_id in finished:
+                    download = active.pop(conn_id)
+                    free.append(conn_id)
+                    if not self._end_download(conn_id, download, hosts, results, queue, retried):
+                        return results
+            return results
+        finally:
+            for download in active.values():
+                download[1].close()
+            for conn_id in range(links):
+                self.set_link_consumer(conn_id, None)
+                if conn_id in self.open_links:
+                    self.close_connection(conn_id)
+            try:
+                self.set_multiple_connections(0)
+            except Exception as e:
+                # what went wrong with the downloads is the error to report
+                self.logger_wifi_client.error(
+                    f"Failed to leave multiple connections: {e}"
+                )
+            elapsed = time.ticks_diff(time.ticks_ms(), started)
+            size = sum(result[1] for result in results.values())
+            self._download_totals = (len(results), size, elapsed)
+
+    def download_stats(self):
+        """
+        Totals of the last download_parallel.
+        """
+        files, size, ms = self._download_totals
+        return {
+            "files": files,
+            "bytes": size,
+            "ms": ms,
+            "kib_s": size / 1024 / (ms / 1000) if ms else 0,
+        }
+
+    def resolve(self, host):
+        """
+        The address of host, from AT+CIPDOMAIN and cached for DNS_TTL ms.
+        When the lookup fails the name is returned, for the ESP to resolve.
+        """
+        if ure.match(r"[0-9.]+$", host):
+            return host
+        ret_data = self._cached_query('AT+CIPDOMAIN="' + host + '"', ttl=self.DNS_TTL)
+        match = ure.search(r'\+CIPDOMAIN:"?([0-9.]+)', ret_data)
+        if match:
+            return match.group(1)
+        self.logger_wifi_client.info(f"Could not resolve {host}")
+        return host
+
+    def close_keep_alive(self):
+        """
+        Close the connection kept alive between requests, if still open.
+        """
+        connection, self.connection = self.connection, None
+        if connection is not None and None in self.open_links:
             self.close_connection()
+
+    def _send_on_connection(self, host, port, send):
+        """
+        Call send with the kept alive connection to host:port open, again on
+        a new connection when the server had closed it and nothing came
+        back.
+        """
+        reused = self._open_connection(host, port)
+        try:
+            response = send()
+        except (http_command_fail, http_response_empty):
+            if not reused:
+                raise
+            self.logger_wifi_client.info("Keep-alive connection lost, reconnecting")
+            self.close_keep_alive()
+            self._open_connection(host, port)
+            response = send()
+        if None not in self.open_links:
+            self.connection = None
+        return response
+
+    def _start_download(
+        self, conn_id, url, hosts, open_file, port, user_agent, offset=0
+    ):
+        scheme, host, path = self._split_url(url)
+        if port is None:
+            raise url_unsupported(scheme)
+        reused = hosts.get(conn_id) == (host, port) and conn_id in self.open_links
+        if not reused:
+            if conn_id in self.open_links:
+                self.close_connection(conn_id)
+            self.create_tcp_connection(self.resolve(host), port, conn_id=conn_id)
+            hosts[conn_id] = (host, port)
+        file = open_file(url)
+        stream = http_stream(file.write, self.DOWNLOAD_BUFFER_LENGTH, offset)
+        self.set_link_consumer(conn_id, lambda link, data: stream.feed(data))
+        get_req = self._get_request(
+            host, port, path, user_agent, keep_alive=True, offset=offset
+        )
+        if not self.send_data(conn_id, get_req):
+            # taken as an empty response once the link is closed
+            self.close_connection(conn_id)
+        return [url, file, stream, time.ticks_ms(), reused]
+
+    def _download_done(self, conn_id, stream):
+        return stream.complete() or (
+            conn_id not in self.open_links and not self.available.get(conn_id)
+        )
+
+    def _downloads_ready(self, active):
+        for conn_id in active:
+            if self.available.get(conn_id) or self._download_done(
+                conn_id, active[conn_id][2]
+            ):
+                return True
+        return False
+
+    def _end_download(self, conn_id, download, hosts, results, queue, retried):
+        """
+        Close the file of a finished download and record it. Returns False
+        when it failed.
+        """
+        url, file, stream, start, reused = download
+        self.set_link_consumer(conn_id, None)
+        stream.finish()
+        file.close()
+        ms = time.ticks_diff(time.ticks_ms(), start)
+        if not stream.keep_alive or not stream.complete():
+            hosts.pop(conn_id, None)
+            if conn_id in self.open_links:
+                self.close_connection(conn_id)
+        try:
+            (header, size, status_code) = self._stream_result(stream)
+        except http_response_empty:
+            if reused and url not in retried:
+                # the server closed the kept alive connection meanwhile
+                retried.add(url)
+                queue.append(url)
+                return True
+            results[url] = (None, 0, ms)
+            self.logger_wifi_client.error(f"Failed to download {url}: empty response")
+            return False
+        except Exception as e:
+            results[url] = (None, stream.received, ms)
+            self.logger_wifi_client.error(f"Failed to download {url}: {e}")
+            return False
+        results[url] = (status_code, size, ms)
+        return True
+
+    def _open_connection(self, host, port):
+        """
+        Have a connection to host:port open, the kept alive one when it is
+        still up. Returns True when it is reused.
+        """
+        # a CLOSED line that arrived while the connection was idle
+        self._receive_frames(lambda: False, timeout=0)
+        if self.connection == (host, port) and None in self.open_links:
+            return True
+        self.close_keep_alive()
+        self.create_tcp_connection(self.resolve(host), port)
+        self.connection = (host, port)
+        return False
+
+    def get_url_passthrough(
+        self, url, port=80, user_agent="RPi-Pico", parse=False, timeout=10
+    ):
+        """
+        get_url_response for bulk transfers, in transparent transmission
+        (AT+CIPMODE=1): the UART is a raw pipe to the host, with no +IPD
+        framing to strip, and the body is read from the UART straight into
+        the download buffer.
+
+        The connection is kept alive for the next request to the same host;
+        call close_passthrough once done, as leaving costs a second. Falls
+        back to get_url_response when the ESP refuses the mode (a server or
+        multiple connections are running).
+        """
+        try:
+            scheme, host, path = self._split_url(url)
+
+            if port is None:
+                raise url_unsupported(scheme)
+
+            if not self._enter_passthrough(host, port):
+                return self.get_url_response(url, port, user_agent, parse)
+
+            get_req = self._get_request(host, port, path, user_agent, keep_alive=True)
+            body = bytearray()
+            (header, _, status_code) = self._download_passthrough(
+                get_req, body.extend, timeout
+            )
+            body = str(body, "utf-8")
+            if parse:
+                content_type = header.get("Content-Type", "").lower()
+                body = self.parser.content_parser(body, content_type)
             return (header, body, status_code)
 
         except Exception as e:
             self.logger_wifi_client.error(f"Failed to get URL response from {url}: {e}")
+            self.close_passthrough()
             return (None, None, None)
+
+    def open_passthrough(self, host, port):
+        """
+        Connect to host and turn the UART into a pipe to it.
+        """
+        ret_data = self._send_and_receive_command("AT+CIPMODE=1")
+        if self.ESP8266_OK_STATUS not in ret_data:
+            self.logger_wifi_client.info("Transparent transmission refused")
+            return False
+        try:
+            connected = self.create_tcp_connection(self.resolve(host), port)
+        except Exception as e:
+            self.logger_wifi_client.error(f"Passthrough connection failed: {e}")
+            connected = False
+        if connected:
+            ret_data = self._send_and_receive_command(
+                "AT+CIPSEND", terminators=self.PASSTHROUGH_PROMPT_RESPONSES
+            )
+            if ">" in ret_data:
+                self.passthrough = (host, port)
+                return True
+            self.close_connection()
+        self._send_and_receive_command("AT+CIPMODE=0")
+        return False
+
+    def close_passthrough(self):
+        """
+        Leave transparent transmission with "+++" and close its connection.
+        """
+        if self.passthrough is None:
+            return
+        self.passthrough = None
+        self.uart.flush()
+        time.sleep_ms(self.PASSTHROUGH_ESCAPE_GUARD_MS)
+        self.uart.write(self.PASSTHROUGH_ESCAPE)
+        self.uart.flush()
+        time.sleep_ms(self.PASSTHROUGH_EXIT_DELAY_MS)
+        # whatever the host still sent is not a response
+        self.rx_buffer.clear()
+        while self.uart.any():
+            self.uart.read(self.uart.any())
+        self._send_and_receive_command("AT+CIPMODE=0")
+        self.close_connection()
+        # a link the host closed meanwhile reported no CLOSED line
+        self.open_links.discard(None)
+
+    def _enter_passthrough(self, host, port):
+        """
+        Have the transparent pipe open to host:port; False when the ESP
+        refuses the mode.
+        """
+        if self.passthrough == (host, port):
+            return True
+        self.close_passthrough()
+        # the ESP has a single connection in this mode
+        self.close_keep_alive()
+        return self.open_passthrough(host, port)
+
+    def _download_passthrough(self, request, sink, timeout=10, offset=0):
+        self.uart.write(request.encode())
+        stream = http_stream(sink, self.DOWNLOAD_BUFFER_LENGTH, offset)
+        completed = self._stream_passthrough(stream, timeout)
+        stream.finish()
+        if not completed or not stream.keep_alive:
+            self.close_passthrough()
+        return self._stream_result(stream)
+
+    def _stream_passthrough(self, stream, timeout=10):
+        """
+        Feed one HTTP response from the transparent pipe to stream. What
+        the ring buffer holds goes through it; a body that is not chunked
+        is read from the UART straight into the stream buffer. A body
+        without framing ends when the line is idle. Returns False on
+        timeout.
+        """
+        ring = self.rx_buffer
+        start_time = time.ticks_ms()
+        idle_start = start_time
+        wait_start = time.ticks_us()
+        try:
+            while not stream.complete():
+                if ring.any():
+                    chunk = ring.chunk()
+                    stream.feed(chunk)
+                    ring.consume(len(chunk))
+                    idle_start = time.ticks_ms()
+                    continue
+                available = self.uart.any()
+                if available and stream.raw_body():
+                    space = stream.buffer_space()
+                    count = min(available, len(space))
+                    if stream.length is not None:
+                        count = min(count, stream.length - stream.received)
+                    stream.commit(self.uart.readinto(space, count) or 0)
+                    idle_start = time.ticks_ms()
+                elif available:
+                    self._fill_rx_buffer()
+                else:
+                    idle = time.ticks_diff(time.ticks_ms(), idle_start)
+                    if (
+                        stream.header is not None
+                        and not stream.framed()
+                        and idle > self.HTTP_IDLE_TIMEOUT * 1000
+                    ):
+                        return True
+                    if not self._wait_passthrough(start_time, timeout):
+                        return False
+            return True
+        finally:
+            self.wait_us += time.ticks_diff(time.ticks_us(), wait_start)
+
+    def _wait_passthrough(self, start_time, timeout):
+        """
+        Wait for the UART to have data. False once timeout seconds passed
+        since start_time.
+        """
+        remaining = timeout * 1000 - time.ticks_diff(time.ticks_ms(), start_time)
+        if remaining <= 0:
+            return False
+        if not self.uart.any():
+            self._wait_for_rx(min(remaining, self.HTTP_IDLE_TIMEOUT * 1000))
+        return True
+
+    def _split_url(self, url):
+        match = ure.match(r"(https?)://([^/]+)(.*)", url)
+
+        if match:
+            return match.groups()
+        raise url_invalid(url)
+
+    def _get_request(self, host, port, path, user_agent, keep_alive=False, offset=0):
+        return (
+            "GET "
+            + path
+            + " HTTP/1.1"
+            + self.client_line_separator
+            + "Host: "
+            + host
+            + ":"
+            + str(port)
+            + self.client_line_separator
+            + "User-Agent: "
+            + user_agent
+            + (
+                self.client_line_separator + "Connection: keep-alive"
+                if keep_alive
+                else ""
+            )
+            + (
+                self.client_line_separator + "Range: bytes=" + str(offset) + "-"
+                if offset
+                else ""
+            )
+            + (self.client_line_separator * 2)
+        )
@@ -1,4 +1,6 @@
 from components.esp.wifi import wifi_module
+from components.esp.http_link import http_link
+from components.esp.errors import at_set
 
 from lib.logging import getLogger, handlers, StreamHandler
 
@@ -6,12 +8,19 @@ from lib.logging import getLogger, handlers, StreamHandler
 class web_server(wifi_module):
     log_file = "espwebserver.txt"
     server_line_separator = "\r" + "\n"
+    MAX_LINKS = 5
 
-    def __init__(self, wifi_ssid, wifi_pass, uart_tx, uart_rx):
-        super().__init__(wifi_ssid, wifi_pass, uart_tx, uart_rx)
+    def __init__(self, wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate=None):
+        super().__init__(wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate)
         self.logger_wifi_server = getLogger("espwebserver")
         self.logger_wifi_server.addHandler(handlers.RotatingFileHandler(self.log_file))
         self.logger_wifi_server.addHandler(StreamHandler())
+        # one http_link per connection id, taken in turns from _turn on
+        self.links = {}
+        self._turn = 0
+        self.default_link_consumer = self._collect_request
+        self.add_urc_handler(self.CONNECT_STATUS, self._open_link, True)
+        self.add_urc_handler(self.CLOSED_STATUS, self._forget_request, True)
 
     def start_web_server(self, port=80):
         """
@@ -20,7 +29,9 @@ class web_server(wifi_module):
         try:
             # self.set_timeout(30)
             self.set_multiple_connections(1)
+            self._set_active_receive()
             self.set_server(1)
+            self.supports_send_buffer()
             self.logger_wifi_server.info(f"ESP: Web server started on port {port}.")
             return True
         except Exception as e:
@@ -29,53 +40,175 @@ class web_server(wifi_module):
             )
             return False
 
-    def handle_web_request(self):
+    def _set_active_receive(self):
+        # what ran before, the updater, may have left the ESP in passive
+        # receive: requests would then wait in the ESP, never pulled
+        try:
+            self.set_passive_receive(False)
+        except at_set as e:
+            # firmware without AT+CIPRECVMODE is always in active mode
+            self.logger_wifi_server.info(f"Active receive not set: {e}")
+
+    def handle_web_request(self, timeout=10):
         """
         Handle incoming HTTP requests and perform actions based on the request.
+
+        The +IPD payload of every link feeds its own http_link, so requests
+        from several clients do not mix. Returns (headers, body, conn_id) for
+        a link whose request headers are complete, the links taking turns.
         """
-        response = self._receive_command(timeout=10)
-        response = response.decode()
-        self.logger_wifi_server.debug("Received response: " + response)
-        if len(response) <= 0:
+        if not self._has_request():
+            self._receive_frames(self._has_request, timeout)
+        if not self._has_request():
             return None, None, None
+        return self._pop_request()
 
-        if "+IPD," not in response:
-            return None, response, None
+    def _has_request(self):
+        for link in self.links.values():
+            if link.state == http_link.READY:
+                return True
+        return False
 
-        conn_id_start = response.index("+IPD,") + 5
-        conn_id_end = response.index(",", conn_id_start)
-        conn_id = int(response[conn_id_start:conn_id_end])
+    def _pop_request(self):
+        link = self._next_link(http_link.READY)
+        request = link.take_request()
+        self.logger_wifi_server.debug("Received request: " + request)
 
-        request_start = response.find("GET ")
-        if request_start == -1:
-            request_start = response.find("POST ")
-        request_end = -1
-        if request_start != -1:
-            request_end = response.find(self.server_line_separator * 2, request_start)
+        headers, _, request_body = request.partition(self.server_line_separator * 2)
+        return headers, request_body, link.conn_id
 
-        if request_end != -1:
-            http_request = response[request_start:request_end]
+    def _next_link(self, state):
+        """
+        The first link in the given state, starting after the one served
+        last, so that every link gets its turn.
+        """
+        for step in range(self.MAX_LINKS):
+            conn_id = (self._turn + step) % self.MAX_LINKS
+            link = self.links.get(conn_id)
+            if link is not None and link.state == state:
+                self._turn = conn_id + 1
+                return link
+        return None
+
+    def _open_link(self, urc, conn_id):
+        self.links[conn_id] = http_link(conn_id)
+
+    def _collect_request(self, conn_id, data):
+        """
+        Link consumer for the server: feed the payload to the state machine
+        of its link.
+        """
+        link = self.links.get(conn_id)
+        if link is None:
+            link = self.links[conn_id] = http_link(conn_id)
+        link.feed(data)
 
-            headers, request_body = (
-                http_request.split(self.server_line_separator * 2, 1)
-                if self.server_line_separator * 2 in http_request
-                else (http_request, "")
-            )
+    def _forget_request(self, urc, conn_id):
+        self.links.pop(conn_id, None)
+
+    def queue_web_file(self, conn_id, html_file_path):
+        """
+        Queue a file as the response of the link, sent by service_links.
+        """
+        html_content = self._read_web_file(html_file_path)
+        if html_content is None:
+            return self.queue_404_response(conn_id)
+        return self._queue_response(conn_id, self._web_file_parts(html_content))
+
+    def queue_ok_response(self, conn_id):
+        return self._queue_response(conn_id, [self._ok_response()], close=False)
 
-            return headers, request_body, conn_id
+    def queue_404_response(self, conn_id):
+        return self._queue_response(conn_id, [self._not_found_response()], close=False)
 
-        return None, response, None
+    def _queue_response(self, conn_id, parts, close=True):
+        link = self.links.get(conn_id)
+        if link is None:
+            self.logger_wifi_server.error(f"Link {conn_id} closed, response dropped")
+            return False
+        link.respond(self._batched(parts), close)
+        return True
+
+    def is_responding(self):
+        for link in self.links.values():
+            if link.state in (http_link.RESPONDING, http_link.CLOSING):
+                return True
+        return False
+
+    def service_links(self):
+        """
+        One round over the links with a queued response: each sends its
+        next payload, and the links whose response is complete are closed.
+        Returns True while responses are left.
+        """
+        for conn_id in sorted(self.links):
+            link = self.links.get(conn_id)
+            if link is not None:
+                self._service_link(link)
+        return self.is_responding()
+
+    def _service_link(self, link):
+        """
+        Send the next payload of the link, or close it once its response is
+        complete. Returns False when sending failed.
+        """
+        sent = True
+        if link.state == http_link.RESPONDING:
+            payload = link.next_payload()
+            if payload is not None and not self.send_data(link.conn_id, payload):
+                self.logger_wifi_server.error("Failed to send chunk. ")
+                link.state = http_link.CLOSING
+                sent = False
+        if link.state == http_link.CLOSING:
+            if not self.wait_sent(link.conn_id):
+                self.logger_wifi_server.error("Chunks not acknowledged. ")
+                sent = False
+            self.close_connection(link.conn_id)
+            self._close_link_state(link)
+        return sent
+
+    def _close_link_state(self, link):
+        link.state = http_link.CLOSED
+        if self.links.get(link.conn_id) is link:
+            del self.links[link.conn_id]
+
+    def _flush_link(self, conn_id):
+        """
+        Send the whole queued response of one link.
+        """
+        link = self.links.get(conn_id)
+        sent = link is not None
+        while sent and link.state in (http_link.RESPONDING, http_link.CLOSING):
+            sent = self._service_link(link)
+        return sent
 
     def send_web_file(self, conn_id, html_file_path):
+        html_content = self._read_web_file(html_file_path)
+        if html_content is None:
+            self.send_404_response(conn_id)
+            return False
+
+        self._queue_response(conn_id, self._web_file_parts(html_content))
+        if not self._flush_link(conn_id):
+            return False
+
+        self.logger_wifi_server.info("Final chunk sent.")
+        return True
+
+    def _read_web_file(self, html_file_path):
         try:
-            with open(html_file_path, "r") as html_file:
-                html_content = html_file.read()
+            with open(html_file_path, "rb") as html_file:
+                return html_file.read()
         except OSError as e:
             self.logger_wifi_server.error(f"Failed to read HTML file: {e}")
-            self.send_404_response(conn_id)
-            return False
+            return None
 
-        http_header = (
+    def _web_file_parts(self, html_content):
+        """
+        The chunked HTTP response for a file (bytes), piece by piece. The
+        pieces are batched into CIPSEND payloads when queued.
+        """
+        yield (
             "HTTP/1.1 200 OK"
             + self.server_line_separator
             + "Content-Type: text/html"
@@ -84,61 +217,38 @@ class web_server(wifi_module):
             + self.server_line_separator * 2
         )
 
-        header_response = self._send_response(conn_id, http_header)
-        if header_response is False:
-            return False
-
+        content = memoryview(html_content)
         max_chunk_size = self.UART_RX_BUFFER_LENGTH - 16
-        for i in range(0, len(html_content), max_chunk_size):
-            chunk = html_content[i : i + max_chunk_size]
-
-            chunk_data = (
-                f"{len(chunk):X}{self.server_line_separator}{chunk}{self.server_line_separator*2}"
-            )
-            chunk_response = self._send_response(conn_id, chunk_data)
-            if chunk_response is False:
-                return False
+        for i in range(0, len(content), max_chunk_size):
+            chunk = content[i : i + max_chunk_size]
+            yield f"{len(chunk):X}{self.server_line_separator}"
+            yield chunk
+            yield self.server_line_separator
 
-        final_response = self._send_response(conn_id, "0" + self.server_line_separator)
-        if final_response is False:
-            self.logger_wifi_server.error("Failed to send final chunk. ")
-            return False
+        yield "0" + self.server_line_separator * 2
 
-        self.logger_wifi_server.info("Final chunk sent.")
+    def send_ok_response(self, conn_id):
+        self.queue_ok_response(conn_id)
+        return self._flush_link(conn_id)
 
-        self.close_connection(conn_id)
+    def send_404_response(self, conn_id):
+        self.queue_404_response(conn_id)
+        return self._flush_link(conn_id)
 
-    def send_ok_response(self, conn_id):
-        html_response = (
+    def _ok_response(self):
+        return (
             "HTTP/1.1 200 OK"
             + self.server_line_separator
             + "Content-Length: 2"
             + self.server_line_separator * 2
             + "OK"
         )
-        self._send_response(conn_id, html_response)
 
-    def send_404_response(self, conn_id):
-        html_response = (
+    def _not_found_response(self):
+        return (
             "HTTP/1.1 404 Not Found"
             + self.server_line_separator
             + "Content-Length: 9"
             + self.server_line_separator * 2
             + "Not Found"
         )
-        self._send_response(conn_id, html_response)
-
-    def _send_response(self, conn_id, response):
-        """
-        Send an HTTP response to the client.
-        """
-        tx_data = f"AT+CIPSEND={conn_id},{len(response)}{self.server_line_separator}"
-        ret_data = self._send_and_receive_command(tx_data)
-
-        if "> " in str(ret_data):
-            return self._send_and_receive_command(response)
-        else:
-            self.logger_wifi_server.critical(
-                "Failed to send HTTP response: " + str(ret_data)
-            )
-            return False
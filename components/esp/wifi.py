@@ -1,3 +1,4 @@
+import time
 import ure
 
 from components.esp.espmodule import ESPMODULE
@@ -5,9 +6,10 @@ from components.esp.errors import (
     http_connection_fail,
     http_command_fail,
     http_response_invalid,
+    http_response_empty,
     at_set,
 )
-from components.esp.response_parser import response_parser
+from components.esp.response_parser import response_parser, http_response_reader
 from lib.logging import getLogger, handlers, StreamHandler
 
 
@@ -20,6 +22,23 @@ class wifi_module(ESPMODULE):
     ESP8266_WIFI_AP_NOT_PRESENT = "WIFI AP NOT FOUND"
     ESP8266_WIFI_AP_WRONG_PWD = "WIFI AP WRONG PASSWORD"
     log_file = "espwifilog.txt"
+    HTTP_IDLE_TIMEOUT = 0.1
+    # Milliseconds a query answer stays valid, None for static answers.
+    QUERY_TTL = {
+        "AT+CWJAP?": 10000,
+        "AT+CIFSR": 60000,
+        "AT+GMR": None,
+        "AT+CLAC": None,
+    }
+    CONNECTION_QUERIES = ("AT+CWJAP?", "AT+CIFSR")
+    WIFI_EVENTS = (b"WIFI CONNECTED", b"WIFI GOT IP", b"WIFI DISCONNECT")
+    # Largest payload of one CIPSEND; longer data is sent in segments.
+    MAX_SEND_LENGTH = 2048
+    # Bytes pulled by one AT+CIPRECVDATA unless the caller asks for fewer:
+    # the reply has to fit the UART RX buffer.
+    RECV_DATA_LENGTH = ESPMODULE.UART_RX_BUFFER_LENGTH - 64
+    SEND_OK_STATUS = b"SEND OK"
+    SEND_FAIL_STATUS = b"SEND FAIL"
 
     def __init__(self, wifi_ssid, wifi_pass, uart_tx, uart_rx, baudrate=None):
         super().__init__(uart_tx, uart_rx, baudrate)
@@ -30,6 +49,62 @@ class wifi_module(ESPMODULE):
         self.logger_wifi_module.addHandler(handlers.RotatingFileHandler(self.log_file))
         self.logger_wifi_module.addHandler(StreamHandler())
         self.parser = response_parser()
+        self._query_cache = {}
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self.wifi_state = None
+        for event in self.WIFI_EVENTS:
+            self.add_urc_handler(event, self._on_wifi_event)
+        self.passive_receive = False
+        # None until AT+CLAC tells whether AT+CIPSENDBUF is there
+        self.send_buffered = None
+        self._unacked = {}
+        self._send_failed = set()
+        self.add_urc_handler(self.SEND_OK_STATUS, self._on_send_ack, True)
+        self.add_urc_handler(self.SEND_FAIL_STATUS, self._on_send_ack, True)
+        self.add_urc_handler(self.CLOSED_STATUS, self._forget_sends, True)
+
+    def _on_wifi_event(self, urc, link):
+        """
+        Keep the last WIFI event; the answers about the connection that are
+        cached may be stale after any of them.
+        """
+        self.wifi_state = str(urc, "utf-8")
+        self.invalidate_query_cache(*self.CONNECTION_QUERIES)
+
+    def _cached_query(self, at_command, attempts=10, ttl=None):
+        """
+        Answer a side effect free query from the cache while its entry is
+        younger than QUERY_TTL (or ttl, for a query not listed there),
+        otherwise ask the ESP. Only answers that end in OK are kept.
+        """
+        entry = self._query_cache.get(at_command)
+        if entry is not None:
+            ttl = self.QUERY_TTL.get(at_command, ttl)
+            if ttl is None or time.ticks_diff(time.ticks_ms(), entry[1]) < ttl:
+                self.query_cache_hits += 1
+                return entry[0]
+        self.query_cache_misses += 1
+        ret_data = self._send_and_receive_command(at_command, attempts)
+        if self.ESP8266_OK_STATUS in ret_data:
+            self._query_cache[at_command] = (ret_data, time.ticks_ms())
+        return ret_data
+
+    def invalidate_query_cache(self, *at_commands):
+        """
+        Drop the given queries from the cache, or all of them.
+        """
+        if not at_commands:
+            self._query_cache.clear()
+        for at_command in at_commands:
+            self._query_cache.pop(at_command, None)
+
+    def query_cache_stats(self):
+        return {
+            "hits": self.query_cache_hits,
+            "misses": self.query_cache_misses,
+            "entries": len(self._query_cache),
+        }
 
     def pre_connect(self):
         try:
@@ -62,6 +137,8 @@ class wifi_module(ESPMODULE):
             + ""
         )
         self.initialized = False
+        self.invalidate_query_cache(*self.CONNECTION_QUERIES)
+        self.wifi_state = None
 
         try:
             ret_data = self._send_and_receive_command(tx_data)
@@ -69,10 +146,11 @@ class wifi_module(ESPMODULE):
             self.logger_wifi_module.exception(str(e))
             return None
 
-        if self.ESP8266_WIFI_CONNECTED in ret_data:
-            if self.ESP8266_WIFI_GOT_IP_CONNECTED in ret_data:
-                self.initialized = True
-                return self.ESP8266_WIFI_CONNECTED
+        # the WIFI lines come as URCs while the command runs
+        if self.wifi_state == self.ESP8266_WIFI_GOT_IP_CONNECTED:
+            self.initialized = True
+            return self.ESP8266_WIFI_CONNECTED
+        if self.wifi_state == self.ESP8266_WIFI_CONNECTED:
             return self.ESP8266_WIFI_DISCONNECTED
 
         if "+CWJAP" in ret_data:
@@ -96,7 +174,7 @@ class wifi_module(ESPMODULE):
         self.logger_wifi_module.debug("Checking Wi-Fi connection...")
         tx_data = "AT+CWJAP?"
         try:
-            ret_data = self._send_and_receive_command(tx_data)
+            ret_data = self._cached_query(tx_data)
             if (
                 ret_data
                 and self.ESP8266_OK_STATUS in ret_data
@@ -136,10 +214,84 @@ class wifi_module(ESPMODULE):
     def reset(self):
         # tx_data = "AT+RST"
         tx_data = "AT+RESTORE"
+        self.invalidate_query_cache()
         ret_data = self._send_and_receive_command(tx_data)
 
         if self.ESP8266_OK_STATUS not in ret_data:
             raise at_set("reset", tx_data)
+        # the factory settings include the UART rate
+        self._set_uart_baudrate(self.DEFAULT_BAUDRATE)
+        self.passive_receive = False
+        self.available = {}
+
+    def set_passive_receive(self, passive=True):
+        """
+        With passive, the ESP keeps what the links receive and only reports
+        how much arrived: receive_data pulls it, so nothing reaches the UART
+        faster than the Pico asks for it. It applies to every link.
+        """
+        tx_data = "AT+CIPRECVMODE=" + ("1" if passive else "0")
+        ret_data = self._send_and_receive_command(tx_data)
+
+        if self.ESP8266_OK_STATUS not in ret_data:
+            raise at_set("passive receive", tx_data)
+        self.passive_receive = passive
+
+    def receive_data(self, conn_id=None, size=None):
+        """
+        Pull up to size bytes (RECV_DATA_LENGTH by default) the link holds
+        in the ESP. They go to the link consumer; returns their count.
+        """
+        if size is None:
+            size = self.RECV_DATA_LENGTH
+        notified = self.available.get(conn_id, 0)
+        received = self._payload_received
+        self._recv_link = conn_id
+        tx_data = (
+            f"AT+CIPRECVDATA={conn_id},{size}"
+            if conn_id is not None
+            else f"AT+CIPRECVDATA={size}"
+        )
+        self._send_and_receive_command(tx_data)
+        count = self._payload_received - received
+
+        available = self.available.get(conn_id, 0)
+        if count < size:
+            # drained: only what was reported meanwhile is left
+            available -= notified
+        else:
+            available -= count
+        self.available[conn_id] = max(0, available)
+        return count
+
+    def _receive_passive(self, conn_id, timeout=10, idle=None, size=None, done=None):
+        """
+        Pull what the link receives until it is closed and drained, or until
+        done() returns True. Returns False when timeout seconds pass or the
+        link is idle for as long as idle() says (seconds, or None) first.
+        """
+        start_time = time.ticks_ms()
+        pulled = False
+        finished = lambda: conn_id not in self.open_links or (
+            done is not None and done()
+        )
+        while True:
+            if self.available.get(conn_id):
+                pulled = self.receive_data(conn_id, size) > 0 or pulled
+                if done is not None and done():
+                    return True
+                continue
+            if finished():
+                return True
+            wait = timeout - time.ticks_diff(time.ticks_ms(), start_time) / 1000
+            quiet = idle() if pulled and idle is not None else None
+            if quiet is not None:
+                wait = min(wait, quiet)
+            if wait <= 0 or not self._receive_frames(
+                lambda: self.available.get(conn_id) or finished(),
+                wait,
+            ):
+                return False
 
     def set_server(self, is_server=1):
         tx_data = f"AT+CIPSERVER={is_server}"  # set server
@@ -157,19 +309,19 @@ class wifi_module(ESPMODULE):
 
     def get_at_commands(self):
         tx_data = "AT+CLAC"
-        ret_data = self._send_and_receive_command(tx_data, 5)
+        ret_data = self._cached_query(tx_data, 5)
         if ret_data is not self.ESP8266_ERROR_STATUS:
             return ret_data
         return None
 
     def get_esp_version(self):
-        ret_data = self._send_and_receive_command("AT+GMR", 5)
+        ret_data = self._cached_query("AT+GMR", 5)
         if self.ESP8266_ERROR_STATUS not in ret_data:
             return ret_data
         return None
 
     def get_ip(self):
-        ret_data = self._send_and_receive_command("AT+CIFSR")
+        ret_data = self._cached_query("AT+CIFSR")
         if self.ESP8266_OK_STATUS not in ret_data:
             return False
         ret_data = str(ret_data)
@@ -182,9 +334,15 @@ class wifi_module(ESPMODULE):
 
         return None
 
-    def create_tcp_connection(self, host, port, is_ssl=False, keepalive=10, attempt=0):
+    def create_tcp_connection(
+        self, host, port, is_ssl=False, keepalive=10, attempt=0, conn_id=None
+    ):
+        """
+        Connect to host:port, on link conn_id with multiple connections.
+        """
         tx_data = (
             "AT+CIPSTART="
+            + ("" if conn_id is None else str(conn_id) + ",")
             + '"'
             + ("TCP" if (not is_ssl) else "SSL")
             + '"'
@@ -202,13 +360,14 @@ class wifi_module(ESPMODULE):
         if not response or self.ESP8266_OK_STATUS not in response:
             if "ALREADY CONNECTED" in response:
                 self.logger_wifi_module.debug("Already connected")
+                self.open_links.add(conn_id)
                 return True
             if attempt < 3:
                 self.logger_wifi_module.error(
                     f"TCP connection failed:{response}{self.line_separator},retry:{str(attempt + 1) }/3"
                 )
                 return self.create_tcp_connection(
-                    host, port, is_ssl, keepalive, attempt + 1
+                    host, port, is_ssl, keepalive, attempt + 1, conn_id
                 )
             raise http_connection_fail(host, port)
         return True
@@ -223,29 +382,209 @@ class wifi_module(ESPMODULE):
         )
         ret_data = self._send_and_receive_command(tx_data)
 
-        if "CLOSED" in ret_data:
+        # the CLOSED line is a URC, it has already updated open_links
+        if self.ESP8266_OK_STATUS in ret_data and conn_id not in self.open_links:
             self.logger_wifi_module.info("Connection closed successfully.")
         else:
             self.logger_wifi_module.error("Failed to close connection.")
 
-    def send_http_command(self, command, conn_id=None, parse=False):
-        tx_data = (
-            f"AT+CIPSEND={conn_id},{len(command)}"
-            if conn_id is not None
-            else f"AT+CIPSEND={len(command)}"
+    def supports_send_buffer(self):
+        """
+        Whether the firmware has AT+CIPSENDBUF, asked once through the
+        cached AT+CLAC.
+        """
+        if self.send_buffered is None:
+            commands = self.get_at_commands()
+            self.send_buffered = commands is not None and "AT+CIPSENDBUF" in commands
+        return self.send_buffered
+
+    def send_data(self, conn_id, data, buffered=None):
+        """
+        Send data (bytes, bytearray, memoryview or str, sent as UTF-8) on a
+        link, in segments of at most MAX_SEND_LENGTH bytes. The lengths given
+        to the ESP are byte counts and the payload is written as is.
+
+        With buffered (by default: on a multiple connection link, when the
+        firmware supports it) segments go through AT+CIPSENDBUF, which
+        returns once the ESP has buffered the data instead of waiting for
+        the peer to acknowledge it, so the next segment follows at once.
+        Call wait_sent before closing the link. Returns True when every
+        segment was accepted.
+        """
+        if buffered is None:
+            buffered = conn_id is not None and self.supports_send_buffer()
+        view = memoryview(self._to_bytes(data))
+        for start in range(0, len(view), self.MAX_SEND_LENGTH):
+            segment = view[start : start + self.MAX_SEND_LENGTH]
+            if not self._send_segment(conn_id, segment, buffered):
+                return False
+        return True
+
+    def send_batched(self, conn_id, parts, buffered=None):
+        """
+        Send the concatenation of parts with as few CIPSEND as possible.
+        """
+        for batch in self._batched(parts):
+            if not self.send_data(conn_id, batch, buffered):
+                return False
+        return True
+
+    def wait_sent(self, conn_id, timeout=10):
+        """
+        Wait until the peer acknowledged every buffered segment sent on the
+        link. Returns False on timeout or when one of them failed.
+        """
+        self._receive_frames(lambda: not self._unacked.get(conn_id), timeout)
+        return self._all_sent(conn_id)
+
+    def _all_sent(self, conn_id):
+        if conn_id in self._send_failed:
+            self._send_failed.remove(conn_id)
+            return False
+        return not self._unacked.get(conn_id)
+
+    def _send_segment(self, conn_id, segment, buffered):
+        ret_data = self._send_and_receive_command(
+            self._send_request(conn_id, len(segment), buffered),
+            terminators=self.PROMPT_RESPONSES,
         )
+        if "> " not in ret_data:
+            self.logger_wifi_module.error("Send refused: " + ret_data)
+            return False
 
-        ret_data = self._send_and_receive_command(tx_data)
+        self.uart.write(segment)
+        received, terminators = self._send_confirmation(len(segment), buffered)
+        ret_data = str(self._read_response(terminators), "utf-8")
+        return self._segment_sent(conn_id, ret_data, received, buffered)
 
-        if "> " in ret_data:
-            response = self._send_and_receive_command(command)
-            if response is None:
-                raise http_response_invalid("Empty response")
-            (header, body, status_code) = self.parser.parse_http(response, parse)
+    def _send_request(self, conn_id, length, buffered):
+        command = "AT+CIPSENDBUF" if buffered else "AT+CIPSEND"
+        if conn_id is None:
+            return f"{command}={length}"
+        return f"{command}={conn_id},{length}"
 
-            if status_code != 200:
-                raise http_response_invalid(body)
+    def _send_confirmation(self, length, buffered):
+        """
+        The text telling that a payload was taken, and the lines that end
+        the wait for it: a buffered segment is taken once the ESP holds it.
+        """
+        if buffered:
+            received = "Recv {} bytes".format(length)
+            return received, (received.encode(), b"ERROR")
+        return "SEND OK", self.SEND_RESPONSES
+
+    def _segment_sent(self, conn_id, ret_data, received, buffered):
+        if received not in ret_data:
+            self.logger_wifi_module.error("Send failed: " + ret_data)
+            return False
+        if buffered:
+            self._unacked[conn_id] = self._unacked.get(conn_id, 0) + 1
+        return True
 
-            return (header, body, status_code)
-        else:
-            raise http_command_fail(command)
+    def _batched(self, parts):
+        """
+        The bytes of parts cut in pieces of MAX_SEND_LENGTH, the last one
+        shorter: small parts share a CIPSEND.
+        """
+        batch = bytearray()
+        for part in parts:
+            view = memoryview(self._to_bytes(part))
+            while len(view):
+                room = self.MAX_SEND_LENGTH - len(batch)
+                batch.extend(view[:room])
+                view = view[room:]
+                if len(batch) == self.MAX_SEND_LENGTH:
+                    yield batch
+                    batch = bytearray()
+        if batch:
+            yield batch
+
+    def _to_bytes(self, data):
+        if isinstance(data, str):
+            return data.encode("utf-8")
+        return data
+
+    def _on_send_ack(self, urc, conn_id):
+        """
+        "<id>,<segment>,SEND OK" (or SEND FAIL) for a buffered segment.
+        """
+        unacked = self._unacked.get(conn_id, 0)
+        if unacked > 0:
+            self._unacked[conn_id] = unacked - 1
+        if urc == self.SEND_FAIL_STATUS:
+            self._send_failed.add(conn_id)
+
+    def _forget_sends(self, urc, conn_id):
+        self._unacked.pop(conn_id, None)
+        self._send_failed.discard(conn_id)
+
+    def send_http_command(self, command, conn_id=None, parse=False, timeout=10):
+        """
+        Send an HTTP request on the link and read the response until its
+        body is complete, as Content-Length or the chunk framing tell, or
+        until the link closes when it says neither. A keep-alive link is
+        left open for the next request.
+        """
+        body = bytearray()
+        reader = http_response_reader(body.extend)
+        self._http_exchange(conn_id, command, reader, timeout)
+        self._check_response(reader)
+        (header, body, status_code) = self.parser.http_result(reader, body, parse)
+
+        if status_code != 200:
+            raise http_response_invalid(body)
+
+        return (header, body, status_code)
+
+    def send_http_stream(self, command, stream, conn_id=None, timeout=10):
+        """
+        send_http_command for bodies too large to hold: the response is fed
+        to stream (an http_stream) as it arrives. Returns (header, body
+        length, status_code).
+        """
+        self._http_exchange(conn_id, command, stream, timeout)
+        stream.finish()
+        return self._stream_result(stream)
+
+    def _stream_result(self, stream):
+        self._check_response(stream)
+        if not stream.accepted():
+            raise http_response_invalid(stream.status_code)
+
+        return (stream.header, stream.received, stream.status_code)
+
+    def _check_response(self, reader):
+        if reader.header is None:
+            if not reader.head:
+                raise http_response_empty()
+            raise http_response_invalid(reader.head)
+        if reader.framed() and not reader.complete():
+            raise http_response_invalid("Incomplete body")
+
+    def _http_exchange(self, conn_id, command, reader, timeout):
+        """
+        Send command on the link and feed what it receives to reader until
+        the link closes or the response is complete. A body that does not
+        say where it ends ends once the link is quiet for HTTP_IDLE_TIMEOUT;
+        one that does may stall for up to timeout.
+        """
+        idle = lambda: (
+            self.HTTP_IDLE_TIMEOUT
+            if reader.header is not None and not reader.framed()
+            else None
+        )
+        self.set_link_consumer(conn_id, lambda link, data: reader.feed(data))
+        try:
+            # the reply is awaited anyway: nothing to gain from buffering
+            if not self.send_data(conn_id, command, buffered=False):
+                raise http_command_fail(command)
+            if self.passive_receive:
+                self._receive_passive(conn_id, timeout, idle, done=reader.complete)
+            else:
+                self._receive_frames(
+                    lambda: conn_id not in self.open_links or reader.complete(),
+                    timeout=timeout,
+                    idle=idle,
+                )
+        finally:
+            self.set_link_consumer(conn_id, None)
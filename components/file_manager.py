@@ -1,4 +1,5 @@
 import os
+import time
 from lib.logging import getLogger, handlers, StreamHandler
 
 
@@ -6,6 +7,11 @@ class FileManager:
     """
     A class to update your MicroController with the latest version from a GitHub tagged release,
     optimized for low power usage.
+
+    Files are copied through one buffer of buffer_size bytes, reused for
+    every file (the rp2 flash block by default), and trees are walked
+    without recursion. file_stats() has what was copied, moved and
+    removed, and how long it took.
     """
 
     main_dir = ""
@@ -13,11 +19,18 @@ class FileManager:
     backup_dir = ""
     log_file = "file_manager.txt"
     supports_rename = False
+    BUFFER_LENGTH = 4096
 
-    def __init__(self, main_dir, new_version_dir, backup_dir):
+    def __init__(
+        self, main_dir, new_version_dir, backup_dir, buffer_size=BUFFER_LENGTH
+    ):
         self.main_dir = main_dir
         self.new_version_dir = new_version_dir
         self.backup_dir = backup_dir
+        self.buffer_size = buffer_size
+        self._buffer = None
+        # files copied, bytes copied, files moved, entries removed, ms
+        self._file_totals = (0, 0, 0, 0, 0)
 
         self.logger_file_manager = getLogger("file_manager")
         self.logger_file_manager.addHandler(handlers.RotatingFileHandler(self.log_file))
@@ -26,21 +39,61 @@ class FileManager:
             self.logger_file_manager.debug("rename supported")
             self.supports_rename = True
 
+    def file_stats(self):
+        copied, size, moved, removed, ms = self._file_totals
+        return {
+            "files": copied,
+            "bytes": size,
+            "moved": moved,
+            "removed": removed,
+            "ms": ms,
+        }
+
+    def _count(self, start, copied=0, size=0, moved=0, removed=0):
+        totals = self._file_totals
+        self._file_totals = (
+            totals[0] + copied,
+            totals[1] + size,
+            totals[2] + moved,
+            totals[3] + removed,
+            totals[4] + time.ticks_diff(time.ticks_ms(), start),
+        )
+
+    def _walk(self, directory, exclude=[]):
+        # (path, is_dir) of everything under directory, each directory
+        # before what it holds; a stack of the directories still to list
+        # stands in for recursion
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            # listed first: the caller may remove what it is given
+            for entry in list(os.ilistdir(current)):
+                path = self._join(current, entry[0])
+                if path in exclude or path.split("/")[0] in exclude:
+                    continue
+                is_dir = entry[1] == 0x4000
+                yield path, is_dir
+                if is_dir:
+                    pending.append(path)
+
     def _rmtree(self, directory, preserve=[]):
-        for entry in os.ilistdir(directory):
-            is_dir = entry[1] == 0x4000
-            path = directory + "/" + entry[0]
-            if directory == "":
-                path = entry[0]
+        start = time.ticks_ms()
+        directories = []
+        removed = 0
+        for path, is_dir in self._walk(directory, exclude=preserve):
             if is_dir:
-                self._rmtree(path, preserve)
+                directories.append(path)
             else:
-                if path.split("/")[0] not in preserve:
-                    self.logger_file_manager.debug(f"remove file: {path}")
-                    os.remove(path)
+                os.remove(path)
+                removed += 1
+        # the deepest first
+        directories.reverse()
         if directory.split("/")[0] not in preserve:
-            self.logger_file_manager.debug(f"remove directory: {directory}")
-            os.rmdir(directory)
+            directories.append(directory)
+        for path in directories:
+            os.rmdir(path)
+        self._count(start, removed=removed + len(directories))
+        self.logger_file_manager.debug(f"removed {directory}: {removed} files")
 
     def _os_supports_rename(self) -> bool:
         self._mk_dirs("otaUpdater/osRenameTest")
@@ -51,36 +104,35 @@ class FileManager:
 
     def _copy_directory(self, from_path, to_path, exclude=[]):
         self.logger_file_manager.debug(f"copy: {from_path} -> {to_path}")
-        # path = to_path.split("/")[0]
-        # if path == self.backup_dir or path == self.new_version_dir:
-        #     return
         if not self._exists_dir(to_path):
             self._mk_dirs(to_path)
-
-        for entry in os.ilistdir(from_path):
-            is_dir = entry[1] == 0x4000
-            path = from_path + "/" + entry[0]
-            if from_path == "":
-                path = entry[0]
+        prefix_length = len(self._join(from_path, ""))
+        for path, is_dir in self._walk(from_path, exclude):
+            target = self._join(to_path, path[prefix_length:])
             if is_dir:
-                if path.split("/")[0] not in exclude:
-                    self._copy_directory(path, to_path + "/" + entry[0])
+                self.mkdir(target)
             else:
-                if path not in exclude:
-                    self._copy_file(path, to_path + "/" + entry[0])
+                self._copy_file(path, target)
 
     def _copy_file(self, from_path, to_path):
-        self.logger_file_manager.debug(f"copy file: {from_path} -> {to_path}")
+        start = time.ticks_ms()
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(self.buffer_size))
+        buffer = self._buffer
+        size = 0
         try:
             with open(
                 from_path, "rb"
             ) as from_file:  # Use binary mode to handle non-text files
                 with open(to_path, "wb") as to_file:
-                    CHUNK_SIZE = 4096  # bytes (you can adjust this)
-                    data = from_file.read(CHUNK_SIZE)
-                    while data:
-                        to_file.write(data)
-                        data = from_file.read(CHUNK_SIZE)
+                    while True:
+                        count = from_file.readinto(buffer)
+                        if not count:
+                            break
+                        to_file.write(buffer[:count])
+                        size += count
+            self._count(start, copied=1, size=size)
+            return True
 
         except FileNotFoundError:
             self.logger_file_manager.exception(f"File not found: {from_path}")
@@ -90,11 +142,59 @@ class FileManager:
             )
         except Exception as e:
             self.logger_file_manager.exception(f"An error occurred: {e}")
+        return False
 
-    def _exists_dir(self, path) -> bool:
+    def _move_file(self, from_path, to_path):
+        start = time.ticks_ms()
         try:
-            os.listdir(path)
+            os.rename(from_path, to_path)
+        except OSError:
+            # FAT does not rename over an existing file; anything else is
+            # not fixed by removing to_path
+            if not (self._exists_file(from_path) and self._exists_file(to_path)):
+                raise
+            os.remove(to_path)
+            os.rename(from_path, to_path)
+        self._count(start, moved=1)
+
+    def _remove_file(self, path):
+        start = time.ticks_ms()
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self._count(start, removed=1)
+
+    def _list_files(self, directory, exclude=[]):
+        # the files under directory, as paths relative to it
+        prefix_length = len(self._join(directory, ""))
+        for path, is_dir in self._walk(directory, exclude):
+            if not is_dir:
+                yield path[prefix_length:]
+
+    def _exists_file(self, path) -> bool:
+        try:
+            os.stat(path)
             return True
+        except OSError:
+            return False
+
+    def _mk_parent_dirs(self, path: str):
+        parent = "/".join(path.split("/")[:-1])
+        if parent and not self._exists_dir(parent):
+            self._mk_dirs(parent)
+
+    def _join(self, directory, name):
+        if directory == "":
+            return name
+        return directory.rstrip("/") + "/" + name
+
+    def _exists_dir(self, path) -> bool:
+        # stat rather than listdir: nothing is read but the entry
+        if path == "":
+            return True
+        try:
+            return os.stat(path)[0] & 0x4000 != 0
         except Exception:
             return False
 
@@ -1,52 +1,106 @@
 from components.file_manager import FileManager
+from components.updater.manifest_manager import HashedFile
 import os
+import ujson
+import ustruct
 from lib.logging import getLogger, handlers, StreamHandler
 
+try:
+    import deflate
+except ImportError:
+    # firmware before 1.21: updates come file by file
+    deflate = None
+
+# a bundle is a zlib stream of records: this header, the path, the file
+BUNDLE_RECORD = "<IH"
+
 
 class BackupManager(FileManager):
     log_file = "backupmanager.txt"
+    supports_bundle = deflate is not None
+    # what a backup saved, and the files the update adds
+    journal_file = "journal.json"
+    # the version new_version_dir is downloading, and which files are done
+    download_journal_file = "download.json"
+    BUNDLE_BUFFER_LENGTH = 1024
 
-    def __init__(self, main_dir, new_version_dir, backup_dir):
-        super().__init__(main_dir, new_version_dir, backup_dir)
+    def __init__(
+        self,
+        main_dir,
+        new_version_dir,
+        backup_dir,
+        buffer_size=FileManager.BUFFER_LENGTH,
+    ):
+        super().__init__(main_dir, new_version_dir, backup_dir, buffer_size)
         self.logger_backup_manager = getLogger("backupmanager")
         self.logger_backup_manager.addHandler(
             handlers.RotatingFileHandler(self.log_file)
         )
         self.logger_backup_manager.addHandler(StreamHandler())
 
-    def create_backup(self):
+    def create_backup(self, files_list=None):
+        # only the files an update overwrites or deletes: the rest of
+        # main_dir is left as it is
         self.logger_backup_manager.debug(
             "creating backup {} -> {}...".format(self.main_dir, self.backup_dir),
         )
-        if self.supports_rename:
-            os.rename(self.main_dir, self.backup_dir)
-        else:
-            if not self._exists_dir(self.backup_dir):
-                self._mk_dirs(self.backup_dir)
-            self._copy_directory(
-                self.main_dir,
-                self.backup_dir,
-                exclude=[self.backup_dir, self.new_version_dir],
+        self.undo_unfinished()
+        if files_list is None:
+            files_list = self._list_files(
+                self.main_dir, exclude=[self.backup_dir, self.new_version_dir]
             )
-            self._rmtree(self.main_dir, preserve=[self.main_dir, self.backup_dir])
+        if self._exists_dir(self.backup_dir):
+            self._rmtree(self.backup_dir, preserve=[self.main_dir])
+        self._mk_dirs(self.backup_dir)
+        saved = []
+        added = []
+        for file_url in files_list:
+            main_path = self._join(self.main_dir, file_url)
+            if not self._exists_file(main_path):
+                added.append(file_url)
+                continue
+            backup_path = self._join(self.backup_dir, file_url)
+            self._mk_parent_dirs(backup_path)
+            if not self._copy_file(main_path, backup_path):
+                self.logger_backup_manager.error(f"Failed to back up {file_url}")
+                return False
+            saved.append(file_url)
+        # written last: without it there is nothing to undo
+        self._write_journal({"saved": saved, "added": added})
         self.logger_backup_manager.debug(
-            "Backup created at {} ...".format(self.backup_dir),
+            "Backup of {} files created at {} ...".format(len(saved), self.backup_dir),
         )
         return True
 
+    def undo_unfinished(self):
+        """
+        Put back what an update a reset cut short had changed, as its
+        journal says. Returns whether there was one.
+        """
+        if self._read_journal() is None:
+            return False
+        self.logger_backup_manager.info("Undoing an unfinished update")
+        return self.restore_backup()
+
     def restore_backup(self):
         self.logger_backup_manager.debug(
             "restoring backup  {} -> {}...".format(self.backup_dir, self.main_dir)
         )
-        if self.supports_rename:
-            os.rename(self.backup_dir, self.main_dir)
-        else:
-            self._copy_directory(
-                self.backup_dir,
-                self.main_dir,
-                exclude=[self.main_dir, self.new_version_dir],
-            )
-            self._rmtree(self.backup_dir, preserve=[self.main_dir])
+        journal = self._read_journal()
+        if journal is None:
+            self.logger_backup_manager.error("No backup journal to restore")
+            return False
+        for file_url in journal["saved"]:
+            backup_path = self._join(self.backup_dir, file_url)
+            if not self._exists_file(backup_path):
+                # moved back by a restore that a reset cut short
+                continue
+            main_path = self._join(self.main_dir, file_url)
+            self._mk_parent_dirs(main_path)
+            self._move_file(backup_path, main_path)
+        for file_url in journal["added"]:
+            self._remove_file(self._join(self.main_dir, file_url))
+        self.delete_backup()
         self.logger_backup_manager.debug(
             "Backup restored at {} ...".format(self.main_dir)
         )
@@ -56,7 +110,9 @@ class BackupManager(FileManager):
         self.logger_backup_manager.debug(
             "deleting backup  {}...".format(self.backup_dir)
         )
-        self._rmtree(self.backup_dir, preserve=[self.main_dir])
+        self._remove_file(self._journal_path())
+        if self._exists_dir(self.backup_dir):
+            self._rmtree(self.backup_dir, preserve=[self.main_dir])
         self.logger_backup_manager.debug(
             "Backup deleted at {} ...".format(self.main_dir)
         )
@@ -75,13 +131,35 @@ class BackupManager(FileManager):
         )
         return True
 
-    def create_new_version(self, files_list):
+    def create_new_version(self, files_list, index=None):
+        """
+        Make new_version_dir ready for the files of files_list. With the
+        index of the update (path: {"size", "sha256"}), what a download of
+        the same files left there, cut by a reset or a lost connection,
+        is kept. Returns (the files already downloaded, {file: bytes it
+        has} of the ones downloaded in part).
+        """
         self.logger_backup_manager.debug(
             "creating new version at  {} ...".format(self.new_version_dir)
         )
-
-        if self._exists_dir(self.new_version_dir):
+        complete = []
+        partial = {}
+        if not isinstance(index, dict):
+            index = None
+        journal = self._read_download_journal() if index else None
+        if journal is not None:
+            self._resume_new_version(files_list, index, journal, complete, partial)
+        elif self._exists_dir(self.new_version_dir):
             self._rmtree(self.new_version_dir)
+        if index:
+            self._mk_dirs(self.new_version_dir)
+            self._write_download_journal(
+                {
+                    file_url: [index[file_url]["sha256"], file_url in complete]
+                    for file_url in files_list
+                    if (index.get(file_url) or {}).get("sha256")
+                }
+            )
 
         directories_list = []
         for file_url in files_list:
@@ -91,27 +169,154 @@ class BackupManager(FileManager):
         directories_list = set(directories_list)
         for directory in directories_list:
             self._mk_dirs(directory)
+        return (complete, partial)
+
+    def record_download(self, files_list):
+        """
+        Mark the files of files_list downloaded whole in the download
+        journal: create_new_version keeps them.
+        """
+        journal = self._read_download_journal()
+        if journal is None:
+            return
+        for file_url in files_list:
+            if file_url in journal:
+                journal[file_url][1] = True
+        self._write_download_journal(journal)
 
-    def install_new_version(self):
+    def _resume_new_version(self, files_list, index, journal, complete, partial):
+        # a file stays when the journal has it for the same hash: whole
+        # once recorded, in part while it is shorter than the update's
+        journal_path = self._download_journal_path()
+        for file_url in list(
+            self._list_files(self.new_version_dir, exclude=[journal_path])
+        ):
+            path = self._join(self.new_version_dir, file_url)
+            entry = index.get(file_url) if file_url in files_list else None
+            state = journal.get(file_url)
+            if entry and state and state[0] == entry.get("sha256"):
+                size = os.stat(path)[6]
+                if state[1] and size == entry.get("size"):
+                    complete.append(file_url)
+                    continue
+                if not state[1] and 0 < size < entry.get("size", 0):
+                    partial[file_url] = size
+                    continue
+            self._remove_file(path)
+        self.logger_backup_manager.info(
+            "Resuming download: {} files complete, {} in part".format(
+                len(complete), len(partial)
+            )
+        )
+
+    def keep_from_backup(self, files_list):
+        # the files an update leaves unchanged stay where they are
+        return True
+
+    def unpack_new_version(self, bundle_path, files_list, hashes=None):
+        """
+        Write the files of files_list the bundle has into new_version_dir.
+        A file whose sha256 differs from the one hashes has for it is
+        removed. Returns the files unpacked whole and intact.
+        """
+        if hashes is None:
+            hashes = {}
+        self.logger_backup_manager.debug(
+            "unpacking {} -> {} ...".format(bundle_path, self.new_version_dir)
+        )
+        unpacked = []
+        header_length = ustruct.calcsize(BUNDLE_RECORD)
+        buffer = bytearray(self.BUNDLE_BUFFER_LENGTH)
+        view = memoryview(buffer)
+        with open(bundle_path, "rb") as bundle_file:
+            stream = deflate.DeflateIO(bundle_file, deflate.ZLIB)
+            while True:
+                header = stream.read(header_length)
+                if len(header) < header_length:
+                    break
+                (size, path_length) = ustruct.unpack(BUNDLE_RECORD, header)
+                file_url = str(stream.read(path_length), "utf-8")
+                # the files the update leaves unchanged are skipped
+                file_object = None
+                file_path = self.new_version_dir + "/" + file_url
+                if file_url in files_list:
+                    file_object = HashedFile(open(file_path, "wb"))
+                try:
+                    while size:
+                        count = stream.readinto(view[: min(size, len(buffer))])
+                        if not count:
+                            break
+                        if file_object is not None:
+                            file_object.write(view[:count])
+                        size -= count
+                finally:
+                    if file_object is not None:
+                        file_object.close()
+                if size:
+                    self.logger_backup_manager.error(
+                        "Bundle truncated at {}".format(file_url)
+                    )
+                    break
+                if file_object is None:
+                    continue
+                digest = file_object.hexdigest()
+                if hashes.get(file_url, digest) != digest:
+                    self.logger_backup_manager.error(
+                        "Hash mismatch in bundle for {}".format(file_url)
+                    )
+                    self._remove_file(file_path)
+                    continue
+                unpacked.append(file_url)
+        return unpacked
+
+    def install_new_version(self, removed_files=()):
         self.logger_backup_manager.info(
             "Installing new version at  {} -> {}...".format(
                 self.new_version_dir, self.main_dir
             )
         )
-        if self.supports_rename:
-            os.rename(self.new_version_dir, self.main_dir)
-        else:
-            if not self._exists_dir(self.new_version_dir):
-                self._mk_dirs(self.new_version_dir)
-            self._copy_directory(
-                self.new_version_dir,
-                self.main_dir,
-                exclude=[self.main_dir, self.backup_dir],
-            )
-            self._rmtree(
-                self.new_version_dir, preserve=[self.main_dir]
-            )
+        self._remove_file(self._download_journal_path())
+        # moved rather than copied: each file is written once
+        for file_url in list(self._list_files(self.new_version_dir)):
+            main_path = self._join(self.main_dir, file_url)
+            self._mk_parent_dirs(main_path)
+            self._move_file(self.new_version_dir + "/" + file_url, main_path)
+        for file_url in removed_files:
+            self._remove_file(self._join(self.main_dir, file_url))
+        # the update is done once its journal is gone: a reset before
+        # delete_backup must not make the next create_backup undo it
+        self._remove_file(self._journal_path())
+        self._rmtree(self.new_version_dir, preserve=[self.main_dir])
         self.logger_backup_manager.info(
             "Update installed, please reboot now",
         )
         return True
+
+    def _journal_path(self):
+        return self._join(self.backup_dir, self.journal_file)
+
+    def _download_journal_path(self):
+        return self._join(self.new_version_dir, self.download_journal_file)
+
+    def _read_journal(self):
+        return self._read_json(self._journal_path())
+
+    def _write_journal(self, journal):
+        self._write_json(self._journal_path(), journal)
+
+    def _read_download_journal(self):
+        return self._read_json(self._download_journal_path())
+
+    def _write_download_journal(self, journal):
+        self._write_json(self._download_journal_path(), journal)
+
+    def _read_json(self, path):
+        try:
+            with open(path, "r") as file:
+                return ujson.loads(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, data):
+        with open(path, "w") as file:
+            file.write(ujson.dumps(data))
@@ -0,0 +1,187 @@
+from lib.logging import getLogger, handlers, StreamHandler
+import os
+import time
+import ubinascii
+import uhashlib
+import ujson
+
+
+class HashedFile:
+    """
+    A file open for writing that takes the sha256 of the bytes written to
+    it as they go by, so what was downloaded is checked without being read
+    back. A hasher that already has the start of the file goes on from
+    there.
+    """
+
+    def __init__(self, file, hasher=None):
+        self.file = file
+        self.hasher = hasher or uhashlib.sha256()
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+    def hexdigest(self):
+        # once, after the last write: it ends the hash on MicroPython
+        return ubinascii.hexlify(self.hasher.digest()).decode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ManifestManager:
+    """
+    Tells which files of an update differ from the installed ones.
+
+    The update manifest (index.json) maps every path to its "size" and
+    "sha256". A path without a hash, or a manifest that is a plain list of
+    paths, is always downloaded. The hashes of the local files are kept in
+    manifest_file with the size and mtime they were taken at, so a file is
+    only read again after it changed.
+    """
+
+    log_file = "manifest_manager.txt"
+    HASH_BUFFER_LENGTH = 1024
+
+    def __init__(self, main_dir, manifest_file="manifest.json"):
+        self.main_dir = main_dir
+        self.manifest_file = manifest_file
+        # path -> [size, mtime, sha256]
+        self._hashes = None
+        self._hash_totals = (0, 0, 0)
+        self.logger_manifest_manager = getLogger("manifest_manager")
+        self.logger_manifest_manager.addHandler(
+            handlers.RotatingFileHandler(self.log_file)
+        )
+        self.logger_manifest_manager.addHandler(StreamHandler())
+
+    def changed_files(self, index):
+        changed = [
+            file_path for file_path in index if not self._matches(index, file_path)
+        ]
+        self.logger_manifest_manager.info(
+            f"{len(changed)} of {len(index)} files changed"
+        )
+        return changed
+
+    def removed_files(self, index):
+        """
+        The files of the installed update that index no longer has.
+        """
+        if self._hashes is None:
+            self._hashes = self._load()
+        return [file_path for file_path in self._hashes if file_path not in index]
+
+    def file_hash(self, file_path, stat=None):
+        """
+        The sha256 of an installed file as a hex string, from the cache
+        while its size and mtime are the ones it was taken at.
+        """
+        if stat is None:
+            stat = os.stat(self._path(file_path))
+        if self._hashes is None:
+            self._hashes = self._load()
+        key = [stat[6], stat[8]]
+        cached = self._hashes.get(file_path)
+        if cached and cached[:2] == key:
+            return cached[2]
+        digest = self._hash_file(self._path(file_path))
+        self._hashes[file_path] = key + [digest]
+        return digest
+
+    def save(self, index):
+        """
+        Record the hashes of a newly installed update. They come from the
+        manifest: the files were just written and are not read again.
+        """
+        hashes = {}
+        if isinstance(index, dict):
+            for file_path, entry in index.items():
+                if not entry or "sha256" not in entry:
+                    continue
+                stat = self._stat(file_path)
+                if stat is not None and stat[6] == entry.get("size", stat[6]):
+                    hashes[file_path] = [stat[6], stat[8], entry["sha256"]]
+        self._hashes = hashes
+        try:
+            with open(self._path(self.manifest_file), "w") as file:
+                file.write(ujson.dumps(hashes))
+        except OSError as e:
+            self.logger_manifest_manager.error(f"Failed to save manifest: {e}")
+            return False
+        return True
+
+    def open_download(self, path, offset=0):
+        """
+        Open path for a download as a HashedFile. With an offset, the
+        download goes on after the bytes the file has, which are hashed
+        first: the one read a resumed file costs.
+        """
+        if offset:
+            hasher = self._feed(uhashlib.sha256(), path)
+            return HashedFile(open(path, "ab"), hasher)
+        return HashedFile(open(path, "wb"))
+
+    def hash_stats(self):
+        files, size, ms = self._hash_totals
+        return {"files": files, "bytes": size, "ms": ms}
+
+    def _matches(self, index, file_path):
+        if not isinstance(index, dict):
+            return False
+        entry = index[file_path]
+        if not entry or "sha256" not in entry:
+            return False
+        stat = self._stat(file_path)
+        # a size that differs settles it without reading the file
+        if stat is None or stat[6] != entry.get("size", stat[6]):
+            return False
+        return self.file_hash(file_path, stat) == entry["sha256"]
+
+    def _hash_file(self, path):
+        return ubinascii.hexlify(self._feed(uhashlib.sha256(), path).digest()).decode()
+
+    def _feed(self, hasher, path):
+        start = time.ticks_ms()
+        buffer = bytearray(self.HASH_BUFFER_LENGTH)
+        view = memoryview(buffer)
+        size = 0
+        with open(path, "rb") as file:
+            while True:
+                count = file.readinto(buffer)
+                if not count:
+                    break
+                hasher.update(view[:count])
+                size += count
+        files, total, ms = self._hash_totals
+        self._hash_totals = (
+            files + 1,
+            total + size,
+            ms + time.ticks_diff(time.ticks_ms(), start),
+        )
+        return hasher
+
+    def _load(self):
+        try:
+            with open(self._path(self.manifest_file), "r") as file:
+                return ujson.loads(file.read())
+        except (OSError, ValueError):
+            return {}
+
+    def _stat(self, file_path):
+        try:
+            return os.stat(self._path(file_path))
+        except OSError:
+            return None
+
+    def _path(self, file_path):
+        if self.main_dir == "":
+            return file_path
+        return self.main_dir.rstrip("/") + "/" + file_path
@@ -0,0 +1,171 @@
+from components.updater.backup_manager import BackupManager
+
+SLOTS = ("slot_a", "slot_b")
+
+# written as the boot file of root_dir: it runs the version of the slot
+# the pointer names, and so does main.py, which is run from the slot too.
+# Without a slot, the version installed in root_dir runs: its own boot
+# file was moved aside to make room for this one
+LOADER = """import os
+
+try:
+    with open("{root}{pointer}") as pointer:
+        slot = "{root}" + pointer.read().strip()
+    os.stat(slot + "/boot.py")
+except OSError:
+    slot = None
+if slot:
+    os.chdir(slot)
+    boot_path = "boot.py"
+else:
+    boot_path = "{root}{legacy}"
+try:
+    with open(boot_path) as boot:
+        code = boot.read()
+except OSError:
+    code = None
+if code:
+    exec(code, {{"__name__": "boot"}})
+"""
+
+
+class SlotManager(BackupManager):
+    """
+    A/B installation: every version lives in a slot directory of root_dir
+    and the boot file (LOADER) runs the one pointer_file names. An update
+    is written into the other slot; installing it or rolling it back
+    rewrites the pointer and nothing else, so the running version is
+    neither copied nor deleted. Without a pointer, the version installed
+    in root_dir itself is the running one.
+    """
+
+    log_file = "slotmanager.txt"
+    pointer_file = "slot.txt"
+    boot_file = "boot.py"
+    # the boot file of the version installed in root_dir, once the loader
+    # has taken its place
+    legacy_boot_file = "boot_root.py"
+
+    def __init__(self, root_dir="/", buffer_size=BackupManager.BUFFER_LENGTH):
+        self.root_dir = root_dir
+        self.main_slot = self.active_slot()
+        self.new_slot = SLOTS[1] if self.main_slot == SLOTS[0] else SLOTS[0]
+        main_dir = self._slot_dir(self.main_slot)
+        super().__init__(
+            main_dir=main_dir,
+            new_version_dir=self._slot_dir(self.new_slot),
+            backup_dir=main_dir,
+            buffer_size=buffer_size,
+        )
+        # the slot a rollback goes back to
+        self.backup_slot = self.main_slot
+
+    def active_slot(self):
+        try:
+            with open(self._join(self.root_dir, self.pointer_file), "r") as file:
+                slot = file.read().strip()
+        except OSError:
+            return None
+        if slot in SLOTS:
+            return slot
+        return None
+
+    def create_backup(self, files_list=None):
+        # the running slot is the backup: it stays as it is
+        self.logger_backup_manager.debug(
+            "backup is the running version at {} ...".format(self.main_dir)
+        )
+        return True
+
+    def undo_unfinished(self):
+        # an update is written to the idle slot: a reset leaves nothing to undo
+        return False
+
+    def restore_backup(self):
+        self.logger_backup_manager.debug(
+            "restoring slot {} ...".format(self.backup_slot)
+        )
+        self._write_pointer(self.backup_slot)
+        self.main_slot = self.backup_slot
+        self.main_dir = self._slot_dir(self.main_slot)
+        return True
+
+    def delete_backup(self):
+        # the previous slot is kept to roll back to until the next update
+        return True
+
+    def delete_old_version(self):
+        return True
+
+    def keep_from_backup(self, files_list):
+        # the idle slot gets the files the update leaves unchanged
+        self.logger_backup_manager.debug(
+            "keeping {} files from {} ...".format(len(files_list), self.main_dir)
+        )
+        for file_url in files_list:
+            new_path = self.new_version_dir + "/" + file_url
+            self._mk_parent_dirs(new_path)
+            if not self._copy_file(self._join(self.main_dir, file_url), new_path):
+                # the idle slot lacks a file: it must not be installed
+                return False
+        return True
+
+    def install_new_version(self, removed_files=()):
+        self.logger_backup_manager.info(
+            "Installing new version at {} ...".format(self.new_version_dir)
+        )
+        self._remove_file(self._download_journal_path())
+        self._install_loader()
+        self._write_pointer(self.new_slot)
+        self.backup_slot = self.main_slot
+        self.backup_dir = self.main_dir
+        self.main_slot = self.new_slot
+        self.main_dir = self.new_version_dir
+        self.logger_backup_manager.info(
+            "Update installed, please reboot now",
+        )
+        return True
+
+    def _install_loader(self):
+        loader = LOADER.format(
+            root=self.root_dir.rstrip("/") + "/",
+            pointer=self.pointer_file,
+            legacy=self.legacy_boot_file,
+        )
+        path = self._join(self.root_dir, self.boot_file)
+        try:
+            with open(path, "r") as file:
+                current = file.read()
+        except OSError:
+            current = None
+        if current == loader:
+            return
+        if current is not None and self.main_slot is None:
+            # the version in root_dir still boots through the loader after
+            # a rollback to it
+            legacy_path = self._join(self.root_dir, self.legacy_boot_file)
+            self.logger_backup_manager.info(
+                "moving {} to {}".format(path, legacy_path)
+            )
+            self._move_file(path, legacy_path)
+        self.logger_backup_manager.info("writing slot loader to {}".format(path))
+        self._write_file(path, loader)
+
+    def _write_pointer(self, slot):
+        path = self._join(self.root_dir, self.pointer_file)
+        if slot is None:
+            self._remove_file(path)
+            return
+        self._write_file(path, slot)
+
+    def _write_file(self, path, data):
+        # written aside then renamed over: a reset leaves the old or the new
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as file:
+            file.write(data)
+        self._move_file(temporary_path, path)
+
+    def _slot_dir(self, slot):
+        if slot is None:
+            return self.root_dir
+        return self._join(self.root_dir, slot)
@@ -25,6 +25,8 @@ class UpdaterTestCase:
             update_port=3000,
             uart_tx=4,
             uart_rx=5,
+            # to new/ in the working directory, not to a slot at the root
+            slots=False,
         )
 
         # Test the _download_all_files method
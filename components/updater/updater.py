@@ -2,54 +2,181 @@ from components.esp.web_client import web_client
 from components.connection_manager import connect_process
 from components.updater.version_manager import get_version
 from components.updater.backup_manager import BackupManager
+from components.updater.manifest_manager import ManifestManager
+from components.updater.slot_manager import SlotManager
+from components.esp.errors import at_set
 
 from lib.logging import getLogger, handlers, StreamHandler
 import gc
+import os
 
 
 class updater:
     index_file="index.json"
     version_file = "version.json"
+    bundle_file = "update.bundle"
     log_file = "updater_log.txt"
+    # from this many files on, one bundle beats a request per file
+    BUNDLE_MIN_FILES = 4
 
 
     def __init__(
-        self, wifi_ssid, wifi_pass, update_url, update_port=80, uart_tx=4, uart_rx=5
+        self,
+        wifi_ssid,
+        wifi_pass,
+        update_url,
+        update_port=80,
+        uart_tx=4,
+        uart_rx=5,
+        baudrate=None,
+        download_links=web_client.DOWNLOAD_LINKS,
+        slots=True,
     ) -> None:
         self.update_url = update_url
         self.update_port = update_port
+        # files downloaded at once; 1 fetches them one by one over a
+        # transparent connection
+        self.download_links = download_links
         self.esp_process = web_client(
-            wifi_ssid=wifi_ssid, wifi_pass=wifi_pass, uart_tx=uart_tx, uart_rx=uart_rx
-        )
-        self.backup_manager = BackupManager(
-            main_dir="", backup_dir="backup", new_version_dir="new"
+            wifi_ssid=wifi_ssid,
+            wifi_pass=wifi_pass,
+            uart_tx=uart_tx,
+            uart_rx=uart_rx,
+            baudrate=baudrate,
         )
+        if slots:
+            # each version in a slot of its own: install is a pointer write
+            self.backup_manager = SlotManager(root_dir="/")
+        else:
+            self.backup_manager = BackupManager(
+                main_dir="", backup_dir="backup", new_version_dir="new"
+            )
+        self.manifest_manager = ManifestManager(main_dir=self.backup_manager.main_dir)
         self.logger_updater = getLogger("updater")
         self.logger_updater.addHandler(handlers.RotatingFileHandler(self.log_file))
         self.logger_updater.addHandler(StreamHandler())
 
-    def _download_all_files(self, files_list):
+    def _download_all_files(self, files_list, index=None):
         if files_list is None:
             files_list = []
         # files_list.reverse()
-        self.backup_manager.create_new_version(files_list)
+        # what an interrupted download of this update left is kept
+        (complete, partial) = self.backup_manager.create_new_version(
+            files_list, index
+        )
+        files_list = [file_url for file_url in files_list if file_url not in complete]
+        hashes = self._expected_hashes(files_list, index)
+        try:
+            if (
+                not complete
+                and not partial
+                and self._use_bundle(files_list)
+                and self._download_bundle(files_list, hashes)
+            ):
+                self.backup_manager.record_download(files_list)
+                return True
+            return self._download_files(files_list, partial, hashes)
+        finally:
+            self.esp_process.close_passthrough()
+            self.esp_process.close_keep_alive()
+
+    def _expected_hashes(self, files_list, index):
+        # the sha256 each file must have once downloaded, when index says
+        if not isinstance(index, dict):
+            return {}
+        hashes = {}
+        for file_url in files_list:
+            entry = index.get(file_url)
+            if entry and "sha256" in entry:
+                hashes[file_url] = entry["sha256"]
+        return hashes
+
+    def _verified(self, file_url, file_object, hashes):
+        """
+        Whether the file downloaded for file_url has the hash of the
+        update; one that differs is removed, and the update not installed.
+        """
+        digest = file_object.hexdigest()
+        if hashes.get(file_url, digest) == digest:
+            return True
+        self.logger_updater.error(f"Hash mismatch for {file_url}, update refused")
+        self.backup_manager._remove_file(
+            self.backup_manager.new_version_dir + "/" + file_url
+        )
+        return False
+
+    def _use_bundle(self, files_list):
+        return (
+            self.backup_manager.supports_bundle
+            and len(files_list) >= self.BUNDLE_MIN_FILES
+        )
+
+    def _download_bundle(self, files_list, hashes):
+        # the compressed bundle goes to flash as it arrives, then it is
+        # unpacked in one pass: deflate pulls its input from a stream
+        bundle_path = self.backup_manager.new_version_dir + "/" + self.bundle_file
+        self.logger_updater.info(f"downloading bundle: {self.bundle_file}")
+        try:
+            with open(bundle_path, "wb") as file_object:
+                (header, size, status_code) = self.esp_process.download(
+                    self.update_url + self.bundle_file,
+                    file_object.write,
+                    port=self.update_port,
+                    passthrough=True,
+                )
+            if status_code != 200:
+                self.logger_updater.info("No bundle found, downloading file by file")
+                return False
+            unpacked = self.backup_manager.unpack_new_version(
+                bundle_path, files_list, hashes
+            )
+        except Exception as e:
+            self.logger_updater.error(f"Failed to unpack bundle: {e}")
+            return False
+        finally:
+            try:
+                os.remove(bundle_path)
+            except OSError:
+                pass
+        missing = [file_url for file_url in files_list if file_url not in unpacked]
+        if missing:
+            self.logger_updater.error(f"Bundle is missing {len(missing)} files")
+            return False
+        self.logger_updater.info(
+            f"unpacked {len(unpacked)} files from a {size} bytes bundle"
+        )
+        return True
+
+    def _download_files(self, files_list, partial=None, hashes=None):
+        if partial is None:
+            partial = {}
+        if hashes is None:
+            hashes = {}
+        if self.download_links > 1:
+            return self._download_parallel(files_list, partial, hashes)
+        # one transparent connection carries every file
         for file_url in files_list:
             gc.collect()
             self.logger_updater.info(f"free memory: {gc.mem_free()}")
-            self.logger_updater.info(f"downloading file: {file_url}")
+            offset = partial.get(file_url, 0)
+            self.logger_updater.info(f"downloading file: {file_url} from {offset}")
             file_path = self.backup_manager.new_version_dir + "/" + file_url
 
-            (header, body, status_code) = self.esp_process.get_url_response(
-                self.update_url + file_url, port=self.update_port, parse=False
-            )
-            if status_code != 200:
-                self.logger_updater.error(f"Failed to download file: {file_url}")
-                return False
+            status_code = None
             try:
-                with open(file_path, "wb") as file_object:
+                with self.manifest_manager.open_download(
+                    file_path, offset
+                ) as file_object:
                     self.logger_updater.debug(f"file {file_path} open")
-                    file_content = body
-                    file_object.write(file_content)
+                    # written and hashed while it arrives: the file never
+                    # sits in RAM, nor is it read back to be checked
+                    (header, size, status_code) = self.esp_process.download(
+                        self.update_url + file_url,
+                        file_object.write,
+                        port=self.update_port,
+                        passthrough=True,
+                        offset=offset,
+                    )
             except OSError as e:
                 self.logger_updater.error(
                     f"Failed to write file {file_url}->{file_path}:" + str(e)
@@ -57,27 +184,99 @@ class updater:
                 return False
             except Exception as e:
                 self.logger_updater.error(f"An error occurred: {e}")
+            if status_code not in (200, 206):
+                self.logger_updater.error(f"Failed to download file: {file_url}")
+                return False
+            if not self._verified(file_url, file_object, hashes):
+                return False
+            self.backup_manager.record_download([file_url])
+        return True
+
+    def _download_parallel(self, files_list, partial, hashes):
+        gc.collect()
+        self.logger_updater.info(f"free memory: {gc.mem_free()}")
+        self.logger_updater.info(
+            f"downloading {len(files_list)} files over {self.download_links} links"
+        )
+        offsets = {
+            self.update_url + file_url: offset for file_url, offset in partial.items()
+        }
+        opened = {}
+        results = self.esp_process.download_parallel(
+            [self.update_url + file_url for file_url in files_list],
+            lambda url: self._open_new_file(url, offsets.get(url, 0), opened),
+            port=self.update_port,
+            links=self.download_links,
+            offsets=offsets,
+        )
+        done = []
+        failed = None
+        for file_url in files_list:
+            url = self.update_url + file_url
+            if results.get(url, (None,))[0] not in (200, 206):
+                failed = failed or file_url
+            elif self._verified(file_url, opened[url], hashes):
+                done.append(file_url)
+            else:
+                failed = failed or file_url
+        # one journal write for all the files done, even when one failed
+        self.backup_manager.record_download(done)
+        if failed is not None:
+            self.logger_updater.error(f"Failed to download file: {failed}")
+            return False
+        for file_url in files_list:
+            (status_code, size, ms) = results[self.update_url + file_url]
+            self.logger_updater.info(
+                f"downloaded {file_url}: {size} bytes in {ms} ms"
+                f" ({size / 1024 / (max(ms, 1) / 1000):.1f} KiB/s)"
+            )
+        stats = self.esp_process.download_stats()
+        self.logger_updater.info(
+            f"downloaded {stats['files']} files, {stats['bytes']} bytes in"
+            f" {stats['ms']} ms ({stats['kib_s']:.1f} KiB/s)"
+        )
         return True
 
+    def _open_new_file(self, url, offset, opened):
+        file_path = (
+            self.backup_manager.new_version_dir + "/" + url[len(self.update_url) :]
+        )
+        self.logger_updater.debug(f"file {file_path} open")
+        # a file downloaded in part gets the rest appended
+        opened[url] = self.manifest_manager.open_download(file_path, offset)
+        return opened[url]
+
     def update_process(self, files_list):
         self.logger_updater.info("Update found. Updating new version...")
-        if not self.backup_manager.create_backup():
+        # only the files whose hash differs from the installed ones
+        changed_files = self.manifest_manager.changed_files(files_list)
+        removed_files = self.manifest_manager.removed_files(files_list)
+        if not self.backup_manager.create_backup(changed_files + removed_files):
             self.logger_updater.error("Backup failed, aborting")
             return False
 
         try:
-            if not self._download_all_files(files_list):
+            if not self._download_all_files(changed_files, files_list):
                 self.logger_updater.error("Failed to download update, rolling back")
-                if self.backup_manager.restore_backup():
-                    self.logger_updater.info("Rolled back. booting old version...")
-                    return False
-                self.logger_updater.critical(
-                    "Rolled back failed, RUUUUN B1TCH, RUUUUN!!!!"
+                return self._roll_back()
+            if not self.backup_manager.keep_from_backup(
+                [file_url for file_url in files_list if file_url not in changed_files]
+            ):
+                self.logger_updater.error(
+                    "Failed to keep unchanged files, rolling back"
                 )
-                return False
+                return self._roll_back()
             # self.backup_manager.delete_old_version()
-            self.backup_manager.install_new_version()
+            self.backup_manager.install_new_version(removed_files)
+            self.manifest_manager.main_dir = self.backup_manager.main_dir
+            self.manifest_manager.save(files_list)
             self.backup_manager.delete_backup()
+            stats = self.backup_manager.file_stats()
+            self.logger_updater.info(
+                f"{stats['files']} files copied ({stats['bytes']} bytes),"
+                f" {stats['moved']} moved, {stats['removed']} removed"
+                f" in {stats['ms']} ms"
+            )
             # If everything goes well, return True
             self.logger_updater.info("Update process completed successfully")
             return True
@@ -85,33 +284,64 @@ class updater:
             self.logger_updater.error(f"Failed to update process: {e}")
             return False
 
+    def _roll_back(self):
+        # always False: the update did not happen
+        if self.backup_manager.restore_backup():
+            self.logger_updater.info("Rolled back. booting old version...")
+            return False
+        self.logger_updater.critical("Rolled back failed, RUUUUN B1TCH, RUUUUN!!!!")
+        return False
+
     def start_update(self):
+        # before the versions and hashes are read: a half installed update
+        # would pass for the new one
+        self.backup_manager.undo_unfinished()
         connect_process(self.esp_process)
         if not self.esp_process.is_initialized():
             self.logger_updater.error("No connection, update aborted.")
             return False
+        try:
+            # pull the responses: nothing is lost while the flash is written
+            self.esp_process.set_passive_receive()
+        except at_set as e:
+            self.logger_updater.info(f"Passive receive not available: {e}")
 
-        url = self.update_url+index_file
-        port = self.update_port
-        (header, body, status_code) = self.esp_process.get_url_response(
-            url, port, parse=True
-        )
-        if body == None:
-            self.logger_updater.error("No body found")
-            return False
-        if not get_version(
-            self.esp_process,
-            self.update_url,
-            self.update_port,
-            self.version_file,
-            body,
-        ):
-            self.logger_updater.info(
-                "No update found. Already updated to the last version"
+        try:
+            url = self.update_url + self.index_file
+            port = self.update_port
+            (header, body, status_code) = self.esp_process.get_url_response(
+                url, port, parse=True
             )
-            return False
-        if not self.update_process(body):
-            return False
+            if body == None:
+                self.logger_updater.error("No body found")
+                return False
+            if not get_version(
+                self.esp_process,
+                self.update_url,
+                self.update_port,
+                self.version_file,
+                body,
+            ):
+                self.logger_updater.info(
+                    "No update found. Already updated to the last version"
+                )
+                return False
+            if not self.update_process(body):
+                return False
 
-        self.logger_updater.info("Update succeded. booting new version...")
-        return True
+            self.logger_updater.info("Update succeded. booting new version...")
+            return True
+        finally:
+            self._restore_active_receive()
+
+    def _restore_active_receive(self):
+        # nothing resets the ESP before main.py: its web server would only
+        # get the +IPD notices of passive mode, and never the requests
+        if not self.esp_process.passive_receive:
+            return
+        try:
+            self.esp_process.close_passthrough()
+            self.esp_process.close_keep_alive()
+            self.esp_process.set_passive_receive(False)
+        except at_set as e:
+            self.logger_updater.error(f"Active receive not restored: {e}")
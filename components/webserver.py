@@ -1,5 +1,5 @@
-from components.esp.web_server import web_server
-import _thread
+from components.esp.async_web_server import async_web_server
+import uasyncio as asyncio
 import time
 from machine import Pin
 from lib.logging import getLogger, handlers, StreamHandler
@@ -16,8 +16,8 @@ class WebServer:
     def __init__(self, motor_control_instance, led_control_instance):
         self.motor_control_instance = motor_control_instance
         self.led_control_instance = led_control_instance
-        self.thread_id = None  # Store the thread ID
-        self.esp_process = web_server(
+        self.task = None  # Store the server task
+        self.esp_process = async_web_server(
             wifi_ssid="Pabloysofi", wifi_pass="jaimitoelperrito", uart_tx=4, uart_rx=5
         )
         self.last_request = ""
@@ -54,7 +54,11 @@ class WebServer:
         self.logger.error("Failed to start the web server.")
         return False
 
-    def start_web_server_thread(self):
+    def start_web_server_task(self):
+        """
+        Start the server and schedule it on the running event loop.
+        """
+        self.esp_process.negotiate_baudrate()
         wifi_connected = self.esp_process.is_wifi_connected()
         self.led_control_instance.set_led_state(wifi_connected)
         if not wifi_connected:
@@ -63,27 +67,34 @@ class WebServer:
         webserver_started = self.start_web_server()
 
         if webserver_started:
-            self.logger.debug("try to start threaded server")
-            self.thread_id = _thread.start_new_thread(self.handle_requests, ())
-            self.logger.info("threaded server started: " + str(self.thread_id))
+            self.logger.debug("try to start server task")
+            self.task = asyncio.create_task(self.handle_requests())
+            self.logger.info("server task started")
             return True
         else:
             self.logger.error("Webserver not started")
             return False
 
-    def is_web_server_thread_running(self):
-        # Check if the web server thread is running
-        if self.thread_id is not None:
+    def is_web_server_task_running(self):
+        # Check if the web server task is running
+        if self.task is not None:
             return True
         return False
 
     def get_last_request(self):
         return self.last_request, self.last_request_time
 
-    def handle_requests(self):
-        thread_log_file = "webserver_thread.txt"
-        logger = getLogger("webserver_thread")
-        logger.addHandler(handlers.RotatingFileHandler(thread_log_file))
+    async def handle_requests(self, poll_timeout=1):
+        """
+        Serve requests. Each wait for a request ends after poll_timeout
+        seconds, so other tasks can send commands to the ESP in between.
+        Responses are queued per link and sent a payload per link and
+        round, so a long page does not hold up the other clients; while
+        they are sent, only the requests already received are taken.
+        """
+        task_log_file = "webserver_task.txt"
+        logger = getLogger("webserver_task")
+        logger.addHandler(handlers.RotatingFileHandler(task_log_file))
 
         try:
             while True:
@@ -93,30 +104,35 @@ class WebServer:
                     self.led_control_instance.start_blinking()
                 # else:
                 #     self.led_control_instance.stop_blinking()
-                headers, request_body, conn_id = self.esp_process.handle_web_request()
-                if headers is None:
-                    if request_body is not None:
-                        logger.error(
-                            "Webserver error:" + str(request_body), thread_log_file
-                        )
-                    continue
-
-                self.last_request = str(headers)
-                self.last_request_time = time.time()
-                # log_message("Request: " + self.last_request, thread_log_file)
-                if headers.startswith("GET /up"):
-                    self.on_up_pressed()
-                    self.esp_process.send_ok_response(conn_id)
-                elif headers.startswith("GET /down"):
-                    self.on_down_pressed()
-                    self.esp_process.send_ok_response(conn_id)
-                elif headers.startswith("GET / "):
-                    file_path = "/html/index.html"
-                    self.esp_process.send_web_file(conn_id, file_path)
-                else:
-                    self.esp_process.send_404_response(conn_id)
+                responding = self.esp_process.is_responding()
+                headers, request_body, conn_id = await self.esp_process.receive_frame(
+                    0 if responding else poll_timeout
+                )
+                if headers is not None:
+                    self.handle_request(headers, conn_id)
+                if responding:
+                    await self.esp_process.service_links()
 
         except KeyboardInterrupt as e:
             logger.exception(e)
             self.led_control_instance.stop_blinking()
-            _thread.exit()
+            self.task = None
+
+    def handle_request(self, headers, conn_id):
+        """
+        Act on a request and queue its response.
+        """
+        self.last_request = str(headers)
+        self.last_request_time = time.time()
+        # log_message("Request: " + self.last_request, task_log_file)
+        if headers.startswith("GET /up"):
+            self.on_up_pressed()
+            self.esp_process.queue_ok_response(conn_id)
+        elif headers.startswith("GET /down"):
+            self.on_down_pressed()
+            self.esp_process.queue_ok_response(conn_id)
+        elif headers.startswith("GET / "):
+            file_path = "html/index.html"
+            self.esp_process.queue_web_file(conn_id, file_path)
+        else:
+            self.esp_process.queue_404_response(conn_id)
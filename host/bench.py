@@ -0,0 +1,786 @@
+"""
+Benchmark the ESP stack on the host against the simulated ESP-01.
+
+Usage::
+
+    python host/bench.py [--baudrate 115200] [--iterations 20] [scenario ...]
+
+Scenarios:
+
+* ``commands``: AT command round trips (``AT``, ``AT+CWJAP?``, ``AT+CIFSR``)
+* ``page``: serving ``html/index.html`` through ``web_server``
+* ``contention``: ``/up`` replies from ``async_web_server`` while another
+  task keeps probing the connection on the same UART
+* ``download``: fetching the files in ``index.json`` with ``web_client``
+* ``passive``: the same files pulled with ``AT+CIPRECVDATA``
+* ``passthrough``: the same files over one transparent (``AT+CIPMODE=1``)
+  connection, including the second it takes to leave it
+* ``parallel``: the same files written to disk by ``download_parallel``
+  over ``--links`` links
+* ``update``: ``updater._download_all_files`` into a scratch directory
+* ``delta``: ``updater.update_process`` of a scratch install where one
+  file changed, from a plain and from a hashed ``index.json``
+* ``bundle``: ``updater.update_process`` of an empty scratch install, file
+  by file and from ``update.bundle``
+* ``slots``: the ``delta`` update installed in place behind a backup of
+  the files it changes (``BackupManager``) and into the idle slot
+  (``SlotManager``)
+* ``resume``: ``updater.update_process`` of an empty scratch install
+  after a first attempt lost its connection halfway through the largest
+  file, from scratch and resuming from the download journal
+* ``files``: ``FileManager`` copying the files in ``index.json`` to a
+  scratch tree and removing it, with ``--buffer-size`` byte buffers
+* ``baudrate``: ``negotiate_baudrate`` from ``--baudrate`` on a cold and a
+  warm boot, then the ``download`` scenario at the rate it picked
+"""
+
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(HOST_DIR)
+for path in (ROOT_DIR, HOST_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import sitecustomize  # noqa: E402,F401
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import shutil  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+import machine  # noqa: E402
+from esp01 import ESP01, http_file_server  # noqa: E402
+from lib.logging import basicConfig, CRITICAL, DEBUG, ERROR, INFO  # noqa: E402
+
+WIFI_SSID = "bench"
+WIFI_PASS = "bench-pass"
+UPDATE_HOST = "homeassistant"
+UPDATE_PORT = 8123
+UPDATE_PREFIX = "/local/pico_curtains/"
+UPDATE_URL = "http://" + UPDATE_HOST + UPDATE_PREFIX
+
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "error": ERROR, "off": CRITICAL + 1}
+
+
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.errors = 0
+        self.bytes = 0
+        self.cpu = None
+        self._cpu_start = None
+
+    def start(self):
+        """
+        Measure the process CPU time from here to the next add().
+        """
+        self._cpu_start = time.process_time()
+
+    def add(self, seconds, ok=True, size=0):
+        if self._cpu_start is not None:
+            self.cpu = (self.cpu or 0.0) + time.process_time() - self._cpu_start
+            self._cpu_start = None
+        self.samples.append(seconds)
+        self.bytes += size
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def row(self):
+        count = len(self.samples)
+        if not count:
+            return "{:<28} {:>5}".format(self.name, 0)
+        total = sum(self.samples)
+        throughput = ""
+        if self.bytes:
+            throughput = "{:.1f}".format(self.bytes / total / 1024)
+        cpu = ""
+        if self.cpu is not None:
+            # process_time is coarser than perf_counter on short samples
+            cpu = "{:.0f}".format(min(self.cpu / total * 100, 100))
+        return "{:<28} {:>5} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9} {:>5}".format(
+            self.name,
+            count,
+            self.errors,
+            total / count * 1000,
+            self.percentile(0.5) * 1000,
+            self.percentile(0.95) * 1000,
+            max(self.samples) * 1000,
+            throughput,
+            cpu,
+        )
+
+
+HEADER = "{:<28} {:>5} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9} {:>5}".format(
+    "scenario",
+    "runs",
+    "errors",
+    "mean ms",
+    "p50 ms",
+    "p95 ms",
+    "max ms",
+    "KiB/s",
+    "cpu %",
+)
+
+
+def new_device(args):
+    machine.reset_devices()
+    esp = ESP01(
+        baudrate=args.baudrate,
+        ssid=WIFI_SSID,
+        password=WIFI_PASS,
+        command_latency=args.command_latency,
+        connect_latency=args.connect_latency,
+        server_latency=args.server_latency,
+        busy_rate=args.busy_rate,
+        seed=args.seed,
+        noise_baudrate=args.noise_baudrate,
+        noise_rate=args.noise_rate,
+        ack_latency=args.ack_latency / 1000.0,
+        sendbuf=not args.no_sendbuf,
+        dns_latency=args.dns_latency / 1000.0,
+    )
+    # the module keeps its association across Pico resets
+    esp.joined = WIFI_SSID
+    esp.echo = False
+    esp.add_host(UPDATE_HOST, UPDATE_PORT, http_file_server(ROOT_DIR, UPDATE_PREFIX))
+    machine.attach_uart(1, esp)
+    return esp
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+def bench_commands(args):
+    from components.esp.wifi import wifi_module
+
+    new_device(args)
+    wifi = wifi_module(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+    results = [
+        Result("AT"),
+        Result("AT+CWJAP? (connected)"),
+        Result("AT+CIFSR (ip)"),
+        Result("is_wifi_connected (cached)"),
+        Result("get_ip (cached)"),
+    ]
+    for _ in range(args.iterations):
+        results[0].start()
+        seconds, response = timed(wifi._send_and_receive_command, "AT")
+        results[0].add(seconds, response.strip().endswith("OK"))
+        wifi.invalidate_query_cache()
+        results[1].start()
+        seconds, connected = timed(wifi.is_wifi_connected)
+        results[1].add(seconds, connected is True)
+        results[2].start()
+        seconds, ip = timed(wifi.get_ip)
+        results[2].add(seconds, ip == "192.168.1.50")
+        results[3].start()
+        seconds, connected = timed(wifi.is_wifi_connected)
+        results[3].add(seconds, connected is True)
+        results[4].start()
+        seconds, ip = timed(wifi.get_ip)
+        results[4].add(seconds, ip == "192.168.1.50")
+    return results
+
+
+def bench_page(args):
+    from components.esp.web_server import web_server
+
+    esp = new_device(args)
+    server = web_server(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+    server.start_web_server(80)
+    with open(os.path.join(ROOT_DIR, "html", "index.html"), "rb") as file:
+        page = file.read()
+    request = (
+        "GET / HTTP/1.1\r\nHost: {}\r\nUser-Agent: bench\r\n\r\n".format(esp.ip)
+    ).encode()
+    result = Result("GET / (index.html)")
+    for _ in range(args.iterations):
+        result.start()
+        start = time.perf_counter()
+        link = esp.connect_client(request)
+        headers, body, conn_id = server.handle_web_request()
+        ok = headers is not None and headers.startswith("GET / ")
+        if ok:
+            server.send_web_file(conn_id, os.path.join(ROOT_DIR, "html", "index.html"))
+            machine.UART(1).flush()
+        seconds = time.perf_counter() - start
+        ok = ok and _dechunk(link.received) == page
+        result.add(seconds, ok, len(link.received))
+        if link.link_id in esp.links:
+            esp.close_link(link)
+        # drain the CLOSED notifications before the next request
+        server._receive_frames(lambda: False, timeout=0)
+    return [result]
+
+
+def bench_contention(args):
+    import uasyncio as asyncio
+    from components.esp.async_web_server import async_web_server
+    from components.esp.command_scheduler import command_scheduler
+
+    esp = new_device(args)
+    server = async_web_server(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+    server.start_web_server(80)
+    request = (
+        "GET /up HTTP/1.1\r\nHost: {}\r\nUser-Agent: bench\r\n\r\n".format(esp.ip)
+    ).encode()
+    reply = Result("GET /up (with probes)")
+    probe = Result("  AT+CWJAP? probe")
+
+    async def probes():
+        while True:
+            start = time.perf_counter()
+            response = await server.send_command(
+                "AT+CWJAP?", priority=command_scheduler.HOUSEKEEPING
+            )
+            probe.add(time.perf_counter() - start, "OK" in response)
+            await asyncio.sleep_ms(1)
+
+    async def clicks():
+        task = asyncio.create_task(probes())
+        for _ in range(args.iterations):
+            await asyncio.sleep_ms(5)
+            start = time.perf_counter()
+            link = esp.connect_client(request)
+            headers, body, conn_id = await server.receive_frame(2)
+            ok = headers is not None and headers.startswith("GET /up ")
+            ok = ok and await server.send_ok_response(conn_id)
+            reply.add(time.perf_counter() - start, ok, len(link.received))
+            await server.close_link(conn_id)
+        task.cancel()
+
+    asyncio.run(clicks())
+    if args.verbose:
+        print("scheduler: {} busy retries: {}".format(
+            server.scheduler.stats, server.busy_retries
+        ))
+    return [reply] + ([probe] if args.verbose else [])
+
+
+def _dechunk(data):
+    body = data.partition(b"\r\n\r\n")[2]
+    out = bytearray()
+    while body:
+        size, _, rest = body.partition(b"\r\n")
+        try:
+            length = int(size.strip() or b"0", 16)
+        except ValueError:
+            return bytes(out)
+        if not length:
+            break
+        out += rest[:length]
+        body = rest[length:].lstrip(b"\r\n")
+    return bytes(out)
+
+
+def _update_files():
+    with open(os.path.join(ROOT_DIR, "index.json")) as file:
+        return json.load(file)
+
+
+def bench_download(args, client=None, name="download (all files)", passthrough=False):
+    from components.esp.web_client import web_client
+
+    if client is None:
+        new_device(args)
+        client = web_client(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+    get = client.get_url_passthrough if passthrough else client.get_url_response
+    results = {}
+    total = Result(name)
+    for _ in range(args.iterations):
+        total.start()
+        start = time.perf_counter()
+        for name in _update_files():
+            with open(os.path.join(ROOT_DIR, name), "rb") as file:
+                expected = file.read()
+            seconds, (header, body, status) = timed(
+                get, UPDATE_URL + name, port=UPDATE_PORT
+            )
+            ok = status == 200 and body is not None and body.encode() == expected
+            results.setdefault(name, Result("  " + name)).add(seconds, ok, len(expected))
+            total.bytes += len(expected)
+            if not ok:
+                total.errors += 1
+        if passthrough:
+            client.close_passthrough()
+        total.add(time.perf_counter() - start)
+    if args.verbose:
+        print("idle: {}".format(client.idle_stats()))
+    return [total] + (list(results.values()) if args.verbose else [])
+
+
+def bench_passive(args):
+    from components.esp.web_client import web_client
+
+    new_device(args)
+    client = web_client(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+    client.set_passive_receive()
+    return bench_download(args, client, name="download (passive receive)")
+
+
+def bench_passthrough(args):
+    return bench_download(args, name="download (passthrough)", passthrough=True)
+
+
+def bench_parallel(args):
+    from components.esp.web_client import web_client
+
+    new_device(args)
+    client = web_client(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+    files = _update_files()
+    total = Result("parallel ({} links)".format(args.links))
+    results = {}
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+
+    def open_file(url):
+        return open(os.path.join(scratch, url[len(UPDATE_URL) :].replace("/", "_")), "wb")
+
+    try:
+        for _ in range(args.iterations):
+            total.start()
+            seconds, downloads = timed(
+                client.download_parallel,
+                [UPDATE_URL + name for name in files],
+                open_file,
+                port=UPDATE_PORT,
+                links=args.links,
+            )
+            ok = True
+            for name in files:
+                with open(os.path.join(ROOT_DIR, name), "rb") as file:
+                    expected = file.read()
+                path = os.path.join(scratch, name.replace("/", "_"))
+                written = None
+                if os.path.exists(path):
+                    with open(path, "rb") as file:
+                        written = file.read()
+                status, size, ms = downloads.get(UPDATE_URL + name, (None, 0, None))
+                file_ok = status == 200 and written == expected
+                ok = ok and file_ok
+                results.setdefault(name, Result("  " + name)).add(
+                    (ms or 0) / 1000, file_ok, size
+                )
+            total.add(seconds, ok, client.download_stats()["bytes"])
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    if args.verbose:
+        print("idle: {}".format(client.idle_stats()))
+    return [total] + (list(results.values()) if args.verbose else [])
+
+
+def bench_update(args):
+    from components.updater.updater import updater
+
+    new_device(args)
+    files = _update_files()
+    size = sum(os.path.getsize(os.path.join(ROOT_DIR, name)) for name in files)
+    result = Result("updater._download_all_files")
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        instance = updater(
+            wifi_ssid=WIFI_SSID,
+            wifi_pass=WIFI_PASS,
+            update_url=UPDATE_URL,
+            update_port=UPDATE_PORT,
+            baudrate=args.baudrate,
+            download_links=args.links,
+            slots=False,
+        )
+        for _ in range(args.iterations):
+            result.start()
+            seconds, ok = timed(instance._download_all_files, list(files))
+            result.add(seconds, ok is True, size)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return [result]
+
+
+def bench_delta(args):
+    from components.updater.updater import updater
+    from components.updater.backup_manager import BackupManager
+    from components.updater.manifest_manager import ManifestManager
+    from make_index import manifest
+
+    new_device(args)
+    files = list(_update_files())
+    plain = Result("update_process (plain)")
+    hashed = Result("update_process (hashed)")
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        instance = updater(
+            wifi_ssid=WIFI_SSID,
+            wifi_pass=WIFI_PASS,
+            update_url=UPDATE_URL,
+            update_port=UPDATE_PORT,
+            baudrate=args.baudrate,
+            download_links=args.links,
+        )
+        instance.backup_manager = BackupManager(
+            main_dir="main", backup_dir="backup", new_version_dir="new"
+        )
+        instance.manifest_manager = ManifestManager(main_dir="main")
+        for _ in range(args.iterations):
+            for result, index in (
+                (plain, files),
+                (hashed, manifest(ROOT_DIR, files)),
+            ):
+                # the installed version differs from the published one in boot.py
+                shutil.rmtree("main", ignore_errors=True)
+                for name in files:
+                    path = os.path.join("main", name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    shutil.copyfile(os.path.join(ROOT_DIR, name), path)
+                with open(os.path.join("main", files[0]), "ab") as file:
+                    file.write(b"# local\n")
+                result.start()
+                seconds, ok = timed(instance.update_process, index)
+                result.add(seconds, ok is True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return [plain, hashed]
+
+
+def bench_bundle(args):
+    from components.updater.updater import updater
+    from components.updater.backup_manager import BackupManager
+    from components.updater.manifest_manager import ManifestManager
+    from make_index import BUNDLE_FILE, bundle, manifest
+
+    esp = new_device(args)
+    files = list(_update_files())
+    index = manifest(ROOT_DIR, files)
+    data = bundle(ROOT_DIR, files)
+    serve = http_file_server(ROOT_DIR, UPDATE_PREFIX)
+    published = {"bundle": False}
+
+    def handler(request):
+        if published["bundle"] and (UPDATE_PREFIX + BUNDLE_FILE).encode() in request:
+            header = "HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n"
+            return header.format(len(data)).encode() + data
+        return serve(request)
+
+    esp.add_host(UPDATE_HOST, UPDATE_PORT, handler)
+    size = sum(os.path.getsize(os.path.join(ROOT_DIR, name)) for name in files)
+    by_file = Result("update_process (files)")
+    by_bundle = Result("update_process (bundle)")
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        instance = updater(
+            wifi_ssid=WIFI_SSID,
+            wifi_pass=WIFI_PASS,
+            update_url=UPDATE_URL,
+            update_port=UPDATE_PORT,
+            baudrate=args.baudrate,
+            download_links=args.links,
+        )
+        instance.backup_manager = BackupManager(
+            main_dir="main", backup_dir="backup", new_version_dir="new"
+        )
+        instance.manifest_manager = ManifestManager(main_dir="main")
+        for _ in range(args.iterations):
+            for result, with_bundle in ((by_file, False), (by_bundle, True)):
+                published["bundle"] = with_bundle
+                shutil.rmtree("main", ignore_errors=True)
+                os.mkdir("main")
+                result.start()
+                seconds, ok = timed(instance.update_process, index)
+                result.add(seconds, ok is True, size)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if args.verbose:
+        print("bundle: {} bytes for {} bytes of files".format(len(data), size))
+    return [by_file, by_bundle]
+
+
+def bench_slots(args):
+    from components.updater.updater import updater
+    from components.updater.backup_manager import BackupManager
+    from components.updater.slot_manager import SlotManager
+    from components.updater.manifest_manager import ManifestManager
+    from make_index import manifest
+
+    new_device(args)
+    files = list(_update_files())
+    index = manifest(ROOT_DIR, files)
+    copies = Result("update_process (journal)")
+    slots = Result("update_process (slots)")
+    stats = {}
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        instance = updater(
+            wifi_ssid=WIFI_SSID,
+            wifi_pass=WIFI_PASS,
+            update_url=UPDATE_URL,
+            update_port=UPDATE_PORT,
+            baudrate=args.baudrate,
+            download_links=args.links,
+            slots=False,
+        )
+        for _ in range(args.iterations):
+            for result in (copies, slots):
+                # the running version differs from the published one in boot.py
+                shutil.rmtree("device", ignore_errors=True)
+                main_dir = "device/main" if result is copies else "device/slot_a"
+                for name in files:
+                    path = os.path.join(main_dir, name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    shutil.copyfile(os.path.join(ROOT_DIR, name), path)
+                with open(os.path.join(main_dir, files[0]), "ab") as file:
+                    file.write(b"# local\n")
+                if result is copies:
+                    manager = BackupManager(
+                        main_dir="device/main",
+                        backup_dir="device/backup",
+                        new_version_dir="device/new",
+                    )
+                else:
+                    with open("device/slot.txt", "w") as file:
+                        file.write("slot_a")
+                    manager = SlotManager(root_dir="device")
+                instance.backup_manager = manager
+                instance.manifest_manager = ManifestManager(main_dir=manager.main_dir)
+                result.start()
+                seconds, ok = timed(instance.update_process, index)
+                result.add(seconds, ok is True)
+                stats[result] = manager.file_stats()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if args.verbose:
+        for result in (copies, slots):
+            print("{}: {}".format(result.name, stats[result]))
+    return [copies, slots]
+
+
+def bench_resume(args):
+    from components.updater.updater import updater
+    from components.updater.backup_manager import BackupManager
+    from components.updater.manifest_manager import ManifestManager
+    from make_index import manifest
+
+    esp = new_device(args)
+    files = list(_update_files())
+    index = manifest(ROOT_DIR, files)
+    largest = max(files, key=lambda name: index[name].get("size", 0))
+    serve = http_file_server(ROOT_DIR, UPDATE_PREFIX)
+    state = {"cut": False, "sent": 0}
+
+    def handler(request):
+        response = serve(request)
+        if state["cut"] and (UPDATE_PREFIX + largest).encode() in request:
+            # the connection drops halfway through the body
+            head, body = response.split(b"\r\n\r\n", 1)
+            head = head.replace(b"keep-alive", b"close")
+            response = head + b"\r\n\r\n" + body[: len(body) // 2]
+        state["sent"] += len(response)
+        return response
+
+    esp.add_host(UPDATE_HOST, UPDATE_PORT, handler)
+    restart = Result("update_process (restart)")
+    resume = Result("update_process (resume)")
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        instance = updater(
+            wifi_ssid=WIFI_SSID,
+            wifi_pass=WIFI_PASS,
+            update_url=UPDATE_URL,
+            update_port=UPDATE_PORT,
+            baudrate=args.baudrate,
+            download_links=args.links,
+        )
+        instance.backup_manager = BackupManager(
+            main_dir="main", backup_dir="backup", new_version_dir="new"
+        )
+        instance.manifest_manager = ManifestManager(main_dir="main")
+        for _ in range(args.iterations):
+            for result in (restart, resume):
+                shutil.rmtree("main", ignore_errors=True)
+                shutil.rmtree("new", ignore_errors=True)
+                os.mkdir("main")
+                state["cut"] = True
+                instance.update_process(index)
+                state["cut"] = False
+                if result is restart:
+                    # what an updater without the journal starts from
+                    shutil.rmtree("new", ignore_errors=True)
+                state["sent"] = 0
+                result.start()
+                seconds, ok = timed(instance.update_process, index)
+                result.add(seconds, ok is True, state["sent"])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if args.verbose:
+        for result in (restart, resume):
+            print(
+                "{}: {} bytes sent per update".format(
+                    result.name, result.bytes // max(len(result.samples), 1)
+                )
+            )
+    return [restart, resume]
+
+
+def bench_files(args):
+    from components.file_manager import FileManager
+
+    files = list(_update_files())
+    copy = Result("_copy_directory ({} B)".format(args.buffer_size))
+    remove = Result("_rmtree")
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        for name in files:
+            os.makedirs(os.path.dirname(os.path.join("tree", name)), exist_ok=True)
+            shutil.copyfile(os.path.join(ROOT_DIR, name), os.path.join("tree", name))
+        manager = FileManager("tree", "copy", "backup", buffer_size=args.buffer_size)
+        for _ in range(args.iterations):
+            before = manager.file_stats()["bytes"]
+            copy.start()
+            seconds, _ = timed(manager._copy_directory, "tree", "copy")
+            copy.add(seconds, True, manager.file_stats()["bytes"] - before)
+            remove.start()
+            seconds, _ = timed(manager._rmtree, "copy")
+            remove.add(seconds, not os.path.exists("copy"))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if args.verbose:
+        print("file_stats: {}".format(manager.file_stats()))
+    return [copy, remove]
+
+
+def bench_baudrate(args):
+    from components.esp.web_client import web_client
+
+    cold = Result("negotiate_baudrate (cold)")
+    warm = Result("negotiate_baudrate (warm)")
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="pico_bench_")
+    try:
+        os.chdir(scratch)
+        for _ in range(args.iterations):
+            if os.path.exists(web_client.BAUDRATE_FILE):
+                os.remove(web_client.BAUDRATE_FILE)
+            esp = new_device(args)
+            client = web_client(WIFI_SSID, WIFI_PASS, 4, 5, baudrate=args.baudrate)
+            seconds, baudrate = timed(client.negotiate_baudrate)
+            cold.add(seconds, baudrate is not None and baudrate == esp.baudrate)
+            # a warm boot: new objects, the ESP kept its rate
+            client = web_client(WIFI_SSID, WIFI_PASS, 4, 5)
+            seconds, baudrate = timed(client.negotiate_baudrate)
+            warm.add(seconds, baudrate is not None and baudrate == esp.baudrate)
+        results = bench_download(
+            args, client, "download @ {}".format(client.BAUDRATE)
+        )
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return [cold, warm] + results
+
+
+SCENARIOS = {
+    "commands": bench_commands,
+    "page": bench_page,
+    "contention": bench_contention,
+    "download": bench_download,
+    "passive": bench_passive,
+    "passthrough": bench_passthrough,
+    "parallel": bench_parallel,
+    "update": bench_update,
+    "delta": bench_delta,
+    "bundle": bench_bundle,
+    "slots": bench_slots,
+    "resume": bench_resume,
+    "files": bench_files,
+    "baudrate": bench_baudrate,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scenarios", nargs="*", choices=[[]] + list(SCENARIOS))
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--command-latency", type=float, default=0.0002)
+    parser.add_argument("--connect-latency", type=float, default=0.002)
+    parser.add_argument("--server-latency", type=float, default=0.0)
+    parser.add_argument("--busy-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise-baudrate", type=int, default=None)
+    parser.add_argument("--noise-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--ack-latency",
+        type=float,
+        default=0.0,
+        help="ms for the peer to acknowledge sent data (SEND OK)",
+    )
+    parser.add_argument(
+        "--dns-latency",
+        type=float,
+        default=0.0,
+        help="ms for the ESP to resolve a host name",
+    )
+    parser.add_argument(
+        "--no-sendbuf", action="store_true", help="firmware without AT+CIPSENDBUF"
+    )
+    parser.add_argument(
+        "--links", type=int, default=3, help="links of the parallel downloads"
+    )
+    parser.add_argument(
+        "--buffer-size", type=int, default=4096, help="FileManager buffer bytes"
+    )
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default="off")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="per-file rows")
+    args = parser.parse_args(argv)
+    basicConfig(level=LOG_LEVELS[args.log_level])
+
+    lines = [
+        "baudrate={} command_latency={}s connect_latency={}s server_latency={}s "
+        "busy_rate={}".format(
+            args.baudrate,
+            args.command_latency,
+            args.connect_latency,
+            args.server_latency,
+            args.busy_rate,
+        ),
+        HEADER,
+    ]
+    print("\n".join(lines))
+    for name in args.scenarios or list(SCENARIOS):
+        for result in SCENARIOS[name](args):
+            lines.append(result.row())
+            print(lines[-1])
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+MicroPython ``deflate`` for the host, decompression only.
+
+``DeflateIO`` pulls compressed bytes from the wrapped stream as its
+reader asks for data, like the firmware's: the window it keeps is the one
+the compressed stream declares.
+"""
+
+import zlib
+
+AUTO = 0
+RAW = 1
+ZLIB = 2
+GZIP = 3
+
+INPUT_LENGTH = 256
+
+
+class DeflateIO:
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        wbits = wbits or 15
+        self._stream = stream
+        self._close = close
+        self._decompressor = zlib.decompressobj(
+            {RAW: -wbits, ZLIB: wbits, GZIP: 16 + wbits}.get(format, 32 + wbits)
+        )
+        self._pending = b""
+        self._eof = False
+
+    def _fill(self, size):
+        while len(self._pending) < size and not self._eof:
+            data = self._decompressor.unconsumed_tail or self._stream.read(
+                INPUT_LENGTH
+            )
+            if not data:
+                self._pending += self._decompressor.flush()
+                self._eof = True
+            else:
+                self._pending += self._decompressor.decompress(data, INPUT_LENGTH)
+                self._eof = self._decompressor.eof and not (
+                    self._decompressor.unconsumed_tail
+                )
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            self._fill(float("inf"))
+            size = len(self._pending)
+        self._fill(size)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self._close:
+            self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
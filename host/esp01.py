@@ -0,0 +1,855 @@
+"""
+Simulated ESP-01 running the Espressif AT firmware.
+
+The emulator speaks the AT dialect used by ``components/esp`` and models
+the timing that matters on the real link:
+
+* every byte takes ``10 / baudrate`` seconds on the wire, in both
+  directions, and output bytes are serialized on a single wire;
+* commands take ``command_latency`` seconds to process and a command that
+  arrives while the previous one is still running is answered with
+  ``busy p...`` and dropped;
+* ``AT+CWJAP``, ``AT+CIPSTART`` and remote HTTP servers have their own
+  latencies; a host name costs ``dns_latency`` more to look up, in
+  ``AT+CIPDOMAIN`` or in an ``AT+CIPSTART`` given the name rather than
+  the address;
+* ``SEND OK`` waits ``ack_latency`` for the peer to acknowledge the data;
+  ``AT+CIPSENDBUF`` (unless ``sendbuf=False``) returns once the data is
+  buffered and reports ``<link>,<segment>,SEND OK`` later;
+* ``AT+CIPMODE=1`` then ``AT+CIPSEND`` starts transparent transmission:
+  the UART is a raw pipe to the single link until ``+++`` arrives as a
+  write of its own, ``escape_guard`` after the last byte; commands are then
+  refused as busy for ``escape_latency``;
+* ``AT+CIPRECVMODE=1`` keeps what the links receive in the ESP and only
+  reports ``+IPD,[<id>,]<len>``; ``AT+CIPRECVDATA`` hands it out, even
+  after the link closed;
+* ``AT+UART_CUR`` changes the device rate once its ``OK`` is on the wire;
+  a host UART left at another rate only sees garbage, and above
+  ``noise_baudrate`` every byte is corrupted with probability
+  ``noise_rate``.
+
+Remote servers are plain callables registered with ``add_host``. They
+receive the raw request bytes and return the raw response bytes, which
+are delivered back as ``+IPD`` frames of at most ``packet_size`` bytes.
+Inbound connections (for the web server) are opened with
+``connect_client``.
+"""
+
+import heapq
+import os
+import random
+import time
+
+CRLF = b"\r\n"
+OK = b"\r\nOK\r\n"
+ERROR = b"\r\nERROR\r\n"
+FAIL = b"\r\nFAIL\r\n"
+BUSY = b"busy p...\r\n"
+
+GMR = (
+    b"AT version:1.7.4.0(May 11 2020 19:13:04)\r\n"
+    b"SDK version:3.0.4(9532ceb)\r\n"
+    b"compile time:May 27 2020 10:12:17\r\n"
+    b"Bin version(Wroom 02):1.7.4\r\n"
+)
+
+CONTENT_TYPES = {
+    ".json": "application/json",
+    ".html": "text/html",
+    ".txt": "text/plain",
+}
+
+
+class SerialDevice:
+    """
+    Wire model for the device end of a UART.
+
+    Output is queued with ``emit`` at a point in time; it is put on the wire
+    in time order, one byte every ``byte_time`` seconds. Input written by
+    the host is handed to ``on_bytes`` together with its arrival times.
+    """
+
+    def __init__(self, baudrate=115200):
+        self._pending = []
+        self._sequence = 0
+        self._wire = []
+        self._wire_end = 0.0
+        self._input_end = 0.0
+        self.set_baudrate(baudrate)
+
+    def set_baudrate(self, baudrate):
+        self.baudrate = baudrate
+        self.byte_time = 10 / baudrate
+
+    def emit(self, data, at):
+        if data:
+            heapq.heappush(self._pending, (at, self._sequence, bytes(data)))
+            self._sequence += 1
+
+    def _commit(self, now):
+        while self._pending and self._pending[0][0] <= now:
+            at, _, data = heapq.heappop(self._pending)
+            start = max(at, self._wire_end)
+            self._wire.append([start, data, 0])
+            self._wire_end = start + len(data) * self.byte_time
+
+    def take_arrived(self, now, baudrate=None):
+        """
+        Return the bytes that reached the host by ``now`` and the arrival
+        time of the last one. A host reading at another ``baudrate`` gets
+        garbage.
+        """
+        self._commit(now)
+        out = bytearray()
+        last_arrival = None
+        while self._wire:
+            segment = self._wire[0]
+            start, data, taken = segment
+            arrived = min(len(data), int((now - start) / self.byte_time))
+            if arrived > taken:
+                out += data[taken:arrived]
+                segment[2] = arrived
+                last_arrival = start + arrived * self.byte_time
+            if arrived < len(data):
+                break
+            self._wire.pop(0)
+        return self._garbled(bytes(out), baudrate), last_arrival
+
+    def _garbled(self, data, baudrate):
+        if baudrate is None or baudrate == self.baudrate:
+            return data
+        return bytes((0xFF,)) * len(data)
+
+    def _future(self):
+        """
+        Yield ``(base, count)`` for the bytes still to arrive; byte ``k``
+        (1-based) of a group arrives at ``base + k * byte_time``.
+        """
+        for start, data, taken in self._wire:
+            yield start + taken * self.byte_time, len(data) - taken
+        end = self._wire_end
+        for at, _, data in sorted(self._pending):
+            base = max(at, end)
+            yield base, len(data)
+            end = base + len(data) * self.byte_time
+
+    def next_arrival(self):
+        for base, count in self._future():
+            if count:
+                return base + self.byte_time
+        return None
+
+    def burst_end(self, after, gap, limit):
+        """
+        Arrival time of the last of up to ``limit`` bytes that follow
+        ``after`` with no silence longer than ``gap``.
+        """
+        last = after
+        taken = 0
+        result = None
+        for base, count in self._future():
+            if not count:
+                continue
+            if base + self.byte_time - last > gap:
+                break
+            count = min(count, limit - taken)
+            last = base + count * self.byte_time
+            taken += count
+            result = last
+            if taken >= limit:
+                break
+        return result
+
+    def receive(self, data, now, baudrate=None):
+        """
+        Bytes written by the host. Returns when the last one arrives.
+        """
+        self._commit(now)
+        start = max(now, self._input_end)
+        self._input_end = start + len(data) * self.byte_time
+        self.on_bytes(self._garbled(data, baudrate), start)
+        return self._input_end
+
+    def tx_done_time(self):
+        return self._input_end
+
+    def on_bytes(self, data, start):
+        """
+        ``data[i]`` arrives at ``start + (i + 1) * byte_time``.
+        """
+        raise NotImplementedError
+
+
+class Link:
+    """
+    One TCP link of the ESP, identified by its link id.
+    """
+
+    def __init__(self, device, link_id, host=None, port=None, handler=None):
+        self.device = device
+        self.link_id = link_id
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.received = bytearray()
+        self.closed = False
+        self._request = bytearray()
+
+    def deliver(self, data, at):
+        self.received += data
+        if self.handler is None:
+            return
+        self._request += data
+        while True:
+            request = _split_http_message(self._request)
+            if request is None:
+                return
+            del self._request[: len(request)]
+            response = self.handler(request)
+            if response is None:
+                continue
+            at = self.device.send_to_host(self, response, at + self.device.server_latency)
+            if b"connection: close" in response.split(CRLF * 2, 1)[0].lower():
+                self.device.close_link(self, at)
+                return
+
+    def send(self, data, at=None):
+        """
+        Data sent by the remote peer.
+        """
+        return self.device.send_to_host(self, data, at)
+
+
+def _split_http_message(buffer):
+    end = buffer.find(CRLF * 2)
+    if end == -1:
+        return None
+    end += 4
+    length = 0
+    for line in bytes(buffer[:end]).split(CRLF):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    if len(buffer) < end + length:
+        return None
+    return bytes(buffer[: end + length])
+
+
+def _range_start(request):
+    for line in request.split(CRLF):
+        if line.lower().startswith(b"range: bytes="):
+            return int(line.split(b"=", 1)[1].split(b"-")[0])
+    return None
+
+
+def http_file_server(root, prefix="/", chunk_size=None, ranges=True):
+    """
+    Handler serving the files under ``root`` for requests below ``prefix``.
+    With ``chunk_size``, bodies are sent with ``Transfer-Encoding: chunked``
+    in chunks of that many bytes. With ``ranges``, a ``Range: bytes=<first>-``
+    request gets the rest of the file from there as a 206.
+    """
+
+    def handler(request):
+        request_line = request.split(CRLF, 1)[0].decode()
+        target = request_line.split(" ")[1]
+        keep_alive = b"connection: keep-alive" in request.lower()
+        body = None
+        extra = ""
+        if target.startswith(prefix):
+            path = os.path.join(root, target[len(prefix) :].split("?")[0])
+            if os.path.isfile(path):
+                with open(path, "rb") as file:
+                    body = file.read()
+        if body is None:
+            status = "404 Not Found"
+            body = b"Not Found"
+            content_type = "text/plain"
+        else:
+            status = "200 OK"
+            content_type = CONTENT_TYPES.get(
+                os.path.splitext(target)[1], "application/octet-stream"
+            )
+            first = _range_start(request) if ranges else None
+            if first is not None and first < len(body):
+                status = "206 Partial Content"
+                extra = "Content-Range: bytes {}-{}/{}\r\n".format(
+                    first, len(body) - 1, len(body)
+                )
+                body = body[first:]
+            elif first is not None:
+                status = "416 Range Not Satisfiable"
+                extra = "Content-Range: bytes */{}\r\n".format(len(body))
+                body = b""
+        if chunk_size:
+            framing = "Transfer-Encoding: chunked"
+            body = b"".join(
+                "{:x};n={}\r\n".format(len(chunk), index).encode() + chunk + CRLF
+                for index, chunk in enumerate(
+                    body[start : start + chunk_size]
+                    for start in range(0, len(body), chunk_size)
+                )
+            ) + b"0\r\nX-Trailer: 1\r\n\r\n"
+        else:
+            framing = "Content-Length: {}".format(len(body))
+        headers = (
+            "HTTP/1.1 {}\r\n"
+            "Content-Type: {}\r\n"
+            "{}{}\r\n"
+            "Connection: {}\r\n"
+            "\r\n"
+        ).format(
+            status,
+            content_type,
+            extra,
+            framing,
+            "keep-alive" if keep_alive else "close",
+        )
+        return headers.encode() + body
+
+    return handler
+
+
+class ESP01(SerialDevice):
+    MAX_LINKS = 5
+    MAX_SEND = 2048
+
+    def __init__(
+        self,
+        baudrate=115200,
+        ssid=None,
+        password=None,
+        ip="192.168.1.50",
+        command_latency=0.0002,
+        join_latency=0.05,
+        connect_latency=0.002,
+        server_latency=0.0,
+        packet_size=1460,
+        busy_rate=0.0,
+        seed=0,
+        noise_baudrate=None,
+        noise_rate=0.0,
+        ack_latency=0.0,
+        sendbuf=True,
+        escape_guard=0.02,
+        escape_latency=1.0,
+        dns_latency=0.0,
+    ):
+        super().__init__(baudrate)
+        self.default_baudrate = baudrate
+        self.noise_baudrate = noise_baudrate
+        self.noise_rate = noise_rate
+        self.ack_latency = ack_latency
+        self.sendbuf = sendbuf
+        self.escape_guard = escape_guard
+        self.escape_latency = escape_latency
+        self.dns_latency = dns_latency
+        self._next_baudrate = None
+        self.ssid = ssid
+        self.password = password
+        self.ip = ip
+        self.command_latency = command_latency
+        self.join_latency = join_latency
+        self.connect_latency = connect_latency
+        self.server_latency = server_latency
+        self.packet_size = packet_size
+        self.busy_rate = busy_rate
+        self.random = random.Random(seed)
+        self.hosts = {}
+        self.addresses = {}
+        self.commands = []
+        self.stats = {
+            "commands": 0,
+            "busy": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "dropped": 0,
+            "corrupted": 0,
+        }
+        self._line = bytearray()
+        self._send = None
+        self._busy_until = 0.0
+        self._restore()
+
+    def _restore(self):
+        self.echo = True
+        self.mux = 0
+        self.server_port = None
+        self.joined = None
+        self.links = {}
+        self._segment = 0
+        self.cipmode = 0
+        self._passthrough = None
+        self._passthrough_last = 0.0
+        self.recvmode = 0
+        self._passive = {}
+        # (time, link id, data) received in passive mode, not there yet
+        self._passive_pending = []
+
+    def add_host(self, host, port, handler, ip=None):
+        """
+        Serve ``host:port`` with ``handler``; the host is also reachable
+        at ``ip``, by default an address of its own.
+        """
+        if ip is None:
+            ip = self.addresses.get(host) or "192.168.1.{}".format(
+                100 + len(self.addresses)
+            )
+        self.addresses[host] = ip
+        self.hosts[(host, port)] = handler
+
+    # -- output ---------------------------------------------------------
+
+    def emit(self, data, at):
+        self.stats["bytes_out"] += len(data)
+        super().emit(self._noisy(data), at)
+
+    def _noisy(self, data):
+        if self.noise_baudrate is None or self.baudrate <= self.noise_baudrate:
+            return data
+        data = bytearray(data)
+        for index in range(len(data)):
+            if self.random.random() < self.noise_rate:
+                data[index] ^= 1 << self.random.randrange(8)
+                self.stats["corrupted"] += 1
+        return bytes(data)
+
+    def take_arrived(self, now, baudrate=None):
+        arrived = super().take_arrived(now, baudrate)
+        self._switch_baudrate(now)
+        return arrived
+
+    def receive(self, data, now, baudrate=None):
+        self._switch_baudrate(now)
+        return super().receive(data, now, baudrate)
+
+    def _switch_baudrate(self, now):
+        """
+        Apply a pending rate change once the reply announcing it has left.
+        """
+        if self._next_baudrate is None or now < self._next_baudrate[0]:
+            return
+        self._commit(now)
+        if self._wire_end > now:
+            return
+        self.set_baudrate(self._next_baudrate[1])
+        self._next_baudrate = None
+
+    def _link_prefix(self, link):
+        if self.mux:
+            return str(link.link_id).encode() + b","
+        return b""
+
+    def send_to_host(self, link, data, at=None):
+        """
+        Forward data received on a TCP link to the host as ``+IPD`` frames,
+        or as is in transparent transmission. Returns the time the last frame
+        was queued.
+        """
+        if at is None:
+            at = time.perf_counter()
+        if self._passthrough is link:
+            self.emit(data, at)
+            return at
+        if self.recvmode:
+            # held by the ESP from the time it arrives
+            self._passive_pending.append((at, link.link_id, bytes(data)))
+            notice = b"\r\n+IPD," + self._link_prefix(link) + str(len(data)).encode()
+            self.emit(notice + CRLF, at)
+            return at
+        for offset in range(0, len(data), self.packet_size):
+            packet = data[offset : offset + self.packet_size]
+            header = b"\r\n+IPD," + self._link_prefix(link)
+            self.emit(header + str(len(packet)).encode() + b":" + packet, at)
+        return at
+
+    def close_link(self, link, at=None):
+        if at is None:
+            at = time.perf_counter()
+        if self.links.get(link.link_id) is link:
+            del self.links[link.link_id]
+        link.closed = True
+        if self._passthrough is not link:
+            self.emit(self._link_prefix(link) + b"CLOSED\r\n", at)
+
+    def connect_client(self, request=None, at=None):
+        """
+        Open an inbound connection to the server, as a browser would.
+        """
+        if at is None:
+            at = time.perf_counter()
+        if self.server_port is None:
+            raise OSError("server not started")
+        link_id = self._free_link_id()
+        if link_id is None:
+            raise OSError("no free link")
+        link = Link(self, link_id)
+        self.links[link_id] = link
+        self._drop_passive(link_id)
+        self.emit(str(link_id).encode() + b",CONNECT\r\n", at)
+        if request:
+            link.send(request, at)
+        return link
+
+    def _free_link_id(self):
+        for link_id in range(self.MAX_LINKS):
+            if link_id not in self.links:
+                return link_id
+        return None
+
+    # -- input ----------------------------------------------------------
+
+    def on_bytes(self, data, start):
+        self.stats["bytes_in"] += len(data)
+        data = self._noisy(data)
+        index = 0
+        if self._passthrough is not None:
+            self._receive_passthrough(data, start)
+            return
+        while index < len(data):
+            if self._send is not None:
+                index = self._receive_payload(data, index, start)
+                continue
+            end = data.find(b"\n", index)
+            if end == -1:
+                self._line += data[index:]
+                return
+            self._line += data[index : end + 1]
+            index = end + 1
+            line = bytes(self._line).strip()
+            self._line = bytearray()
+            if line:
+                self._on_line(line, start + index * self.byte_time)
+
+    def _receive_payload(self, data, index, start):
+        link, remaining, buffer, prompt_at, buffered = self._send
+        while index < len(data) and start + (index + 1) * self.byte_time < prompt_at:
+            # bytes that arrive before the prompt are discarded
+            self.stats["dropped"] += 1
+            index += 1
+        count = min(remaining, len(data) - index)
+        buffer += data[index : index + count]
+        index += count
+        remaining -= count
+        if remaining:
+            self._send = (link, remaining, buffer, prompt_at, buffered)
+            return index
+        self._send = None
+        at = start + index * self.byte_time
+        self.emit(b"\r\nRecv " + str(len(buffer)).encode() + b" bytes\r\n", at)
+        done = at + self.command_latency
+        if buffered:
+            # the data is in the send buffer: the next command can follow
+            self._busy_until = done
+            sent = "{},{},SEND OK\r\n".format(link.link_id, self._segment).encode()
+            self.emit(sent, done + self.ack_latency)
+        else:
+            self.emit(b"\r\nSEND OK\r\n", done + self.ack_latency)
+            self._busy_until = done + self.ack_latency
+        link.deliver(bytes(buffer), done)
+        return index
+
+    def _receive_passthrough(self, data, start):
+        end = start + len(data) * self.byte_time
+        if data == b"+++" and start - self._passthrough_last >= self.escape_guard:
+            self._passthrough = None
+            self._busy_until = end + self.escape_latency
+            return
+        self._passthrough_last = end
+        link = self._passthrough
+        if not link.closed:
+            link.deliver(bytes(data), end)
+
+    def _on_line(self, line, at):
+        self.commands.append(line)
+        if self.echo:
+            self.emit(line + b"\r\r\n", at)
+        if at < self._busy_until or (
+            self.busy_rate and self.random.random() < self.busy_rate
+        ):
+            self.stats["busy"] += 1
+            self.emit(BUSY, at)
+            return
+        self.stats["commands"] += 1
+        command = line.decode("latin-1")
+        name, _, args = command.partition("=")
+        query = name.endswith("?")
+        name = name.rstrip("?")
+        key = name[3:] if name.startswith("AT+") else name[2:]
+        handler = getattr(self, "_at_" + key.lower(), None)
+        if not name.startswith("AT") or (name != "AT" and handler is None):
+            response, latency = ERROR, self.command_latency
+        elif name == "AT":
+            response, latency = OK, self.command_latency
+        else:
+            try:
+                response, latency = handler(_split_args(args), query, at)
+            except (ValueError, IndexError):
+                # a corrupted or malformed argument list
+                response, latency = ERROR, self.command_latency
+        done = at + latency
+        self._busy_until = done
+        self.emit(response, done)
+
+    # -- commands -------------------------------------------------------
+
+    def _at_e0(self, args, query, at):
+        self.echo = False
+        return OK, self.command_latency
+
+    def _at_e1(self, args, query, at):
+        self.echo = True
+        return OK, self.command_latency
+
+    def _at_rst(self, args, query, at):
+        self.links = {}
+        self.server_port = None
+        self.mux = 0
+        self.cipmode = 0
+        self.recvmode = 0
+        self._passive = {}
+        self._passive_pending = []
+        self._next_baudrate = (at + self.command_latency, self.default_baudrate)
+        self.emit(b"\r\nready\r\n", at + 0.3)
+        return OK, self.command_latency
+
+    def _at_restore(self, args, query, at):
+        self._restore()
+        self._next_baudrate = (at + self.command_latency, self.default_baudrate)
+        self.emit(b"\r\nready\r\n", at + 0.3)
+        return OK, self.command_latency
+
+    def _at_gmr(self, args, query, at):
+        return GMR + OK, self.command_latency
+
+    def _at_clac(self, args, query, at):
+        names = [
+            name[4:].upper()
+            for name in dir(self)
+            if name.startswith("_at_") and len(name) > 6
+            and (self.sendbuf or name != "_at_cipsendbuf")
+        ]
+        listing = b"AT\r\n" + b"".join(
+            b"AT+" + name.encode() + CRLF for name in sorted(names)
+        )
+        return listing + OK, self.command_latency
+
+    def _at_uart_cur(self, args, query, at):
+        if query:
+            info = "+UART_CUR:{},8,1,0,0\r\n".format(self.baudrate)
+            return info.encode() + OK, self.command_latency
+        baudrate = int(args[0])
+        if not 110 <= baudrate <= 4608000:
+            return ERROR, self.command_latency
+        self._next_baudrate = (at + self.command_latency, baudrate)
+        return OK, self.command_latency
+
+    def _at_cwmode_cur(self, args, query, at):
+        if query:
+            return b"+CWMODE_CUR:3\r\n" + OK, self.command_latency
+        return OK, self.command_latency
+
+    _at_cwmode = _at_cwmode_cur
+
+    def _at_cwjap_cur(self, args, query, at):
+        if query:
+            if self.joined is None:
+                return b"No AP\r\n" + OK, self.command_latency
+            info = '+CWJAP:"{}","a0:ab:1b:6c:3f:12",6,-58\r\n'.format(self.joined)
+            return info.encode() + OK, self.command_latency
+        ssid, password = args[0], args[1]
+        if self.joined is not None:
+            self.emit(b"WIFI DISCONNECT\r\n", at)
+            self.joined = None
+        if self.ssid is not None and ssid != self.ssid:
+            return b"+CWJAP:3\r\n" + FAIL, self.join_latency
+        if self.password is not None and password != self.password:
+            return b"+CWJAP:2\r\n" + FAIL, self.join_latency
+        self.joined = ssid
+        self.emit(b"WIFI CONNECTED\r\n", at + self.join_latency / 2)
+        return b"WIFI GOT IP\r\n" + OK, self.join_latency
+
+    _at_cwjap = _at_cwjap_cur
+
+    def _at_cwqap(self, args, query, at):
+        if self.joined is not None:
+            self.joined = None
+            self.emit(b"WIFI DISCONNECT\r\n", at + self.command_latency)
+        return OK, self.command_latency
+
+    def _at_cifsr(self, args, query, at):
+        ip = self.ip if self.joined is not None else "0.0.0.0"
+        listing = (
+            '+CIFSR:APIP,"192.168.4.1"\r\n'
+            '+CIFSR:APMAC,"a2:20:a6:14:2b:9c"\r\n'
+            '+CIFSR:STAIP,"{}"\r\n'
+            '+CIFSR:STAMAC,"a0:20:a6:14:2b:9c"\r\n'
+        ).format(ip)
+        return listing.encode() + OK, self.command_latency
+
+    def _at_cipmux(self, args, query, at):
+        if query:
+            return "+CIPMUX:{}\r\n".format(self.mux).encode() + OK, self.command_latency
+        if self.links or self.server_port is not None:
+            return b"link is builded\r\n" + ERROR, self.command_latency
+        self.mux = int(args[0])
+        return OK, self.command_latency
+
+    def _at_cipserver(self, args, query, at):
+        if not self.mux:
+            return ERROR, self.command_latency
+        if int(args[0]):
+            self.server_port = int(args[1]) if len(args) > 1 else 333
+        else:
+            self.server_port = None
+        return OK, self.command_latency
+
+    def _at_cipsto(self, args, query, at):
+        return OK, self.command_latency
+
+    def _at_cipstart(self, args, query, at):
+        link_id = int(args.pop(0)) if self.mux else 0
+        host, port = args[1], int(args[2])
+        if link_id in self.links:
+            return b"ALREADY CONNECTED\r\n" + ERROR, self.command_latency
+        if self.joined is None:
+            return ERROR + b"CLOSED\r\n", self.command_latency
+        latency = self.connect_latency
+        if host in self.addresses:
+            latency += self.dns_latency
+        else:
+            names = [name for name, ip in self.addresses.items() if ip == host]
+            host = names[0] if names else host
+        handler = self.hosts.get((host, port))
+        if handler is None:
+            return b"DNS Fail\r\n" + ERROR, latency
+        self.links[link_id] = Link(self, link_id, host, port, handler)
+        self._drop_passive(link_id)
+        connect = self._link_prefix(self.links[link_id]) + b"CONNECT\r\n"
+        return connect + OK, latency
+
+    def _at_cipdomain(self, args, query, at):
+        ip = self.addresses.get(args[0]) if self.joined is not None else None
+        if ip is None:
+            return b"DNS Fail\r\n" + ERROR, self.dns_latency
+        return "+CIPDOMAIN:{}\r\n".format(ip).encode() + OK, self.dns_latency
+
+    def _at_cipmode(self, args, query, at):
+        if query:
+            return "+CIPMODE:{}\r\n".format(self.cipmode).encode() + OK, self.command_latency
+        mode = int(args[0])
+        if mode and (self.mux or self.server_port is not None):
+            return ERROR, self.command_latency
+        self.cipmode = mode
+        return OK, self.command_latency
+
+    def _at_ciprecvmode(self, args, query, at):
+        if query:
+            return "+CIPRECVMODE:{}\r\n".format(self.recvmode).encode() + OK, self.command_latency
+        self.recvmode = int(args[0])
+        return OK, self.command_latency
+
+    def _drop_passive(self, link_id):
+        self._passive.pop(link_id, None)
+        self._passive_pending = [
+            entry for entry in self._passive_pending if entry[1] != link_id
+        ]
+
+    def _passive_arrived(self, now):
+        pending = []
+        for entry in self._passive_pending:
+            if entry[0] <= now:
+                self._passive.setdefault(entry[1], bytearray()).extend(entry[2])
+            else:
+                pending.append(entry)
+        self._passive_pending = pending
+
+    def _at_ciprecvdata(self, args, query, at):
+        link_id = int(args[0]) if self.mux else 0
+        length = int(args[-1])
+        self._passive_arrived(at)
+        buffer = self._passive.get(link_id)
+        if not self.recvmode or (buffer is None and link_id not in self.links):
+            return ERROR, self.command_latency
+        buffer = buffer or bytearray()
+        data = bytes(buffer[:length])
+        del buffer[:length]
+        header = "+CIPRECVDATA,{}:".format(len(data)).encode()
+        return header + data + OK, self.command_latency
+
+    def _at_cipsend(self, args, query, at):
+        if self.cipmode:
+            link = self.links.get(0)
+            if args or link is None:
+                return ERROR, self.command_latency
+            self._passthrough = link
+            self._passthrough_last = at
+            return OK + b"\r\n>", self.command_latency
+        link_id = int(args[0]) if self.mux else 0
+        length = int(args[-1])
+        link = self.links.get(link_id)
+        if link is None:
+            return b"link is not valid\r\n" + ERROR, self.command_latency
+        if length > self.MAX_SEND:
+            return ERROR, self.command_latency
+        prompt_at = at + self.command_latency
+        self._send = (link, length, bytearray(), prompt_at, False)
+        return OK + b"> ", self.command_latency
+
+    def _at_cipsendbuf(self, args, query, at):
+        if not self.sendbuf:
+            return ERROR, self.command_latency
+        link_id = int(args[0]) if self.mux else 0
+        length = int(args[-1])
+        link = self.links.get(link_id)
+        if link is None:
+            return b"link is not valid\r\n" + ERROR, self.command_latency
+        if length > self.MAX_SEND:
+            return ERROR, self.command_latency
+        self._segment += 1
+        prompt_at = at + self.command_latency
+        self._send = (link, length, bytearray(), prompt_at, True)
+        segments = "{},{}\r\n".format(self._segment, self._segment - 1).encode()
+        return segments + OK + b"> ", self.command_latency
+
+    def _at_cipclose(self, args, query, at):
+        link_id = int(args[0]) if args else 0
+        if self.mux and link_id == self.MAX_LINKS:
+            links = list(self.links.values())
+        else:
+            links = [self.links[link_id]] if link_id in self.links else []
+        if not links:
+            return ERROR, self.command_latency
+        done = at + self.command_latency
+        for link in links:
+            self.close_link(link, done)
+        return OK, self.command_latency
+
+    def _at_cipstatus(self, args, query, at):
+        lines = [b"STATUS:" + (b"3" if self.links else b"2") + CRLF]
+        for link in self.links.values():
+            lines.append(
+                '+CIPSTATUS:{},"TCP","{}",{},0,0\r\n'.format(
+                    link.link_id, link.host, link.port
+                ).encode()
+            )
+        return b"".join(lines) + OK, self.command_latency
+
+
+def _split_args(args):
+    """
+    Split ``"a","b",3`` into ``["a", "b", "3"]``.
+    """
+    values = []
+    current = ""
+    quoted = False
+    for char in args:
+        if char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            values.append(current)
+            current = ""
+        else:
+            current += char
+    if args:
+        values.append(current)
+    return values
@@ -0,0 +1,309 @@
+"""
+Host stand-in for the MicroPython ``machine`` module.
+
+Only the parts used by the project are provided. ``UART`` instances are
+connected to a simulated device (see ``esp01.ESP01``) that models the
+wire time of every byte at the configured baud rate, the RX ring buffer
+size and the ``timeout``/``timeout_char`` semantics of the rp2 port.
+"""
+
+import threading
+import time
+
+_pins = {}
+_uart_devices = {}
+
+
+def attach_uart(uart_id, device):
+    """
+    Connect a simulated device to the UART with the given id.
+    """
+    _uart_devices[uart_id] = device
+    return device
+
+
+def get_uart_device(uart_id):
+    device = _uart_devices.get(uart_id)
+    if device is None:
+        from esp01 import ESP01
+
+        device = attach_uart(uart_id, ESP01())
+    return device
+
+
+def reset_devices():
+    _uart_devices.clear()
+    _pins.clear()
+
+
+def freq(hz=None):
+    return 125000000
+
+
+def unique_id():
+    return b"\xe6\x61\x38\x83\x7b\x4f\x2a\x2c"
+
+
+def lightsleep(ms=None):
+    if ms is not None:
+        time.sleep(ms / 1000)
+
+
+def idle():
+    time.sleep(0)
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self._value = 1 if pull == self.PULL_UP else 0
+        if value is not None:
+            self._value = 1 if value else 0
+        self._irq = None
+        _pins[id] = self
+
+    def init(self, mode=-1, pull=-1, value=None):
+        self.__init__(self.id, mode, pull, value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        previous = self._value
+        self._value = 1 if value else 0
+        if self._irq is not None and previous != self._value:
+            handler, trigger = self._irq
+            if (trigger & self.IRQ_RISING and self._value) or (
+                trigger & self.IRQ_FALLING and not self._value
+            ):
+                handler(self)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(not self._value)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self._irq = (handler, trigger) if handler is not None else None
+
+    __call__ = value
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, callback=None):
+        self._timer = None
+        if callback is not None:
+            self.init(mode=mode, period=period, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=None, callback=None):
+        self.deinit()
+        if freq is not None:
+            period = 1000 / freq
+        self._mode = mode
+        self._period = max(period, 0) / 1000
+        self._callback = callback
+        self._schedule()
+
+    def _schedule(self):
+        self._timer = threading.Timer(self._period, self._fire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _fire(self):
+        if self._mode == self.PERIODIC:
+            self._schedule()
+        if self._callback is not None:
+            self._callback(self)
+
+    def deinit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class UART:
+    INV_TX = 1
+    INV_RX = 2
+    CTS = 1
+    RTS = 2
+
+    def __init__(self, id, baudrate=115200, **kwargs):
+        self.id = id
+        self.device = get_uart_device(id)
+        self._rx = bytearray()
+        self._last_arrival = 0.0
+        self.overflows = 0
+        self.bits = 8
+        self.txbuf = 256
+        self.rxbuf = 256
+        self.timeout = 0.0
+        self._timeout_char = 0
+        self.init(baudrate, **kwargs)
+
+    def init(
+        self,
+        baudrate=None,
+        bits=None,
+        parity=None,
+        stop=None,
+        tx=None,
+        rx=None,
+        txbuf=None,
+        rxbuf=None,
+        timeout=None,
+        timeout_char=None,
+        **kwargs
+    ):
+        """
+        Like the rp2 port, arguments that are not given keep their value.
+        The device keeps its own rate: when the two differ, bytes in both
+        directions arrive as garbage.
+        """
+        if baudrate is not None:
+            self.baudrate = baudrate
+        if bits is not None:
+            self.bits = bits
+        if txbuf is not None:
+            self.txbuf = txbuf
+        if rxbuf is not None:
+            self.rxbuf = rxbuf
+        if timeout is not None:
+            self.timeout = timeout / 1000
+        if timeout_char is not None:
+            self._timeout_char = timeout_char / 1000
+        # like the rp2 port: at least one character time between bytes
+        self.byte_time = (self.bits + 2) / self.baudrate
+        self.timeout_char = max(self._timeout_char, 0.001, 13 / self.baudrate)
+
+    def deinit(self):
+        pass
+
+    def _pump(self):
+        """
+        Move every byte that has reached the pin into the RX ring buffer.
+        Bytes that find the buffer full are lost, as on the real port.
+        """
+        now = time.perf_counter()
+        data, last_arrival = self.device.take_arrived(now, self.baudrate)
+        if data:
+            free = self.rxbuf - len(self._rx)
+            if len(data) > free:
+                self.overflows += len(data) - free
+                data = data[:free]
+            self._rx += data
+            self._last_arrival = last_arrival
+        return now
+
+    def _wait_for(self, nbytes, deadline):
+        """
+        Block like the rp2 driver: wait up to ``timeout`` for the first byte,
+        then keep reading while bytes follow each other within
+        ``timeout_char``, until ``nbytes`` are buffered.
+        """
+        now = self._pump()
+        if not self._rx:
+            arrival = self.device.next_arrival()
+            if arrival is None or arrival > deadline:
+                if deadline > now:
+                    time.sleep(deadline - now)
+                self._pump()
+                if not self._rx:
+                    return
+            elif arrival > now:
+                time.sleep(arrival - now)
+                self._pump()
+        while len(self._rx) < nbytes:
+            arrival = self.device.burst_end(
+                self._last_arrival, self.timeout_char, nbytes - len(self._rx)
+            )
+            if arrival is None:
+                return
+            now = time.perf_counter()
+            if arrival > now:
+                time.sleep(arrival - now)
+            self._pump()
+
+    def any(self):
+        self._pump()
+        return len(self._rx)
+
+    def next_arrival(self):
+        """
+        Host only: when the next byte reaches the RX buffer, or None.
+        """
+        return self.device.next_arrival()
+
+    def read(self, nbytes=None):
+        if nbytes is None:
+            nbytes = self.rxbuf
+        self._wait_for(nbytes, time.perf_counter() + self.timeout)
+        if not self._rx:
+            return None
+        data = bytes(self._rx[:nbytes])
+        del self._rx[:nbytes]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        if nbytes is None:
+            nbytes = len(buf)
+        self._wait_for(nbytes, time.perf_counter() + self.timeout)
+        if not self._rx:
+            return None
+        count = min(nbytes, len(self._rx))
+        buf[:count] = self._rx[:count]
+        del self._rx[:count]
+        return count
+
+    def readline(self):
+        deadline = time.perf_counter() + self.timeout
+        while b"\n" not in self._rx:
+            before = len(self._rx)
+            self._wait_for(before + 1, deadline)
+            if len(self._rx) == before:
+                break
+        if not self._rx:
+            return None
+        end = self._rx.find(b"\n") + 1 or len(self._rx)
+        data = bytes(self._rx[:end])
+        del self._rx[:end]
+        return data
+
+    def write(self, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        data = bytes(buf)
+        now = time.perf_counter()
+        done = self.device.receive(data, now, self.baudrate)
+        # the call returns once everything but txbuf bytes is on the wire
+        blocked = done - self.txbuf * self.byte_time
+        if blocked > now:
+            time.sleep(blocked - now)
+        return len(data)
+
+    def flush(self):
+        done = self.device.tx_done_time()
+        now = time.perf_counter()
+        if done > now:
+            time.sleep(done - now)
+
+    def txdone(self):
+        return self.device.tx_done_time() <= time.perf_counter()
+
+    def sendbreak(self):
+        pass
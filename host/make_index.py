@@ -0,0 +1,84 @@
+"""
+Write the update manifest: ``index.json`` maps every file the updater
+installs to its size and sha256, so a device only downloads the files
+whose content changed. ``update.bundle`` has all those files in a single
+zlib stream, for updates that change many of them.
+
+Usage::
+
+    python host/make_index.py [path ...]
+
+The files already listed in ``index.json`` are hashed again and the paths
+given are added to them. Run it before publishing a new version.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import zlib
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(HOST_DIR)
+INDEX_FILE = "index.json"
+BUNDLE_FILE = "update.bundle"
+# the window the device keeps while it unpacks: 4 KiB
+BUNDLE_WBITS = 12
+BUNDLE_RECORD = "<IH"
+
+
+def file_entry(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    return {"size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def manifest(root, paths):
+    """
+    The manifest of ``paths`` under ``root``. The index cannot carry its
+    own hash, so it is listed without one and always downloaded.
+    """
+    return {
+        path: {} if path == INDEX_FILE else file_entry(os.path.join(root, path))
+        for path in paths
+    }
+
+
+def bundle(root, paths):
+    """
+    The files of ``paths`` under ``root`` as one zlib stream of records:
+    size and path length (``BUNDLE_RECORD``), the path, the content.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, BUNDLE_WBITS)
+    data = bytearray()
+    for path in paths:
+        with open(os.path.join(root, path), "rb") as file:
+            content = file.read()
+        name = path.encode()
+        data += compressor.compress(
+            struct.pack(BUNDLE_RECORD, len(content), len(name)) + name + content
+        )
+    return bytes(data + compressor.flush())
+
+
+def main(argv):
+    index_path = os.path.join(ROOT_DIR, INDEX_FILE)
+    with open(index_path) as file:
+        paths = list(json.load(file))
+    paths += [path for path in argv if path not in paths]
+    with open(index_path, "w") as file:
+        json.dump(manifest(ROOT_DIR, paths), file, indent=2)
+        file.write("\n")
+    data = bundle(ROOT_DIR, paths)
+    with open(os.path.join(ROOT_DIR, BUNDLE_FILE), "wb") as file:
+        file.write(data)
+    print(
+        "{}: {} files, {}: {} bytes".format(
+            INDEX_FILE, len(paths), BUNDLE_FILE, len(data)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
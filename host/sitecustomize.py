@@ -0,0 +1,107 @@
+"""
+MicroPython compatibility layer for running the project under CPython.
+
+Loaded automatically when ``host`` is on ``PYTHONPATH``::
+
+    PYTHONPATH=host:. python host/bench.py
+
+It maps the ``u*`` modules to their CPython equivalents and adds the
+MicroPython-only helpers the project relies on (``time.ticks_ms``,
+``gc.mem_free``, ``os.ilistdir``, ``sys.print_exception``).
+"""
+
+import binascii
+import gc
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import sys
+import time
+import traceback
+import tracemalloc
+
+HEAP_SIZE = 264 * 1024
+
+_aliases = {
+    "ubinascii": binascii,
+    "uhashlib": hashlib,
+    "uio": io,
+    "ujson": json,
+    "ure": re,
+    "ustruct": struct,
+    "utime": time,
+}
+for _name, _module in _aliases.items():
+    sys.modules.setdefault(_name, _module)
+
+
+def _ticks_ms():
+    return int(time.monotonic() * 1000)
+
+
+def _ticks_us():
+    return int(time.monotonic() * 1000000)
+
+
+def _ticks_diff(end, start):
+    return end - start
+
+
+def _ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def _sleep_us(us):
+    time.sleep(us / 1000000)
+
+
+for _name, _func in (
+    ("ticks_ms", _ticks_ms),
+    ("ticks_us", _ticks_us),
+    ("ticks_diff", _ticks_diff),
+    ("ticks_add", _ticks_add),
+    ("sleep_ms", _sleep_ms),
+    ("sleep_us", _sleep_us),
+):
+    if not hasattr(time, _name):
+        setattr(time, _name, _func)
+
+
+def _mem_alloc():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def _mem_free():
+    return max(HEAP_SIZE - _mem_alloc(), 0)
+
+
+if not hasattr(gc, "mem_alloc"):
+    gc.mem_alloc = _mem_alloc
+    gc.mem_free = _mem_free
+
+
+def _ilistdir(path=""):
+    for entry in os.scandir(path or "."):
+        entry_type = 0x4000 if entry.is_dir() else 0x8000
+        yield (entry.name, entry_type, entry.inode(), entry.stat().st_size)
+
+
+if not hasattr(os, "ilistdir"):
+    os.ilistdir = _ilistdir
+
+
+def _print_exception(exc, file=sys.stdout):
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=file)
+
+
+if not hasattr(sys, "print_exception"):
+    sys.print_exception = _print_exception
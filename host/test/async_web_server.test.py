@@ -0,0 +1,89 @@
+"""
+Host only: serve requests with async_web_server against the simulated
+ESP-01 while another task keeps running on the same event loop.
+
+    PYTHONPATH=host:. python host/test/async_web_server.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+import uasyncio as asyncio
+
+import machine
+from esp01 import ESP01
+from components.esp.async_web_server import async_web_server
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+REQUEST = b"GET /up HTTP/1.1\r\nHost: 192.168.1.50\r\n\r\n"
+
+
+class AsyncWebServerTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    async def ticker(self, ticks):
+        while True:
+            ticks.append(1)
+            await asyncio.sleep_ms(1)
+
+    async def serve_once(self, esp, server):
+        ticks = []
+        task = asyncio.create_task(self.ticker(ticks))
+
+        # Nothing arrives: the wait ends on its timeout, not by blocking
+        headers, body, conn_id = await server.receive_frame(0.05)
+        self.assert_equal(None, headers)
+        self.assert_equal(True, len(ticks) > 10)
+
+        link = esp.connect_client(REQUEST)
+        headers, body, conn_id = await server.receive_frame(1)
+        self.assert_equal(True, headers.startswith("GET /up "))
+        self.assert_equal(link.link_id, conn_id)
+
+        self.assert_equal(True, await server.send_ok_response(conn_id))
+        self.assert_equal(True, link.received.endswith(b"\r\n\r\nOK"))
+        self.assert_equal(True, await server.close_link(conn_id))
+
+        response = await server.send_command("AT")
+        self.assert_equal(True, response.strip().endswith("OK"))
+        task.cancel()
+
+    def run_tests(self):
+        # away from a baudrate file other tests left in the working directory
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            machine.reset_devices()
+            esp = ESP01(baudrate=115200, ssid="test", password="test-pass")
+            esp.joined = "test"
+            esp.echo = False
+            machine.attach_uart(1, esp)
+
+            server = async_web_server("test", "test-pass", 4, 5)
+            self.assert_equal(True, server.start_web_server(80))
+            asyncio.run(self.serve_once(esp, server))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = AsyncWebServerTestCase()
+test_case.run_tests()
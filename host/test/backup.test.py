@@ -0,0 +1,202 @@
+"""
+Host only: the backup of an update holds the files it overwrites or
+deletes, and nothing else; a journal undoes a failed or unfinished one.
+
+    PYTHONPATH=host:. python host/test/backup.test.py
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from esp01 import http_file_server
+from make_index import manifest
+from components.updater.backup_manager import BackupManager
+from components.updater.manifest_manager import ManifestManager
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import new_updater, read_file, read_tree, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REMOTE = {
+    "boot.py": b"print('boot')\n",
+    "components/a.py": b"print('a2')\n",
+    "components/new.py": b"print('new')\n",
+    "version.json": b'{"version": 3}',
+}
+LOCAL = {
+    "boot.py": b"print('boot')\n",
+    "components/a.py": b"print('a1')\n",
+    "components/old.py": b"print('old')\n",
+    "version.json": b'{"version": 2}',
+    "main.txt": b"log lines",
+}
+
+
+class BackupTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def install_local(self):
+        # the installed version, with the manifest its update left
+        shutil.rmtree("main", ignore_errors=True)
+        write_files("main", LOCAL)
+        index = manifest("main", [name for name in LOCAL if name != "main.txt"])
+        ManifestManager(main_dir="main").save(index)
+        return read_tree("main")
+
+    def device_updater(self, root):
+        # the version in the working directory, where boot.py runs it from
+        return new_updater(
+            http_file_server(root),
+            backup_manager=BackupManager(
+                main_dir="", backup_dir="backup", new_version_dir="new"
+            ),
+        )
+
+    def cut_install(self, root, name):
+        # a reset right after name is moved in
+        shutil.rmtree("new", ignore_errors=True)
+        shutil.rmtree("components", ignore_errors=True)
+        write_files(".", LOCAL)
+        index = manifest(".", [name for name in LOCAL if name != "main.txt"])
+        ManifestManager(main_dir="").save(index)
+        instance = self.device_updater(root)
+        move_file = instance.backup_manager._move_file
+
+        def cut_move(from_path, to_path):
+            move_file(from_path, to_path)
+            if from_path == "new/" + name:
+                raise OSError("power lost")
+
+        instance.backup_manager._move_file = cut_move
+        self.assert_equal(False, instance.start_update())
+        self.assert_equal(REMOTE[name], read_file(name))
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(root, REMOTE)
+        index = manifest(root, list(REMOTE))
+        with open(os.path.join(root, "index.json"), "w") as file:
+            json.dump(index, file)
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            # Only what the update overwrites or deletes is backed up
+            self.install_local()
+            manager = BackupManager(
+                main_dir="main", backup_dir="backup", new_version_dir="new"
+            )
+            self.assert_equal(
+                True,
+                manager.create_backup(
+                    ["components/a.py", "components/new.py", "components/old.py"]
+                ),
+            )
+            with open("backup/journal.json") as file:
+                journal = json.load(file)
+            self.assert_equal(
+                ["components/a.py", "components/old.py"], journal["saved"]
+            )
+            self.assert_equal(["components/new.py"], journal["added"])
+            self.assert_equal(
+                ["components/a.py", "components/old.py", "journal.json"],
+                sorted(read_tree("backup")),
+            )
+
+            # An update that did not finish is undone by the next backup
+            write_files("main", {"components/a.py": b"half"})
+            write_files("main", {"components/new.py": b""})
+            os.remove("main/components/old.py")
+            before = read_tree("backup")
+            self.assert_equal(True, manager.create_backup(["boot.py"]))
+            tree = read_tree("main")
+            self.assert_equal(LOCAL["components/a.py"], tree["components/a.py"])
+            self.assert_equal(False, "components/new.py" in tree)
+            self.assert_equal(LOCAL["components/old.py"], tree["components/old.py"])
+            self.assert_equal(True, before != read_tree("backup"))
+            manager.delete_backup()
+            self.assert_equal(False, os.path.exists("backup"))
+
+            # So is a restore that was cut short, however far it went
+            installed = self.install_local()
+            saved = ["components/a.py", "components/old.py"]
+            self.assert_equal(True, manager.create_backup(saved))
+            os.remove("main/components/old.py")
+            os.replace("backup/components/a.py", "main/components/a.py")
+            self.assert_equal(True, manager.create_backup(["boot.py"]))
+            self.assert_equal(installed, read_tree("main"))
+            manager.delete_backup()
+
+            # An installed update is not undone, though its backup was left
+            self.install_local()
+            self.assert_equal(True, manager.create_backup(saved))
+            manager.create_new_version(["components/a.py"])
+            write_files("new", {"components/a.py": REMOTE["components/a.py"]})
+            manager.install_new_version(["components/old.py"])
+            installed = read_tree("main")
+            self.assert_equal(True, manager.create_backup(["boot.py"]))
+            self.assert_equal(installed, read_tree("main"))
+            self.assert_equal(REMOTE["components/a.py"], installed["components/a.py"])
+            manager.delete_backup()
+
+            # An update replaces, adds and deletes files, and leaves the rest
+            installed = self.install_local()
+            boot_mtime = os.stat("main/boot.py").st_mtime_ns
+            instance = new_updater(http_file_server(root))
+            self.assert_equal(True, instance.update_process(index))
+            tree = read_tree("main")
+            for name, content in REMOTE.items():
+                self.assert_equal(content, tree[name])
+            self.assert_equal(False, "components/old.py" in tree)
+            self.assert_equal(installed["main.txt"], tree["main.txt"])
+            self.assert_equal(boot_mtime, os.stat("main/boot.py").st_mtime_ns)
+            self.assert_equal(False, os.path.exists("backup"))
+            self.assert_equal(False, os.path.exists("new"))
+
+            # A failed download puts everything back
+            installed = self.install_local()
+            index["missing.py"] = {"size": 1, "sha256": "0" * 64}
+            instance = new_updater(http_file_server(root))
+            self.assert_equal(False, instance.update_process(index))
+            self.assert_equal(installed, read_tree("main"))
+            self.assert_equal(False, os.path.exists("backup"))
+
+            # An install cut partway is undone before the update is looked
+            # for again: all of it is installed, whichever file was moved
+            os.mkdir("device")
+            os.chdir("device")
+            del index["missing.py"]
+            for name in ["components/a.py", "components/new.py", "version.json"]:
+                self.cut_install(root, name)
+                instance = self.device_updater(root)
+                self.assert_equal(True, instance.start_update())
+                for path, content in REMOTE.items():
+                    self.assert_equal(content, read_file(path))
+                self.assert_equal(False, os.path.exists("components/old.py"))
+                # and the manifest has the hashes of what is installed
+                changed = ManifestManager(main_dir="").changed_files(index)
+                self.assert_equal([], changed)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = BackupTestCase()
+test_case.run_tests()
@@ -0,0 +1,80 @@
+"""
+Host only: negotiate the UART rate with the simulated ESP-01.
+
+    PYTHONPATH=host:. python host/test/baudrate.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+import machine
+from esp01 import ESP01
+from components.esp.wifi import wifi_module
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+
+class BaudrateTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_device(self, **kwargs):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass", **kwargs)
+        machine.attach_uart(1, esp)
+        return esp
+
+    def run_tests(self):
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        cwd = os.getcwd()
+        os.chdir(scratch)
+
+        try:
+            # Cold boot: climb to the fastest rate and remember it
+            esp = self.new_device()
+            wifi = wifi_module("test", "test-pass", 4, 5)
+            self.assert_equal(921600, wifi.negotiate_baudrate())
+            self.assert_equal(921600, esp.baudrate)
+            self.assert_equal(921600, wifi._load_baudrate())
+
+            # Warm boot: the saved rate is used from the start
+            wifi = wifi_module("test", "test-pass", 4, 5)
+            self.assert_equal(921600, wifi.BAUDRATE)
+            sent = len(esp.commands)
+            self.assert_equal(921600, wifi.negotiate_baudrate())
+            self.assert_equal([b"AT"], esp.commands[sent:])
+
+            # Power cycle: the ESP is back at 115200, the saved rate is stale
+            esp = self.new_device()
+            wifi = wifi_module("test", "test-pass", 4, 5)
+            self.assert_equal(921600, wifi.negotiate_baudrate())
+
+            # A noisy link above 460800 falls back to the next rate
+            esp = self.new_device(noise_baudrate=460800, noise_rate=0.01)
+            os.remove(wifi.BAUDRATE_FILE)
+            wifi = wifi_module("test", "test-pass", 4, 5)
+            self.assert_equal(460800, wifi.negotiate_baudrate())
+            self.assert_equal(460800, esp.baudrate)
+            self.assert_equal(True, wifi._send_and_receive_command("AT").endswith("OK\r\n"))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = BaudrateTestCase()
+test_case.run_tests()
@@ -0,0 +1,111 @@
+"""
+Host only: an update that changes many files comes in one compressed
+bundle, unpacked into the new version; without a usable bundle the files
+are downloaded one by one.
+
+    PYTHONPATH=host:. python host/test/bundle.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+from esp01 import http_file_server
+from make_index import BUNDLE_FILE, bundle, manifest
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import new_updater, read_file, recording, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REMOTE = {
+    "boot.py": b"print('boot')\n" * 300,
+    "components/a.py": b"print('a')\n" * 50,
+    "components/esp/b.py": bytes(range(256)) * 20,
+    "lib/c.py": "print('señal')\n".encode(),
+    "version.json": b'{"version": 3}',
+    "empty.txt": b"",
+}
+# the installed version already has lib/c.py
+LOCAL = {
+    "lib/c.py": "print('señal')\n".encode(),
+    "version.json": b'{"version": 2}',
+}
+
+
+class BundleTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def update(self, root, index, download_links=1):
+        requested = []
+        instance = new_updater(
+            recording(http_file_server(root), requested), download_links
+        )
+        shutil.rmtree("main", ignore_errors=True)
+        write_files("main", LOCAL)
+        result = instance.update_process(index)
+        for name in index:
+            self.assert_equal(REMOTE[name], read_file("main/" + name))
+        self.assert_equal(False, os.path.exists("new"))
+        return result, requested
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(root, REMOTE)
+        index = manifest(root, list(REMOTE))
+        data = bundle(root, list(REMOTE))
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            # One request brings every changed file
+            with open(os.path.join(root, BUNDLE_FILE), "wb") as file:
+                file.write(data)
+            for download_links in (1, 3):
+                result, requested = self.update(root, index, download_links)
+                self.assert_equal(True, result)
+                self.assert_equal([BUNDLE_FILE], requested)
+            self.assert_equal(True, len(data) < sum(map(len, REMOTE.values())))
+
+            # A truncated bundle: the files come one by one instead
+            with open(os.path.join(root, BUNDLE_FILE), "wb") as file:
+                file.write(data[: len(data) // 2])
+            result, requested = self.update(root, index)
+            self.assert_equal(True, result)
+            self.assert_equal(BUNDLE_FILE, requested[0])
+            self.assert_equal(5, len(requested[1:]))
+
+            # And so without one
+            os.remove(os.path.join(root, BUNDLE_FILE))
+            result, requested = self.update(root, index, 3)
+            self.assert_equal(True, result)
+            self.assert_equal(BUNDLE_FILE, requested[0])
+            self.assert_equal(
+                sorted(name for name in REMOTE if name != "lib/c.py"),
+                sorted(requested[1:]),
+            )
+
+            # Few changed files are downloaded as files
+            result, requested = self.update(root, list(REMOTE)[-3:])
+            self.assert_equal(BUNDLE_FILE in requested, False)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = BundleTestCase()
+test_case.run_tests()
@@ -0,0 +1,110 @@
+"""
+Host only: serve a long page and a short reply to two clients of the
+simulated ESP-01 at the same time.
+
+    PYTHONPATH=host:. python host/test/concurrent_links.test.py
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import uasyncio as asyncio
+
+import machine
+from esp01 import ESP01
+from components.esp.async_web_server import async_web_server
+from components.esp.http_link import http_link
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+PAGE_REQUEST = b"GET / HTTP/1.1\r\nHost: 192.168.1.50\r\n\r\n"
+UP_REQUEST = b"GET /up HTTP/1.1\r\nHost: 192.168.1.50\r\n\r\n"
+
+
+class ConcurrentLinksTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    async def serve(self, server, page_path, rounds):
+        """
+        The loop of WebServer.handle_requests.
+        """
+        while True:
+            responding = server.is_responding()
+            headers, body, conn_id = await server.receive_frame(0 if responding else 0.05)
+            if headers is not None:
+                if headers.startswith("GET /up"):
+                    server.queue_ok_response(conn_id)
+                else:
+                    server.queue_web_file(conn_id, page_path)
+            if responding:
+                rounds.append(sorted(server.links))
+                await server.service_links()
+
+    async def serve_two(self, esp, server, page_path, page):
+        rounds = []
+        task = asyncio.create_task(self.serve(server, page_path, rounds))
+        now = time.perf_counter()
+        page_link = esp.connect_client(PAGE_REQUEST, now)
+        up_link = esp.connect_client(UP_REQUEST, now + 0.1)
+
+        # The short reply goes out while the page is still being sent
+        while not up_link.received.endswith(b"OK"):
+            await asyncio.sleep_ms(5)
+        self.assert_equal(False, page_link.closed)
+        self.assert_equal(True, 0 < len(page_link.received) < len(page))
+
+        while not page_link.closed:
+            await asyncio.sleep_ms(5)
+        body = bytes(page_link.received).partition(b"\r\n\r\n")[2]
+        self.assert_equal(True, body.endswith(b"0\r\n\r\n"))
+        self.assert_equal(True, [0, 1] in rounds)
+        # The page link is closed, the other one waits for its next request
+        await asyncio.sleep_ms(20)
+        self.assert_equal([1], sorted(server.links))
+        self.assert_equal(http_link.IDLE, server.links[1].state)
+        task.cancel()
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        page_path = os.path.join(root, "index.html")
+        page = b"<p>" + b"curtains " * 2000 + b"</p>"
+        with open(page_path, "wb") as file:
+            file.write(page)
+
+        # away from a baudrate file other tests left in the working directory
+        cwd = os.getcwd()
+        os.chdir(root)
+        try:
+            machine.reset_devices()
+            esp = ESP01(baudrate=115200, ssid="test", password="test-pass")
+            esp.joined = "test"
+            esp.echo = False
+            machine.attach_uart(1, esp)
+
+            server = async_web_server("test", "test-pass", 4, 5)
+            self.assert_equal(True, server.start_web_server(80))
+            asyncio.run(self.serve_two(esp, server, page_path, page))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = ConcurrentLinksTestCase()
+test_case.run_tests()
@@ -0,0 +1,98 @@
+"""
+Host only: an update from a hashed index.json downloads only the files
+that differ from the installed ones.
+
+    PYTHONPATH=host:. python host/test/delta_update.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+from esp01 import http_file_server
+from make_index import manifest
+from components.updater.manifest_manager import ManifestManager
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import new_updater, read_file, recording, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REMOTE = {
+    "a.py": b"print('a')\n",
+    "lib/b.py": b"print('b2')\n",
+    "c.py": b"print('c')\n",
+    "version.json": b'{"version": 3}',
+}
+LOCAL = {
+    "a.py": b"print('a')\n",
+    "lib/b.py": b"print('b1')\n",
+    "version.json": b'{"version": 2}',
+    "old.py": b"print('old')\n",
+}
+
+
+class DeltaUpdateTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(root, REMOTE)
+        index = manifest(root, list(REMOTE))
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            for download_links in (1, 3):
+                shutil.rmtree("main", ignore_errors=True)
+                write_files("main", LOCAL)
+                requested = []
+                instance = new_updater(
+                    recording(http_file_server(root), requested), download_links
+                )
+
+                # Only the changed and the new files are downloaded
+                self.assert_equal(True, instance.update_process(index))
+                self.assert_equal(
+                    ["c.py", "lib/b.py", "version.json"], sorted(requested)
+                )
+                for name, content in REMOTE.items():
+                    self.assert_equal(content, read_file("main/" + name))
+                self.assert_equal(False, os.path.exists("backup"))
+                self.assert_equal(False, os.path.exists("new"))
+                # only the files of the same size are read to compare them
+                stats = instance.manifest_manager.hash_stats()
+                self.assert_equal(3, stats["files"])
+
+            # The hashes of the installed files are saved: nothing is read
+            manager = ManifestManager(main_dir="main")
+            self.assert_equal([], manager.changed_files(index))
+            self.assert_equal(0, manager.hash_stats()["files"])
+
+            # A file changed on the device is downloaded again
+            write_files("main", {"a.py": b"print('local')\n"})
+            self.assert_equal(["a.py"], manager.changed_files(index))
+
+            # A plain list of paths downloads every file, as before
+            self.assert_equal(list(REMOTE), manager.changed_files(list(REMOTE)))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = DeltaUpdateTestCase()
+test_case.run_tests()
@@ -0,0 +1,107 @@
+"""
+Host only: stream downloads from the simulated ESP-01 to files, in
+command mode, with passive receive and over transparent transmission.
+
+    PYTHONPATH=host:. python host/test/download.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+import machine
+from esp01 import ESP01, http_file_server
+from components.esp.web_client import web_client
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+URL = "http://files/"
+
+
+class DownloadTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_client(self, root):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass", escape_latency=0.05)
+        esp.joined = "test"
+        esp.add_host("files", 8000, http_file_server(root))
+        esp.add_host("chunked", 8000, http_file_server(root, chunk_size=700))
+        machine.attach_uart(1, esp)
+        client = web_client("test", "test-pass", 4, 5, baudrate=115200)
+        client.PASSTHROUGH_EXIT_DELAY_MS = 60
+        return esp, client
+
+    def download(self, client, name, path, url=URL, **kwargs):
+        slices = []
+
+        def write(data):
+            slices.append(len(data))
+            file.write(data)
+
+        with open(path, "wb") as file:
+            result = client.download(url + name, write, 8000, **kwargs)
+        with open(path, "rb") as file:
+            return result, file.read(), max(slices or [0])
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        try:
+            data = bytes(range(256)) * 80 + "señal\r\n\r\n".encode()
+            with open(os.path.join(root, "data.bin"), "wb") as file:
+                file.write(data)
+            target = os.path.join(root, "out.bin")
+
+            for mode, kwargs in (
+                ("command", {}),
+                ("passive", {}),
+                ("passthrough", {"passthrough": True}),
+            ):
+                esp, client = self.new_client(root)
+                if mode == "passive":
+                    client.set_passive_receive()
+                (header, size, status), written, largest = self.download(
+                    client, "data.bin", target, **kwargs
+                )
+                # Binary content arrives intact, never more than a buffer at once
+                self.assert_equal(200, status)
+                self.assert_equal(len(data), size)
+                self.assert_equal(data, written)
+                self.assert_equal(True, largest <= client.DOWNLOAD_BUFFER_LENGTH)
+
+                # A missing file gives no status and writes nothing
+                result, written, largest = self.download(client, "missing", target, **kwargs)
+                self.assert_equal((None, None, None), result)
+                self.assert_equal(b"", written)
+                client.close_passthrough()
+
+                # Chunked bodies are decoded; their end keeps the connection
+                for _ in range(2):
+                    (header, size, status), written, largest = self.download(
+                        client, "data.bin", target, "http://chunked/", **kwargs
+                    )
+                    self.assert_equal(data, written)
+                starts = [c for c in esp.commands if c.startswith(b"AT+CIPSTART")]
+                self.assert_equal(1, len([c for c in starts if b"192.168.1.101" in c]))
+                client.close_passthrough()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = DownloadTestCase()
+test_case.run_tests()
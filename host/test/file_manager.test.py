@@ -0,0 +1,107 @@
+"""
+Host only: FileManager copies, moves and removes trees through one buffer
+and without recursion, and keeps count of it.
+
+    PYTHONPATH=host:. python host/test/file_manager.test.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from components.file_manager import FileManager
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import read_tree, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+FILES = {
+    "a.txt": b"0123456789" * 3,
+    "empty.txt": b"",
+    "lib/b.bin": bytes(range(256)),
+    "lib/deep/c.py": "señal".encode(),
+    "skip/d.txt": b"skipped",
+}
+
+
+class FileManagerTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            write_files("tree", FILES)
+            manager = FileManager("tree", "copy", "backup", buffer_size=7)
+
+            # Files larger than the buffer are copied whole, through it
+            manager._copy_directory("tree", "copy", exclude=["tree/skip"])
+            expected = dict(FILES)
+            del expected["skip/d.txt"]
+            self.assert_equal(expected, read_tree("copy"))
+            self.assert_equal(7, len(manager._buffer))
+            stats = manager.file_stats()
+            self.assert_equal(4, stats["files"])
+            self.assert_equal(sum(map(len, expected.values())), stats["bytes"])
+
+            # Listing gives relative paths, parents before children
+            self.assert_equal(sorted(FILES), sorted(manager._list_files("tree")))
+            walked = [path for path, is_dir in manager._walk("tree")]
+            self.assert_equal(
+                True, walked.index("tree/lib") < walked.index("tree/lib/deep/c.py")
+            )
+
+            # Moves are counted, and replace the target
+            manager._move_file("copy/a.txt", "copy/empty.txt")
+            self.assert_equal(FILES["a.txt"], read_tree("copy")["empty.txt"])
+            self.assert_equal(1, manager.file_stats()["moved"])
+
+            # A tree deeper than the recursion limit is still removed
+            depth = 300
+            path = "copy"
+            for _ in range(depth):
+                path += "/d"
+                os.mkdir(path)
+            with open(path + "/leaf.txt", "wb") as file:
+                file.write(b"leaf")
+            limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(100)
+            try:
+                walked = list(manager._walk("copy/d"))
+                before = manager.file_stats()["removed"]
+                manager._rmtree("copy")
+            finally:
+                sys.setrecursionlimit(limit)
+            self.assert_equal(depth, len(walked))
+            self.assert_equal(False, os.path.exists("copy"))
+            # 3 files and the leaf, lib and lib/deep, the d chain and copy
+            self.assert_equal(
+                3 + 1 + 2 + depth + 1, manager.file_stats()["removed"] - before
+            )
+
+            # What is preserved stays
+            manager._rmtree("tree", preserve=["tree"])
+            self.assert_equal(FILES, read_tree("tree"))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = FileManagerTestCase()
+test_case.run_tests()
@@ -0,0 +1,56 @@
+"""
+Host only: wait for the simulated ESP-01 with each idle strategy.
+
+    PYTHONPATH=host:. python host/test/idle.test.py
+"""
+
+import machine
+from esp01 import ESP01
+from components.esp.wifi import wifi_module
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+
+class IdleTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        for strategy in (
+            wifi_module.IDLE_POLL,
+            wifi_module.IDLE_SLEEP,
+            wifi_module.IDLE_LIGHTSLEEP,
+        ):
+            machine.reset_devices()
+            esp = ESP01(ssid="test", password="test-pass", join_latency=0.2)
+            machine.attach_uart(1, esp)
+            wifi = wifi_module("test", "test-pass", 4, 5, baudrate=115200)
+            wifi.set_idle_strategy(strategy, 2)
+
+            # Joining takes 200 ms: most of it is spent idle
+            self.assert_equal(wifi.ESP8266_WIFI_CONNECTED, wifi.connect_to_wifi())
+            stats = wifi.idle_stats()
+            self.assert_equal(True, stats["wait_ms"] >= 200)
+            self.assert_equal(True, stats["idle_ratio"] > 0.5)
+
+            # Nothing arrives: the wait ends on its timeout
+            response = wifi._read_response(timeout=0.05)
+            self.assert_equal(0, len(response))
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = IdleTestCase()
+test_case.run_tests()
@@ -0,0 +1,111 @@
+"""
+Host only: reuse keep-alive connections and cached host addresses when
+fetching from the simulated ESP-01.
+
+    PYTHONPATH=host:. python host/test/keep_alive.test.py
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import machine
+from esp01 import ESP01, http_file_server
+from components.esp.web_client import web_client
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+
+class KeepAliveTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def count(self, esp, prefix):
+        return len([c for c in esp.commands if c.startswith(prefix)])
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        try:
+            files = {"a.txt": "señal\r\n\r\n", "b.json": '{"v": 1}' * 300}
+            for name, content in files.items():
+                with open(os.path.join(root, name), "w", encoding="utf-8") as file:
+                    file.write(content)
+
+            machine.reset_devices()
+            esp = ESP01(ssid="test", password="test-pass")
+            esp.joined = "test"
+            esp.add_host("files", 8000, http_file_server(root), ip="192.168.1.20")
+            esp.add_host("other", 8000, http_file_server(root))
+            machine.attach_uart(1, esp)
+            client = web_client("test", "test-pass", 4, 5, baudrate=115200)
+
+            # Both files come over one connection, opened to the cached address
+            for name, content in files.items():
+                header, body, status = client.get_url_response("http://files/" + name, 8000)
+                self.assert_equal(200, status)
+                self.assert_equal(content, body)
+            self.assert_equal(("files", 8000), client.connection)
+            self.assert_equal(1, self.count(esp, b'AT+CIPDOMAIN="files"'))
+            self.assert_equal(
+                [b'AT+CIPSTART="TCP","192.168.1.20",8000,10'],
+                [c for c in esp.commands if c.startswith(b"AT+CIPSTART")],
+            )
+            self.assert_equal(0, self.count(esp, b"AT+CIPCLOSE"))
+
+            # The server closes the idle connection: a new one, same address
+            esp.close_link(esp.links[0])
+            header, body, status = client.get_url_response("http://files/a.txt", 8000)
+            self.assert_equal(files["a.txt"], body)
+            self.assert_equal(2, self.count(esp, b"AT+CIPSTART"))
+            self.assert_equal(1, self.count(esp, b"AT+CIPDOMAIN"))
+
+            # Closed just before the request: sent again on a new connection
+            sent = self.count(esp, b"AT+CIPSEND=")
+            esp.close_link(esp.links[0], time.perf_counter() + 0.002)
+            header, body, status = client.get_url_response("http://files/a.txt", 8000)
+            self.assert_equal(files["a.txt"], body)
+            self.assert_equal(3, self.count(esp, b"AT+CIPSTART"))
+            self.assert_equal(2, self.count(esp, b"AT+CIPSEND=") - sent)
+
+            # Another host takes the place of the kept connection
+            closed = self.count(esp, b"AT+CIPCLOSE")
+            header, body, status = client.get_url_response("http://other/a.txt", 8000)
+            self.assert_equal(files["a.txt"], body)
+            self.assert_equal(1, self.count(esp, b"AT+CIPCLOSE") - closed)
+            self.assert_equal(("other", 8000), client.connection)
+
+            # Expired addresses are looked up again
+            client.DNS_TTL = 0
+            client.get_url_response("http://files/a.txt", 8000)
+            self.assert_equal(2, self.count(esp, b'AT+CIPDOMAIN="files"'))
+
+            # A failed request does not leave its connection behind
+            header, body, status = client.get_url_response("http://files/missing", 8000)
+            self.assert_equal(None, status)
+            self.assert_equal(None, client.connection)
+            self.assert_equal({}, esp.links)
+
+            # A name the ESP cannot resolve is handed to AT+CIPSTART as is
+            self.assert_equal("nowhere", client.resolve("nowhere"))
+            self.assert_equal("10.0.0.1", client.resolve("10.0.0.1"))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = KeepAliveTestCase()
+test_case.run_tests()
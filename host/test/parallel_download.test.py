@@ -0,0 +1,114 @@
+"""
+Host only: download files over several links of the simulated ESP-01 at
+once.
+
+    PYTHONPATH=host:. python host/test/parallel_download.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+import machine
+from esp01 import ESP01, http_file_server
+from components.esp.web_client import web_client
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+URL = "http://files/"
+
+
+class ParallelDownloadTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_client(self, root, chunk_size=None):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass", server_latency=0.02)
+        esp.joined = "test"
+        esp.add_host("files", 8000, http_file_server(root, chunk_size=chunk_size))
+        machine.attach_uart(1, esp)
+        client = web_client("test", "test-pass", 4, 5, baudrate=115200)
+        return esp, client
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        target = tempfile.mkdtemp(prefix="pico_test_")
+        try:
+            files = {}
+            for index in range(7):
+                name = "f{}.bin".format(index)
+                files[name] = bytes([index]) * (500 * index) + "señal".encode()
+                with open(os.path.join(root, name), "wb") as file:
+                    file.write(files[name])
+
+            def open_file(url):
+                return open(os.path.join(target, url[len(URL) :]), "wb")
+
+            for passive, chunk_size in ((False, None), (True, 300)):
+                esp, client = self.new_client(root, chunk_size)
+                if passive:
+                    client.set_passive_receive()
+                results = client.download_parallel(
+                    [URL + name for name in files], open_file, 8000, links=3
+                )
+
+                # Every file lands in its own file, whole
+                for name, content in files.items():
+                    self.assert_equal(200, results[URL + name][0])
+                    with open(os.path.join(target, name), "rb") as file:
+                        self.assert_equal(content, file.read())
+
+                # Three links, each kept alive from one file to the next
+                starts = [c for c in esp.commands if c.startswith(b"AT+CIPSTART")]
+                self.assert_equal([b"2", b"1", b"0"], [c[12:13] for c in starts])
+                self.assert_equal(0, esp.mux)
+                self.assert_equal({}, esp.links)
+
+                stats = client.download_stats()
+                self.assert_equal(7, stats["files"])
+                self.assert_equal(sum(len(content) for content in files.values()), stats["bytes"])
+
+            # A missing file stops the downloads
+            results = client.download_parallel(
+                [URL + "f1.bin", URL + "missing", URL + "f2.bin"], open_file, 8000, links=1
+            )
+            self.assert_equal(200, results[URL + "f1.bin"][0])
+            self.assert_equal(None, results[URL + "missing"][0])
+            self.assert_equal(False, URL + "f2.bin" in results)
+            self.assert_equal({}, esp.links)
+
+            # An ESP that will not leave multiple connections does not hide
+            # the results
+            serve = http_file_server(root)
+
+            def busy_server(request):
+                # a server started meanwhile: AT+CIPMUX=0 is refused
+                esp.server_port = 80
+                return serve(request)
+
+            esp.add_host("files", 8000, busy_server)
+            results = client.download_parallel([URL + "missing"], open_file, 8000, links=1)
+            self.assert_equal(None, results[URL + "missing"][0])
+            self.assert_equal(1, esp.mux)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(target, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = ParallelDownloadTestCase()
+test_case.run_tests()
@@ -0,0 +1,140 @@
+"""
+Host only: pull data from the simulated ESP-01 in passive receive mode,
+with a consumer too slow for the data to be pushed at it.
+
+    PYTHONPATH=host:. python host/test/passive_receive.test.py
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import machine
+from esp01 import ESP01, http_file_server
+from components.esp.web_client import web_client
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+CONTENT = bytes(range(32, 127)) * 40
+REQUEST = b"GET /data.bin HTTP/1.1\r\nHost: files\r\n\r\n"
+
+
+def stalling_server(esp, content, stall):
+    """
+    Handler that sends the first half of the body, then the rest after
+    stall seconds, framed by Content-Length.
+    """
+
+    def handler(request):
+        link = [link for link in esp.links.values() if link.host == "files"][0]
+        head = "HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n"
+        half = len(content) // 2
+        at = time.perf_counter() + 0.01
+        esp.send_to_host(link, head.format(len(content)).encode() + content[:half], at)
+        esp.send_to_host(link, content[half:], at + stall)
+        return None
+
+    return handler
+
+
+class PassiveReceiveTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_client(self, root):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass")
+        esp.joined = "test"
+        esp.echo = False
+        esp.add_host("files", 8000, http_file_server(root))
+        machine.attach_uart(1, esp)
+        return web_client("test", "test-pass", 4, 5, baudrate=115200)
+
+    def fetch(self, client, receive):
+        """
+        Ask for the file with a consumer that takes 100 ms per chunk, as a
+        slow flash write would.
+        """
+        received = bytearray()
+
+        def slow_consumer(link, data):
+            time.sleep(0.1)
+            received.extend(data)
+
+        client.create_tcp_connection("files", 8000)
+        client.set_link_consumer(None, slow_consumer)
+        client.send_data(None, REQUEST)
+        receive()
+        client.set_link_consumer(None, None)
+        return bytes(received).partition(b"\r\n\r\n")[2]
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        try:
+            with open(os.path.join(root, "data.bin"), "wb") as file:
+                file.write(CONTENT)
+
+            # Pushed data overflows the UART while the consumer is busy
+            client = self.new_client(root)
+            body = self.fetch(
+                client, lambda: client._receive_frames(lambda: None not in client.open_links, 5)
+            )
+            self.assert_equal(True, client.uart.overflows > 0)
+            self.assert_equal(False, body == CONTENT)
+
+            # Pulled data only comes when asked for
+            client = self.new_client(root)
+            client.set_passive_receive()
+            body = self.fetch(client, lambda: client._receive_passive(None, 5))
+            self.assert_equal(0, client.uart.overflows)
+            self.assert_equal(CONTENT, body)
+            self.assert_equal(0, client.available[None])
+
+            # Smaller pulls for a smaller buffer
+            client = self.new_client(root)
+            client.set_passive_receive()
+            sent = len(machine.UART(1).device.commands)
+            body = self.fetch(client, lambda: client._receive_passive(None, 5, size=256))
+            self.assert_equal(CONTENT, body)
+            pulls = machine.UART(1).device.commands[sent:]
+            self.assert_equal(True, b"AT+CIPRECVDATA=256" in pulls)
+            self.assert_equal(False, b"AT+CIPRECVDATA=960" in pulls)
+
+            # The usual request path pulls too
+            header, body, status = client.get_url_response("http://files/data.bin", 8000)
+            self.assert_equal(200, status)
+            self.assert_equal(CONTENT, body.encode())
+
+            # A framed body may stall for longer than the idle cut, pushed or pulled
+            for passive in (False, True):
+                client = self.new_client(root)
+                esp = machine.UART(1).device
+                esp.add_host("files", 8000, stalling_server(esp, CONTENT, 0.3))
+                if passive:
+                    client.set_passive_receive()
+                header, body, status = client.get_url_response(
+                    "http://files/data.bin", 8000
+                )
+                self.assert_equal(200, status)
+                self.assert_equal(CONTENT, (body or "").encode())
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = PassiveReceiveTestCase()
+test_case.run_tests()
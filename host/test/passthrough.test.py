@@ -0,0 +1,90 @@
+"""
+Host only: download files over transparent transmission from the
+simulated ESP-01.
+
+    PYTHONPATH=host:. python host/test/passthrough.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+import machine
+from esp01 import ESP01, http_file_server
+from components.esp.web_client import web_client
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+URL = "http://files/"
+
+
+class PassthroughTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_client(self, root):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass", escape_latency=0.05)
+        esp.joined = "test"
+        esp.add_host("files", 8000, http_file_server(root))
+        machine.attach_uart(1, esp)
+        client = web_client("test", "test-pass", 4, 5, baudrate=115200)
+        client.PASSTHROUGH_EXIT_DELAY_MS = 60
+        return esp, client
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        try:
+            files = {"a.txt": "señal\r\n\r\n+IPD,0,3:", "b.json": '{"v": 1}' * 300}
+            for name, content in files.items():
+                with open(os.path.join(root, name), "w", encoding="utf-8") as file:
+                    file.write(content)
+
+            # Both files go through one connection and one CIPSEND
+            esp, client = self.new_client(root)
+            for name, content in files.items():
+                header, body, status = client.get_url_passthrough(URL + name, 8000)
+                self.assert_equal(200, status)
+                self.assert_equal(content, body)
+            self.assert_equal(("files", 8000), client.passthrough)
+            self.assert_equal(1, esp.commands.count(b"AT+CIPSEND"))
+            self.assert_equal(1, len([c for c in esp.commands if c.startswith(b"AT+CIPSTART")]))
+
+            # Leaving it takes the ESP back to commands
+            client.close_passthrough()
+            self.assert_equal(None, client.passthrough)
+            self.assert_equal(0, esp.cipmode)
+            self.assert_equal(True, client._send_and_receive_command("AT").endswith("OK\r\n"))
+
+            # A missing file fails and leaves no pipe behind
+            header, body, status = client.get_url_passthrough(URL + "missing", 8000)
+            self.assert_equal(None, status)
+            self.assert_equal(None, client.passthrough)
+
+            # With multiple connections the ESP refuses the mode
+            esp, client = self.new_client(root)
+            client.set_multiple_connections(1)
+            client.get_url_passthrough(URL + "a.txt", 8000)
+            self.assert_equal(b"AT+CIPMODE=1", esp.commands[1])
+            self.assert_equal(None, client.passthrough)
+            self.assert_equal(0, esp.cipmode)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = PassthroughTestCase()
+test_case.run_tests()
@@ -0,0 +1,73 @@
+"""
+Host only: answer repeated queries to the simulated ESP-01 from the cache.
+
+    PYTHONPATH=host:. python host/test/query_cache.test.py
+"""
+
+import machine
+from esp01 import ESP01
+from components.esp.wifi import wifi_module
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+
+class QueryCacheTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def run_tests(self):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass")
+        esp.joined = "test"
+        machine.attach_uart(1, esp)
+        wifi = wifi_module("test", "test-pass", 4, 5, baudrate=115200)
+
+        # Repeated queries reach the ESP once
+        self.assert_equal(True, wifi.is_wifi_connected())
+        self.assert_equal(True, wifi.is_wifi_connected())
+        self.assert_equal("192.168.1.50", wifi.get_ip())
+        self.assert_equal("192.168.1.50", wifi.get_ip())
+        self.assert_equal(wifi.get_esp_version(), wifi.get_esp_version())
+        self.assert_equal(
+            [b"AT+CWJAP?", b"AT+CIFSR", b"AT+GMR"], esp.commands
+        )
+        self.assert_equal(
+            {"hits": 3, "misses": 3, "entries": 3}, wifi.query_cache_stats()
+        )
+
+        # An expired entry is asked again
+        wifi.QUERY_TTL = dict(wifi.QUERY_TTL, **{"AT+CIFSR": 0})
+        wifi.get_ip()
+        self.assert_equal(b"AT+CIFSR", esp.commands[-1])
+
+        # A WIFI DISCONNECT event drops the connection state, not the version
+        esp.emit(b"WIFI DISCONNECT\r\n", 0)
+        esp.joined = None
+        wifi._send_and_receive_command("AT")
+        self.assert_equal(False, wifi.is_wifi_connected())
+        self.assert_equal(b"AT+CWJAP?", esp.commands[-1])
+        wifi.get_esp_version()
+        self.assert_equal(b"AT+CWJAP?", esp.commands[-1])
+
+        # Joining again invalidates the cached "No AP"
+        wifi.connect_to_wifi()
+        self.assert_equal(True, wifi.is_wifi_connected())
+        self.assert_equal(b"AT+CWJAP?", esp.commands[-1])
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = QueryCacheTestCase()
+test_case.run_tests()
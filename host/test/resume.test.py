@@ -0,0 +1,142 @@
+"""
+Host only: an update whose download was cut goes on from where it
+stopped: files already downloaded are not asked for again, and the rest
+of a file downloaded in part comes with a Range request.
+
+    PYTHONPATH=host:. python host/test/resume.test.py
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from esp01 import http_file_server
+from make_index import manifest
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import installed, new_updater, read_tree, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REMOTE = {
+    "a.py": b"print('a')\n" * 40,
+    "b.py": b"print('b')\n" * 40,
+    "big.bin": bytes(range(256)) * 24,
+    "version.json": b'{"version": 3}',
+}
+CUT = "big.bin"
+
+
+def recording_server(root, requests, cut=None, ranges=True):
+    """
+    http_file_server that records (path, Range header) of every request;
+    the response for cut stops halfway and the connection closes.
+    """
+    serve = http_file_server(root, ranges=ranges)
+
+    def handler(request):
+        lines = request.split(b"\r\n")
+        path = lines[0].split(b" ")[1].decode()[1:]
+        first = None
+        for line in lines:
+            if line.lower().startswith(b"range:"):
+                first = line.split(b"=", 1)[1].decode()
+        requests.append((path, first))
+        response = serve(request)
+        if path == cut:
+            head, body = response.split(b"\r\n\r\n", 1)
+            head = head.replace(b"Connection: keep-alive", b"Connection: close")
+            return head + b"\r\n\r\n" + body[: len(body) // 2]
+        return response
+
+    return handler
+
+
+class ResumeTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def cut_update(self, root, index):
+        # the first attempt loses the connection in the middle of big.bin
+        shutil.rmtree("main", ignore_errors=True)
+        shutil.rmtree("new", ignore_errors=True)
+        os.makedirs("main")
+        requests = []
+        instance = new_updater(recording_server(root, requests, cut=CUT), 3)
+        self.assert_equal(False, instance.update_process(index))
+        with open("new/download.json") as file:
+            return json.load(file)
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(root, REMOTE)
+        index = manifest(root, list(REMOTE))
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            # What was downloaded is in the journal, big.bin in part
+            journal = self.cut_update(root, index)
+            self.assert_equal(sorted(REMOTE), sorted(journal))
+            self.assert_equal(False, journal[CUT][1])
+            self.assert_equal(index[CUT]["sha256"], journal[CUT][0])
+            held = os.path.getsize("new/" + CUT)
+            self.assert_equal(True, 0 < held < len(REMOTE[CUT]))
+            self.assert_equal({}, installed())
+
+            # Over several links, the rest of it comes with a Range request
+            done = [name for name in journal if journal[name][1]]
+            requests = []
+            instance = new_updater(recording_server(root, requests), 3)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(REMOTE, installed())
+            self.assert_equal("{}-".format(held), dict(requests)[CUT])
+            self.assert_equal([], [path for path, _ in requests if path in done])
+            self.assert_equal(False, os.path.exists("new"))
+
+            # And over the transparent connection
+            self.cut_update(root, index)
+            held = os.path.getsize("new/" + CUT)
+            requests = []
+            instance = new_updater(recording_server(root, requests), 1)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(REMOTE, installed())
+            self.assert_equal("{}-".format(held), dict(requests)[CUT])
+
+            # A server that ignores Range sends it all; the start is dropped
+            self.cut_update(root, index)
+            requests = []
+            instance = new_updater(recording_server(root, requests, ranges=False), 3)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(REMOTE, installed())
+
+            # A file of another update is downloaded again from the start
+            self.cut_update(root, index)
+            write_files(root, {CUT: bytes(range(255, -1, -1)) * 24})
+            changed = manifest(root, list(REMOTE))
+            requests = []
+            instance = new_updater(recording_server(root, requests), 3)
+            self.assert_equal(True, instance.update_process(changed))
+            self.assert_equal(read_tree(root), installed())
+            self.assert_equal(None, dict(requests)[CUT])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = ResumeTestCase()
+test_case.run_tests()
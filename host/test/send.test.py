@@ -0,0 +1,88 @@
+"""
+Host only: send binary payloads to the simulated ESP-01, batched and with
+AT+CIPSENDBUF when the firmware has it.
+
+    PYTHONPATH=host:. python host/test/send.test.py
+"""
+
+import machine
+from esp01 import ESP01
+from components.esp.web_server import web_server
+from lib.logging import basicConfig, CRITICAL
+
+basicConfig(level=CRITICAL + 1)
+
+
+class SendTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_server(self, **kwargs):
+        machine.reset_devices()
+        esp = ESP01(ssid="test", password="test-pass", **kwargs)
+        esp.joined = "test"
+        machine.attach_uart(1, esp)
+        server = web_server("test", "test-pass", 4, 5, baudrate=115200)
+        server.start_web_server(80)
+        link = esp.connect_client()
+        server._receive_frames(lambda: link.link_id in server.open_links, 1)
+        return esp, server, link
+
+    def sends(self, esp, sent):
+        return [c for c in esp.commands[sent:] if c.startswith(b"AT+CIPSEND")]
+
+    def run_tests(self):
+        # Firmware with AT+CIPSENDBUF: segments do not wait for SEND OK
+        esp, server, link = self.new_server(ack_latency=0.02)
+        self.assert_equal(True, server.send_buffered)
+        sent = len(esp.commands)
+        self.assert_equal(True, server.send_data(link.link_id, "señal"))
+        self.assert_equal([b"AT+CIPSENDBUF=0,6"], self.sends(esp, sent))
+        self.assert_equal("señal".encode(), bytes(link.received))
+        self.assert_equal(1, server._unacked[link.link_id])
+        self.assert_equal(True, server.wait_sent(link.link_id, 1))
+        self.assert_equal(0, server._unacked[link.link_id])
+
+        # Small parts share one CIPSEND, long data is cut in segments
+        link.received = bytearray()
+        sent = len(esp.commands)
+        parts = [b"ab", memoryview(b"cd"), bytearray(b"\x00\xff"), "é"]
+        self.assert_equal(True, server.send_batched(link.link_id, parts))
+        self.assert_equal([b"AT+CIPSENDBUF=0,8"], self.sends(esp, sent))
+        data = bytes(range(256)) * 9
+        sent = len(esp.commands)
+        self.assert_equal(True, server.send_data(link.link_id, data))
+        self.assert_equal(
+            [b"AT+CIPSENDBUF=0,2048", b"AT+CIPSENDBUF=0,256"], self.sends(esp, sent)
+        )
+        self.assert_equal(b"abcd\x00\xff" + "é".encode() + data, bytes(link.received))
+        self.assert_equal(True, server.wait_sent(link.link_id, 1))
+
+        # A SEND OK line answering a CIPSEND is not taken as an ack
+        esp, server, link = self.new_server(sendbuf=False)
+        self.assert_equal(False, server.send_buffered)
+        sent = len(esp.commands)
+        self.assert_equal(True, server.send_data(link.link_id, b"\r\nok\r\n"))
+        self.assert_equal([b"AT+CIPSEND=0,6"], self.sends(esp, sent))
+        self.assert_equal(b"\r\nok\r\n", bytes(link.received))
+
+        # The payload is written as is: no CRLF is left for the command line
+        self.assert_equal(True, server._send_and_receive_command("AT").endswith("OK\r\n"))
+        self.assert_equal(b"AT", esp.commands[-1])
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = SendTestCase()
+test_case.run_tests()
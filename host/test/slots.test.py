@@ -0,0 +1,142 @@
+"""
+Host only: updates are installed into the slot that is not running and
+the boot file follows a pointer to it; the running version is neither
+copied nor deleted.
+
+    PYTHONPATH=host:. python host/test/slots.test.py
+"""
+
+import os
+import shutil
+import tempfile
+
+from esp01 import http_file_server
+from make_index import manifest
+from components.updater.slot_manager import SlotManager
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import new_updater, read_file, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REMOTE = {
+    "boot.py": b"open('booted.txt', 'w').write('yes')\n",
+    "components/a.py": b"print('a')\n",
+    "version.json": b'{"version": 3}',
+}
+# the version installed before there were slots
+LEGACY = {
+    "boot.py": b"open('legacy.txt', 'w').write('yes')\n",
+    "components/a.py": b"print('a')\n",
+    "version.json": b'{"version": 2}',
+    "data.txt": b"kept",
+}
+
+
+class SlotsTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def new_updater(self, remote, device):
+        # a new boot: the slot manager reads the pointer again
+        return new_updater(
+            http_file_server(remote), backup_manager=SlotManager(root_dir=device)
+        )
+
+    def run_tests(self):
+        remote = tempfile.mkdtemp(prefix="pico_test_")
+        device = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(remote, REMOTE)
+        write_files(device, LEGACY)
+        index = manifest(remote, list(REMOTE))
+        pointer = os.path.join(device, "slot.txt")
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            # The first update moves the version installed at the root to a slot
+            instance = self.new_updater(remote, device)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(b"slot_a", read_file(pointer))
+            for name, content in REMOTE.items():
+                self.assert_equal(content, read_file(device + "/slot_a/" + name))
+            # the root keeps what it had, but boots through the loader
+            self.assert_equal(b"kept", read_file(device + "/data.txt"))
+            loader = read_file(device + "/boot.py")
+            self.assert_equal(True, b"slot.txt" in loader)
+            self.assert_equal(True, os.path.exists(device + "/slot_a/manifest.json"))
+
+            # Rolled back to, the root version boots with its own boot file
+            self.assert_equal(True, instance.backup_manager.restore_backup())
+            self.assert_equal(False, os.path.exists(pointer))
+            exec(loader.decode(), {})
+            self.assert_equal(b"yes", read_file("legacy.txt"))
+            # and updates from there as the first time, the boot file kept
+            instance = self.new_updater(remote, device)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(b"slot_a", read_file(pointer))
+            self.assert_equal(LEGACY["boot.py"], read_file(device + "/boot_root.py"))
+
+            # The next one goes to the other slot; the running one is untouched
+            write_files(remote, {"components/a.py": b"print('a2')\n"})
+            write_files(remote, {"version.json": b'{"version": 4}'})
+            index = manifest(remote, list(REMOTE))
+            before = os.stat(device + "/slot_a/components/a.py").st_mtime_ns
+            instance = self.new_updater(remote, device)
+            self.assert_equal(device + "/slot_a", instance.backup_manager.main_dir)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(b"slot_b", read_file(pointer))
+            self.assert_equal(
+                b"print('a2')\n", read_file(device + "/slot_b/components/a.py")
+            )
+            self.assert_equal(
+                before, os.stat(device + "/slot_a/components/a.py").st_mtime_ns
+            )
+            self.assert_equal(read_file(device + "/boot.py"), loader)
+
+            # Rolling back is a pointer write
+            self.assert_equal(True, instance.backup_manager.restore_backup())
+            self.assert_equal(b"slot_a", read_file(pointer))
+
+            # A failed download leaves the pointer where it was
+            instance = self.new_updater(remote, device)
+            index["missing.py"] = {"size": 1, "sha256": "0" * 64}
+            self.assert_equal(False, instance.update_process(index))
+            self.assert_equal(b"slot_a", read_file(pointer))
+
+            # The loader runs boot.py in the slot the pointer names
+            loader_globals = {}
+            exec(loader.decode(), loader_globals)
+            self.assert_equal(
+                os.path.realpath(device + "/slot_a"), os.path.realpath(os.getcwd())
+            )
+            self.assert_equal(b"yes", read_file(device + "/slot_a/booted.txt"))
+
+            # An unchanged file that cannot be kept leaves the pointer too
+            index = manifest(remote, list(REMOTE))
+            instance = self.new_updater(remote, device)
+            # the flash refuses the copy
+            instance.backup_manager._copy_file = lambda from_path, to_path: False
+            self.assert_equal(False, instance.update_process(index))
+            self.assert_equal(b"slot_a", read_file(pointer))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(remote, ignore_errors=True)
+            shutil.rmtree(device, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = SlotsTestCase()
+test_case.run_tests()
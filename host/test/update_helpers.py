@@ -0,0 +1,87 @@
+"""
+What the host tests of the updater share: scratch trees of files, and an
+updater talking to a server of the simulated ESP-01.
+
+The tests import it as a module next to them:
+
+    from update_helpers import URL, new_updater, write_files
+"""
+
+import os
+
+import machine
+from esp01 import ESP01
+from components.esp.web_client import web_client
+from components.updater.updater import updater
+from components.updater.backup_manager import BackupManager
+from components.updater.manifest_manager import ManifestManager
+
+URL = "http://files/"
+
+
+def write_files(root, files):
+    for name, content in files.items():
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(content)
+
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def read_tree(root):
+    tree = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as file:
+                tree[os.path.relpath(path, root)] = file.read()
+    return tree
+
+
+def installed(main_dir="main"):
+    # the files of the update, without the manifest it leaves
+    tree = read_tree(main_dir)
+    tree.pop("manifest.json", None)
+    return tree
+
+
+def recording(handler, requested):
+    """
+    handler, with the path of every request appended to requested.
+    """
+
+    def record(request):
+        requested.append(request.split(b" ")[1].decode()[1:])
+        return handler(request)
+
+    return record
+
+
+def new_updater(
+    handler, download_links=web_client.DOWNLOAD_LINKS, backup_manager=None
+):
+    """
+    An updater of URL, served by handler, that installs through
+    backup_manager: by default a BackupManager of main, backup and new in
+    the working directory.
+    """
+    machine.reset_devices()
+    esp = ESP01(ssid="test", password="test-pass", escape_latency=0.05)
+    esp.joined = "test"
+    esp.add_host("files", 8000, handler)
+    machine.attach_uart(1, esp)
+    instance = updater(
+        "test", "test-pass", URL, 8000, baudrate=115200, download_links=download_links
+    )
+    instance.esp_process.PASSTHROUGH_EXIT_DELAY_MS = 60
+    if backup_manager is None:
+        backup_manager = BackupManager(
+            main_dir="main", backup_dir="backup", new_version_dir="new"
+        )
+    instance.backup_manager = backup_manager
+    instance.manifest_manager = ManifestManager(main_dir=backup_manager.main_dir)
+    return instance
@@ -0,0 +1,108 @@
+"""
+Host only: the web server started after an update, on the same ESP-01,
+gets its requests: the updater leaves passive receive behind it, and the
+server sets active receive itself.
+
+    PYTHONPATH=host:. python host/test/update_serve.test.py
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import uasyncio as asyncio
+
+import machine
+from esp01 import http_file_server
+from make_index import manifest
+from components.esp.async_web_server import async_web_server
+from components.updater.backup_manager import BackupManager
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import new_updater, read_file, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REQUEST = b"GET /up HTTP/1.1\r\nHost: 192.168.1.50\r\n\r\n"
+REMOTE = {
+    "a.py": b"print('a')\n",
+    "version.json": b'{"version": 3}',
+}
+LOCAL = {
+    "a.py": b"print('old a')\n",
+    "version.json": b'{"version": 2}',
+}
+
+
+class UpdateServeTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    async def serve_once(self, esp, server):
+        link = esp.connect_client(REQUEST)
+        headers, body, conn_id = await server.receive_frame(2)
+        self.assert_equal(True, (headers or "").startswith("GET /up "))
+        self.assert_equal(link.link_id, conn_id)
+
+    def serve(self, esp):
+        # as main.py does, at the rate the updater left
+        server = async_web_server("test", "test-pass", 4, 5)
+        server.negotiate_baudrate()
+        self.assert_equal(True, server.start_web_server(80))
+        self.assert_equal(0, esp.recvmode)
+        asyncio.run(self.serve_once(esp, server))
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(root, REMOTE)
+        with open(os.path.join(root, "index.json"), "w") as file:
+            json.dump(manifest(root, list(REMOTE)), file)
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            # The version in the working directory is updated, then served
+            write_files(".", LOCAL)
+            instance = new_updater(
+                http_file_server(root),
+                backup_manager=BackupManager(
+                    main_dir="", backup_dir="backup", new_version_dir="new"
+                ),
+            )
+            esp = machine.UART(1).device
+            self.assert_equal(True, instance.start_update())
+            self.assert_equal(REMOTE["a.py"], read_file("a.py"))
+            self.assert_equal(0, esp.recvmode)
+            self.serve(esp)
+
+            # With nothing to update, the ESP is left in active mode too
+            instance = new_updater(http_file_server(root))
+            esp = machine.UART(1).device
+            self.assert_equal(False, instance.start_update())
+            self.assert_equal(0, esp.recvmode)
+
+            # The server sets active mode, whatever left the ESP passive
+            instance.esp_process.set_passive_receive()
+            self.assert_equal(1, esp.recvmode)
+            self.serve(esp)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = UpdateServeTestCase()
+test_case.run_tests()
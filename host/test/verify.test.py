@@ -0,0 +1,144 @@
+"""
+Host only: every file of an update is hashed as it is written and checked
+against index.json; one that differs is not installed, and the files are
+not read back to check them.
+
+    PYTHONPATH=host:. python host/test/verify.test.py
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from esp01 import http_file_server
+from make_index import BUNDLE_FILE, bundle, manifest
+from lib.logging import basicConfig, CRITICAL
+from update_helpers import installed, new_updater, write_files
+
+basicConfig(level=CRITICAL + 1)
+
+REMOTE = {
+    "a.py": b"print('a')\n" * 40,
+    "b.py": b"print('b')\n" * 40,
+    "big.bin": bytes(range(256)) * 8,
+    "version.json": b'{"version": 3}',
+}
+LOCAL = {
+    "a.py": b"print('old a')\n",
+    "version.json": b'{"version": 2}',
+}
+BAD = "b.py"
+
+
+def short_server(root, name):
+    """
+    http_file_server whose response for name is cut halfway, with a
+    Content-Length that says so: a body that looks whole.
+    """
+    serve = http_file_server(root)
+
+    def handler(request):
+        response = serve(request)
+        if ("/" + name + " ").encode() in request:
+            head, body = response.split(b"\r\n\r\n", 1)
+            body = body[: len(body) // 2]
+            head = head.replace(
+                "Content-Length: {}".format(len(body) * 2).encode(),
+                "Content-Length: {}".format(len(body)).encode(),
+            )
+            return head + b"\r\n\r\n" + body
+        return response
+
+    return handler
+
+
+def bundle_server(root, data):
+    serve = http_file_server(root)
+
+    def handler(request):
+        if ("/" + BUNDLE_FILE).encode() in request:
+            header = "HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n"
+            return header.format(len(data)).encode() + data
+        return serve(request)
+
+    return handler
+
+
+class VerifyTestCase:
+    def __init__(self):
+        self.tests_passed = 0
+        self.tests_failed = 0
+
+    def assert_equal(self, expected, actual):
+        if expected == actual:
+            self.tests_passed += 1
+        else:
+            self.tests_failed += 1
+            print(f"Test failed: expected {expected}, but got {actual}")
+
+    def local_updater(self, handler, links):
+        # an updater of the LOCAL version, nothing left of an earlier try
+        shutil.rmtree("main", ignore_errors=True)
+        shutil.rmtree("new", ignore_errors=True)
+        write_files("main", LOCAL)
+        return new_updater(handler, links)
+
+    def refused(self, instance, index):
+        # nothing of the update is installed, nor kept to resume from
+        self.assert_equal(False, instance.update_process(index))
+        self.assert_equal(LOCAL, installed())
+        self.assert_equal(False, os.path.exists("new/" + BAD))
+        self.assert_equal(True, instance.backup_manager.file_stats()["removed"] > 0)
+        with open("new/download.json") as file:
+            self.assert_equal(False, json.load(file)[BAD][1])
+
+    def run_tests(self):
+        root = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(root, REMOTE)
+        index = manifest(root, list(REMOTE))
+        # what the server has for BAD is not what the index says
+        tampered = tempfile.mkdtemp(prefix="pico_test_")
+        write_files(tampered, REMOTE)
+        write_files(tampered, {BAD: REMOTE[BAD].replace(b"b", b"c")})
+        cwd = os.getcwd()
+        scratch = tempfile.mkdtemp(prefix="pico_test_")
+        os.chdir(scratch)
+        try:
+            # A file that differs is refused, over one link or several
+            for links in (1, 3):
+                instance = self.local_updater(http_file_server(tampered), links)
+                self.refused(instance, index)
+
+            # So is a body cut short, though its length said it was whole
+            for links in (1, 3):
+                instance = self.local_updater(short_server(root, BAD), links)
+                self.refused(instance, index)
+
+            # A bundle entry that differs is dropped: its files come one by one
+            data = bundle(tampered, list(REMOTE))
+            instance = self.local_updater(bundle_server(root, data), 1)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(REMOTE, installed())
+
+            # An intact update is installed, and nothing was read to check it
+            instance = self.local_updater(http_file_server(root), 3)
+            for name in LOCAL:
+                os.remove("main/" + name)
+            self.assert_equal(True, instance.update_process(index))
+            self.assert_equal(REMOTE, installed())
+            self.assert_equal(0, instance.manifest_manager.hash_stats()["bytes"])
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(tampered, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        # Print the test results
+        print(f"Tests passed: {self.tests_passed}")
+        print(f"Tests failed: {self.tests_failed}")
+
+
+# Run the tests
+test_case = VerifyTestCase()
+test_case.run_tests()
@@ -0,0 +1,79 @@
+"""
+MicroPython ``uasyncio`` on top of CPython ``asyncio``.
+
+Everything comes from ``asyncio`` except the parts MicroPython adds or
+implements differently: ``sleep_ms``/``wait_for_ms`` and ``Stream``, which
+on the board wraps any object with the stream protocol (a ``machine.UART``)
+and waits for it through the poller. Here readiness is polled from
+``any()``, which the simulated UART keeps up to date with the wire time.
+"""
+
+import asyncio
+from asyncio import *  # noqa: F401,F403
+
+POLL_INTERVAL = 0.0002
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(awaitable, timeout):
+    return await asyncio.wait_for(awaitable, timeout / 1000)
+
+
+class Stream:
+    def __init__(self, s, e={}):
+        self.s = s
+        self.e = e
+        self.out_buf = b""
+
+    def get_extra_info(self, v):
+        return self.e[v]
+
+    async def _wait_readable(self):
+        while not self.s.any():
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def read(self, n=-1):
+        await self._wait_readable()
+        available = self.s.any()
+        if n < 0 or n > available:
+            n = available
+        return self.s.read(n)
+
+    async def readinto(self, buf):
+        await self._wait_readable()
+        return self.s.readinto(buf, min(len(buf), self.s.any()))
+
+    async def readexactly(self, n):
+        data = b""
+        while len(data) < n:
+            data += await self.read(n - len(data))
+        return data
+
+    async def readline(self):
+        line = b""
+        while not line.endswith(b"\n"):
+            line += await self.read(1)
+        return line
+
+    def write(self, buf):
+        self.out_buf += bytes(buf)
+
+    async def drain(self):
+        data = self.out_buf
+        self.out_buf = b""
+        if data:
+            self.s.write(data)
+        await asyncio.sleep(0)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+StreamReader = Stream
+StreamWriter = Stream
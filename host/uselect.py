@@ -0,0 +1,70 @@
+"""
+MicroPython ``uselect`` for the host.
+
+``poll`` accepts the simulated UART, which has no file descriptor:
+readiness comes from ``any()``, and the emulator knows when the next byte
+is due, so a wait sleeps until then instead of spinning.
+"""
+
+import time
+from select import POLLERR, POLLHUP, POLLIN, POLLOUT, select  # noqa: F401
+
+FALLBACK_INTERVAL = 0.001
+
+
+class _poll:
+    def __init__(self):
+        self._objects = {}
+
+    def register(self, obj, eventmask=POLLIN | POLLOUT):
+        self._objects[obj] = eventmask
+
+    def modify(self, obj, eventmask):
+        self._objects[obj] = eventmask
+
+    def unregister(self, obj):
+        self._objects.pop(obj, None)
+
+    def _ready(self):
+        ready = []
+        for obj, eventmask in self._objects.items():
+            events = eventmask & POLLOUT
+            if eventmask & POLLIN and obj.any():
+                events |= POLLIN
+            if events:
+                ready.append((obj, events))
+        return ready
+
+    def poll(self, timeout=-1):
+        deadline = None
+        if timeout >= 0:
+            deadline = time.perf_counter() + timeout / 1000
+        while True:
+            ready = self._ready()
+            if ready:
+                return ready
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                return []
+            wake = now + FALLBACK_INTERVAL
+            arrivals = [
+                obj.next_arrival()
+                for obj in self._objects
+                if hasattr(obj, "next_arrival")
+            ]
+            arrivals = [arrival for arrival in arrivals if arrival is not None]
+            if arrivals:
+                wake = min(arrivals)
+            elif deadline is not None:
+                wake = deadline
+            if deadline is not None:
+                wake = min(wake, deadline)
+            if wake > now:
+                time.sleep(wake - now)
+
+    def ipoll(self, timeout=-1, flags=0):
+        return iter(self.poll(timeout))
+
+
+def poll():
+    return _poll()
@@ -1,4 +1,5 @@
 import sys
+import uasyncio as asyncio
 from machine import Pin
 from components import motor_control, led_control, button_control, webserver
 from lib.logging import getLogger, handlers, basicConfig, INFO, StreamHandler
@@ -74,31 +75,39 @@ up_button.on_released = on_released
 down_button.on_pressed = on_down_pressed
 down_button.on_released = on_released
 
-triggered_message = False
-last_time = None
-try:
-    logger_main.info("Start Webserver Loop")
-    web_server.start_web_server_thread()
-    logger_main.info("Start Main Loop")
+
+async def poll_buttons(interval_ms=10):
     while True:
         if interrupt.value():
             raise KeyboardInterrupt("interrupt pin")
         button_handler.check_buttons()
+        await asyncio.sleep_ms(interval_ms)
+
+
+async def motor_watchdog(interval_ms=100):
+    last_time = None
+    while True:
         running_time = motor_control_instance.get_running_time()
         if running_time > 15 * 1000:
             logger_main.debug("Motor run timeout")
             on_released()
-        # if web_server.is_web_server_thread_running():
         last_request, last_request_time = web_server.get_last_request()
         if last_request != "" and last_request_time != last_time:
             last_time = last_request_time
             logger_main.info("Last request" + last_request)
-        # else:
-        #     if not triggered_message:
-        #         log_message("Web server thread is not running.")
-        #         triggered_message = True
-        #     # sys.exit()
+        await asyncio.sleep_ms(interval_ms)
 
+
+async def main():
+    logger_main.info("Start Webserver Loop")
+    web_server.start_web_server_task()
+    logger_main.info("Start Main Loop")
+    asyncio.create_task(motor_watchdog())
+    await poll_buttons()
+
+
+try:
+    asyncio.run(main())
 except KeyboardInterrupt as e:
     logger_main.exception(str(e))
     sys.exit()